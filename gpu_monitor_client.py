@@ -5,166 +5,2357 @@ GPU监控客户端 - 收集本地GPU信息并发送到服务端
 """
 
 import subprocess
+import bisect
+import ctypes
+import http.server
+import io
 import json
+import mmap
+import os
+import struct
+import sys
 import requests
 import time
 import socket
 import argparse
+import math
+import queue
+import random
+import socketserver
+import threading
 from datetime import datetime
 import xml.etree.ElementTree as ET
+from gpu_monitor_protocol import (BATCH_PATH, BINARY_CONTENT_TYPE, REGISTER_PATH, SCHEMA_VERSION, build_batch_body,
+                                  compress_body, encode_binary_sample, legacy_sample, make_delta, normalize_gpu,
+                                  parse_number, split_static, zstandard)
+
+# 流式采集使用的查询字段（name 放在最后，避免型号中的逗号影响切分）
+STREAM_QUERY_FIELDS = [
+    'index', 'uuid', 'temperature.gpu', 'utilization.gpu',
+    'memory.used', 'memory.total', 'power.draw', 'power.limit', 'pci.bus_id', 'driver_version', 'name',
+]
+# 流式采集的进程列表最长刷新间隔（秒）
+STREAM_PROCESS_REFRESH = 30
+# 每个补传批次最多包含的样本数
+SPOOL_BATCH_SIZE = 200
+# 逐条补传时这些 4xx 状态码表示稍后可以重试（其余 4xx 表示样本被拒绝，丢弃）
+RETRYABLE_STATUS = (404, 408, 409, 429)
+MIB = 1024 * 1024
+VIRTUAL_DISK_PREFIXES = ('loop', 'ram', 'zram', 'dm-', 'md', 'sr')
+# 窗口聚合：上报间隔内高频采样，每个指标上报 min/max/mean/p95
+AGGREGATE_FIELDS = ['temperature', 'utilization', 'memory_used', 'memory_percent', 'power_draw']
+# 自适应采样：服务端超过60秒未收到数据会标记离线，最长间隔不能超过这个心跳上限
+HEARTBEAT_LIMIT = 50
+# 客户端自身各阶段耗时直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
 
 def get_hostname():
     """获取主机名"""
     return socket.gethostname()
 
-def parse_gpu_info():
-    """使用nvidia-smi获取GPU信息"""
+# XML字段提取表: (字段名, 指标组, nvidia-smi -d 段名, 相对<gpu>的候选路径, 默认值)
+# 同一字段的多个候选路径用于兼容不同版本驱动的XML结构；
+# 除 XML_TEXT_FIELDS 外均转换为数值（去掉 C、%、MiB、W、MHz 等单位），缺失为 None
+XML_FIELDS = [
+    ('name', 'static', None, ['product_name'], 'Unknown'),
+    ('uuid', 'static', None, ['uuid'], None),
+    ('pci_bus_id', 'static', None, ['pci/pci_bus_id'], None),
+    ('driver_version', 'static', None, [], None),  # 在 <gpu> 之外，由 extract() 单独读取
+    ('temperature', 'basic', 'TEMPERATURE', ['temperature/gpu_temp'], None),
+    ('utilization', 'basic', 'UTILIZATION', ['utilization/gpu_util'], None),
+    ('memory_used', 'basic', 'MEMORY', ['fb_memory_usage/used'], None),
+    ('memory_total', 'basic', 'MEMORY', ['fb_memory_usage/total'], None),
+    ('power_draw', 'basic', 'POWER', ['power_readings/power_draw',
+                                      'gpu_power_readings/power_draw',
+                                      'gpu_power_readings/instant_power_draw'], None),
+    ('power_limit', 'basic', 'POWER', ['power_readings/power_limit',
+                                       'gpu_power_readings/current_power_limit'], None),
+    ('clock_graphics', 'clocks', 'CLOCK', ['clocks/graphics_clock'], None),
+    ('clock_sm', 'clocks', 'CLOCK', ['clocks/sm_clock'], None),
+    ('clock_memory', 'clocks', 'CLOCK', ['clocks/mem_clock'], None),
+    ('pcie_tx', 'pcie', None, ['pci/tx_util'], None),
+    ('pcie_rx', 'pcie', None, ['pci/rx_util'], None),
+    ('ecc_mode', 'ecc', 'ECC', ['ecc_mode/current_ecc'], None),
+    ('ecc_corrected', 'ecc', 'ECC', ['ecc_errors/volatile/single_bit/total',
+                                     'ecc_errors/volatile/sram_correctable'], None),
+    ('ecc_uncorrected', 'ecc', 'ECC', ['ecc_errors/volatile/double_bit/total',
+                                       'ecc_errors/volatile/sram_uncorrectable'], None),
+]
+# 进程字段（相对 <processes>/<process_info>）
+XML_PROCESS_FIELDS = [
+    ('pid', 'pid', None),
+    ('name', 'process_name', 'Unknown'),
+    ('memory', 'used_memory', None),
+]
+# 降频原因：收集值为 Active 的子元素名称
+XML_THROTTLE_PARENTS = ['clocks_throttle_reasons', 'clocks_event_reasons']
+# 保持文本的字段
+XML_TEXT_FIELDS = {'name', 'uuid', 'pci_bus_id', 'driver_version', 'ecc_mode'}
+# 可通过 --metrics 启用的附加指标组
+OPTIONAL_METRICS = ['clocks', 'pcie', 'ecc', 'throttle']
+
+class XmlFieldPlan:
+    """编译好的XML字段提取计划
+
+    把需要的指标一次性编译成 {相对路径元组: 字段名} 的查找表，
+    解析时只需单次遍历XML，并据此缩小 nvidia-smi -d 输出的段。
+    """
+
+    def __init__(self, metrics=()):
+        unknown = set(metrics) - set(OPTIONAL_METRICS)
+        if unknown:
+            raise ValueError(f"未知的指标组: {', '.join(sorted(unknown))}")
+        groups = {'static', 'basic'} | set(metrics)
+        self.fields = {}
+        self.defaults = {}
+        self.static_fields = []
+        sections = {'PIDS'}
+        narrowable = True
+        for field, group, section, paths, default in XML_FIELDS:
+            if group not in groups:
+                continue
+            for path in paths:
+                self.fields[tuple(path.split('/'))] = field
+            self.defaults[field] = default
+            if group == 'static':
+                self.static_fields.append(field)
+            elif section is None:
+                narrowable = False  # 没有对应的 -d 段，只能取完整输出
+            else:
+                sections.add(section)
+        self.process_fields = {('processes', 'process_info', tag): (field, default)
+                               for field, tag, default in XML_PROCESS_FIELDS}
+        self.throttle_parents = set()
+        if 'throttle' in groups:
+            self.throttle_parents = {(tag,) for tag in XML_THROTTLE_PARENTS}
+            self.defaults['throttle_reasons'] = []
+            sections.add('PERFORMANCE')
+        self.sections = sorted(sections) if narrowable else None
+
+    def command(self, nvidia_smi, narrow=True):
+        cmd = [nvidia_smi, '-q', '-x']
+        if narrow and self.sections:
+            cmd += ['-d', ','.join(self.sections)]
+        return cmd
+
+    def extract(self, stream):
+        """单次遍历XML流，返回 [(gpu的id属性, 字段字典), ...]"""
+        gpus = []
+        path = []
+        gpu = None
+        process = None
+        driver_version = None
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem.tag)
+                if len(path) == 2 and elem.tag == 'gpu':
+                    gpu = {'processes': []}
+                    if driver_version:
+                        gpu['driver_version'] = driver_version
+                    gpus.append((elem.get('id'), gpu))
+                elif gpu is not None and len(path) == 4 and elem.tag == 'process_info':
+                    process = {}
+                    gpu['processes'].append(process)
+                continue
+            key = tuple(path[2:])
+            path.pop()
+            if gpu is None:
+                if len(path) == 1 and elem.tag == 'driver_version':
+                    driver_version = (elem.text or '').strip() or None
+                continue
+            field = self.fields.get(key)
+            if field is not None:
+                text = (elem.text or '').strip()
+                if text and (field not in gpu or gpu[field] == 'N/A'):
+                    gpu[field] = text
+            elif key in self.process_fields and process is not None:
+                field, _ = self.process_fields[key]
+                process[field] = (elem.text or '').strip()
+            elif key[:-1] in self.throttle_parents:
+                if (elem.text or '').strip() == 'Active':
+                    gpu.setdefault('throttle_reasons', []).append(key[-1])
+            if len(path) == 1:
+                gpu = None
+            # 已处理的子树立即释放
+            if len(path) <= 2:
+                elem.clear()
+        return gpus
+
+    def finish(self, index, fields):
+        """补齐默认值并生成带类型的GPU信息字典（数值字段为数字，缺失为 None）"""
+        gpu_info = {'index': index}
+        for field, default in self.defaults.items():
+            value = fields.get(field, default)
+            if field not in XML_TEXT_FIELDS and isinstance(value, str):
+                value = parse_number(value)
+            gpu_info[field] = value
+        gpu_info['processes'] = [
+            {
+                'pid': _parse_int(process.get('pid')),
+                'name': process.get('name') or 'Unknown',
+                'memory': parse_number(process.get('memory')),
+            }
+            for process in fields.get('processes', [])
+        ]
+        gpu_info['memory_percent'] = _percent(gpu_info['memory_used'], gpu_info['memory_total'])
+        return gpu_info
+
+DEFAULT_XML_PLAN = XmlFieldPlan()
+
+class _TeeReader:
+    """读取管道时保留一份原始输出（--record 使用）"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.chunks = []
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.chunks.append(data)
+        return data
+
+def build_xml_gpus(plan, extracted, static_cache=None):
+    """把 XmlFieldPlan.extract() 的结果整理为GPU信息列表，并维护静态字段缓存"""
+    narrow = static_cache is not None and bool(static_cache)
+    gpus = []
+    for i, (gpu_id, fields) in enumerate(extracted):
+        if static_cache is not None:
+            cached = static_cache.get(gpu_id)
+            if cached is None:
+                if narrow:
+                    # 出现新的GPU，下次重新做一次完整查询
+                    static_cache.clear()
+            else:
+                for field in plan.static_fields:
+                    fields.setdefault(field, cached[field])
+            if 'name' in fields:
+                static_cache[gpu_id] = {field: fields.get(field, plan.defaults[field])
+                                        for field in plan.static_fields}
+        gpus.append(plan.finish(i, fields))
+    return gpus
+
+def parse_gpu_info(nvidia_smi='nvidia-smi', plan=None, static_cache=None, recorder=None, timings=None):
+    """使用nvidia-smi获取GPU信息
+
+    plan 为编译好的 XmlFieldPlan；传入 static_cache 字典时，型号、UUID 等静态字段
+    只在首次（或出现新GPU时）通过完整查询获取，之后只请求 -d 指定的段。
+    传入 recorder 时把 nvidia-smi 的原始XML输出写入记录文件；传入 timings 字典时填入
+    smi（nvidia-smi 进程从启动到退出的时间）和 parse（解析消耗的CPU时间，边读管道边解析）。
+    """
+    plan = plan or DEFAULT_XML_PLAN
+    narrow = static_cache is not None and bool(static_cache)
+    proc = None
     try:
-        # 使用XML格式获取详细信息
-        cmd = ['nvidia-smi', '-q', '-x']
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        # 使用XML格式获取详细信息，直接从管道流式解析
+        started = time.perf_counter()
+        proc = subprocess.Popen(plan.command(nvidia_smi, narrow), stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        parse_started = time.thread_time()
+        timed_out = threading.Event()
         
-        if result.returncode != 0:
-            print(f"错误: nvidia-smi命令执行失败")
-            return None
+        def kill_on_timeout():
+            timed_out.set()
+            proc.kill()
         
-        # 解析XML
-        root = ET.fromstring(result.stdout)
-        gpus = []
+        timer = threading.Timer(10, kill_on_timeout)
+        timer.start()
+        stream = proc.stdout if recorder is None else _TeeReader(proc.stdout)
+        try:
+            extracted = plan.extract(stream)
+        except ET.ParseError:
+            extracted = None
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+            returncode = proc.wait()
+            if timings is not None:
+                timings['smi'] = time.perf_counter() - started
         
-        for i, gpu in enumerate(root.findall('gpu')):
-            gpu_info = {
-                'index': i,
-                'name': gpu.find('product_name').text if gpu.find('product_name') is not None else 'Unknown',
-                'temperature': gpu.find('.//temperature/gpu_temp').text.replace(' C', '') if gpu.find('.//temperature/gpu_temp') is not None else 'N/A',
-                'utilization': gpu.find('.//utilization/gpu_util').text.replace(' %', '') if gpu.find('.//utilization/gpu_util') is not None else '0',
-                'memory_used': gpu.find('.//fb_memory_usage/used').text if gpu.find('.//fb_memory_usage/used') is not None else 'N/A',
-                'memory_total': gpu.find('.//fb_memory_usage/total').text if gpu.find('.//fb_memory_usage/total') is not None else 'N/A',
-                'power_draw': gpu.find('.//power_readings/power_draw').text if gpu.find('.//power_readings/power_draw') is not None else 'N/A',
-                'power_limit': gpu.find('.//power_readings/power_limit').text if gpu.find('.//power_readings/power_limit') is not None else 'N/A',
-                'processes': []
-            }
-            
-            # 计算显存使用百分比
-            try:
-                memory_used = float(gpu.find('.//fb_memory_usage/used').text.split()[0])
-                memory_total = float(gpu.find('.//fb_memory_usage/total').text.split()[0])
-                gpu_info['memory_percent'] = f"{(memory_used / memory_total * 100):.1f}"
-            except:
-                gpu_info['memory_percent'] = '0'
-            
-            # 获取进程信息
-            processes = gpu.find('.//processes')
-            if processes is not None:
-                for process in processes.findall('process_info'):
-                    proc_info = {
-                        'pid': process.find('pid').text if process.find('pid') is not None else 'N/A',
-                        'name': process.find('process_name').text if process.find('process_name') is not None else 'Unknown',
-                        'memory': process.find('used_memory').text if process.find('used_memory') is not None else 'N/A'
-                    }
-                    gpu_info['processes'].append(proc_info)
-            
-            gpus.append(gpu_info)
+        if timed_out.is_set():
+            print("错误: nvidia-smi命令超时")
+            return None
+        if returncode != 0 or extracted is None:
+            print(f"错误: nvidia-smi命令执行失败")
+            return None
+        if recorder is not None:
+            recorder.write('xml', b''.join(stream.chunks).decode('utf-8', 'replace'))
         
+        gpus = build_xml_gpus(plan, extracted, static_cache)
+        if timings is not None:
+            timings['parse'] = time.thread_time() - parse_started
         return gpus
     
-    except subprocess.TimeoutExpired:
-        print("错误: nvidia-smi命令超时")
-        return None
     except FileNotFoundError:
         print("错误: 未找到nvidia-smi命令，请确保已安装NVIDIA驱动")
         return None
     except Exception as e:
+        if proc is not None and proc.poll() is None:
+            proc.kill()
         print(f"错误: 解析GPU信息失败 - {str(e)}")
         return None
 
-def send_data_to_server(server_url, server_name, gpu_data):
-    """发送GPU数据到服务端"""
+def parse_stream_line(line):
+    """解析 nvidia-smi --query-gpu 的一行CSV输出，格式不对时返回 None"""
+    fields = [f.strip() for f in line.strip().split(',', len(STREAM_QUERY_FIELDS) - 1)]
+    if len(fields) != len(STREAM_QUERY_FIELDS):
+        return None
+    row = dict(zip(STREAM_QUERY_FIELDS, fields))
     try:
-        payload = {
-            'server_name': server_name,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'gpus': gpu_data
+        index = int(row['index'])
+    except ValueError:
+        return None
+    gpu_info = {
+        'index': index,
+        'uuid': row['uuid'],
+        'name': row['name'] or 'Unknown',
+        'temperature': _csv_value(row['temperature.gpu']),
+        'utilization': _csv_value(row['utilization.gpu']),
+        'memory_used': _csv_value(row['memory.used']),
+        'memory_total': _csv_value(row['memory.total']),
+        'power_draw': _csv_value(row['power.draw']),
+        'power_limit': _csv_value(row['power.limit']),
+        'pci_bus_id': row['pci.bus_id'] or None,
+        'driver_version': row['driver_version'] or None,
+    }
+    gpu_info['memory_percent'] = _percent(gpu_info['memory_used'], gpu_info['memory_total'])
+    return gpu_info
+
+def parse_compute_apps(output):
+    """解析 nvidia-smi --query-compute-apps 的CSV输出，返回 {gpu_uuid: [进程, ...]}"""
+    processes = {}
+    for line in output.splitlines():
+        fields = [f.strip() for f in line.split(',', 3)]
+        if len(fields) != 4:
+            continue
+        gpu_uuid, pid, used_memory, name = fields
+        processes.setdefault(gpu_uuid, []).append({
+            'pid': _parse_int(pid),
+            'name': name or 'Unknown',
+            'memory': _csv_value(used_memory),
+        })
+    return processes
+
+def _csv_value(value):
+    """把 nounits CSV 字段转换为数值，'N/A'、'[Not Supported]' 等返回 None"""
+    value = value.strip()
+    if not value or value.startswith('[') or value == 'N/A':
+        return None
+    return parse_number(value)
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _percent(used, total):
+    """显存占用百分比（保留一位小数），无法计算时返回 None"""
+    if used is None or not total:
+        return None
+    return round(used / total * 100, 1)
+
+class Collector:
+    """GPU信息采集器接口
+
+    collect() 返回 GPU 信息列表（格式同 parse_gpu_info()），失败时返回 None；
+    close() 释放子进程、库句柄等资源。设置 recorder 后把读到的原始输出写入记录文件。
+    每次 collect() 后 last_timings 为该次采集的分阶段耗时（秒）：smi=等待 nvidia-smi 的时间，parse=解析耗时。
+    """
+
+    name = 'base'
+    recorder = None
+    last_timings = {}
+
+    def collect(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SmiXmlCollector(Collector):
+    """每次采样调用一次 nvidia-smi -q -x，按编译好的字段计划单次遍历解析"""
+
+    name = 'xml'
+
+    def __init__(self, nvidia_smi='nvidia-smi', metrics=()):
+        self.nvidia_smi = nvidia_smi
+        self.plan = XmlFieldPlan(metrics) if metrics else DEFAULT_XML_PLAN
+        self.static_cache = {}
+
+    def collect(self):
+        self.last_timings = {}
+        return parse_gpu_info(self.nvidia_smi, self.plan, self.static_cache, self.recorder, self.last_timings)
+
+class SmiStreamCollector(Collector):
+    """常驻 nvidia-smi -lms 子进程，按行流式解析CSV输出
+
+    子进程退出或超过 hang_timeout 秒没有输出时，下一次 collect() 会自动重启它。
+    进程列表仍通过一次性的 --query-compute-apps 获取，但只在显存占用变化
+    或距上次刷新超过 STREAM_PROCESS_REFRESH 秒时才执行。
+    """
+
+    name = 'stream'
+
+    def __init__(self, interval, nvidia_smi='nvidia-smi', hang_timeout=None):
+        self.interval = interval
+        self.nvidia_smi = nvidia_smi
+        self.hang_timeout = hang_timeout or max(3 * interval, 10)
+        self.restarts = 0
+        self._proc = None
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._latest = None
+        self._latest_time = 0
+        self._latest_parse_time = None
+        self._last_line_time = 0
+        self._processes = {}
+        self._process_key = None
+        self._process_time = 0
+
+    def _command(self):
+        return [
+            self.nvidia_smi,
+            f"--query-gpu={','.join(STREAM_QUERY_FIELDS)}",
+            '--format=csv,noheader,nounits',
+            f"-lms={int(self.interval * 1000)}",
+        ]
+
+    def _start(self):
+        """启动（或重启）nvidia-smi子进程和读取线程"""
+        self._stop_process()
+        self._frame_ready.clear()
+        proc = subprocess.Popen(
+            self._command(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1
+        )
+        with self._lock:
+            self._proc = proc
+            self._last_line_time = time.monotonic()
+        reader = threading.Thread(target=self._read_stream, args=(proc,), daemon=True)
+        reader.start()
+
+    def _stop_process(self):
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.poll() is None:
+            proc.kill()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def _read_stream(self, proc):
+        """读取子进程输出；索引回绕时说明上一帧已完整"""
+        frame = []
+        lines = []
+        last_index = -1
+        parse_time = 0.0
+        for line in proc.stdout:
+            started = time.perf_counter()
+            gpu = parse_stream_line(line)
+            if gpu is None:
+                continue
+            if gpu['index'] <= last_index and frame:
+                self._publish(proc, frame, lines, parse_time)
+                frame = []
+                lines = []
+                parse_time = 0.0
+            parse_time += time.perf_counter() - started
+            frame.append(gpu)
+            lines.append(line)
+            last_index = gpu['index']
+            with self._lock:
+                if proc is not self._proc:
+                    return
+                self._last_line_time = time.monotonic()
+                expected = len(self._latest) if self._latest else None
+            if expected is not None and len(frame) == expected:
+                # GPU数量已知时不必等到下一帧开头才发布
+                self._publish(proc, frame, lines, parse_time)
+                frame = []
+                lines = []
+                parse_time = 0.0
+                last_index = -1
+
+    def _publish(self, proc, frame, lines, parse_time):
+        with self._lock:
+            if proc is not self._proc:
+                return
+            self._latest = frame
+            self._latest_time = time.monotonic()
+            self._latest_parse_time = parse_time
+        self._frame_ready.set()
+        if self.recorder is not None:
+            self.recorder.write('csv', ''.join(lines))
+
+    def _refresh_processes(self, frame):
+        """显存占用变化或超过刷新间隔时重新查询进程列表"""
+        key = tuple(gpu['memory_used'] for gpu in frame)
+        now = time.monotonic()
+        if key == self._process_key and now - self._process_time < STREAM_PROCESS_REFRESH:
+            return
+        cmd = [
+            self.nvidia_smi,
+            '--query-compute-apps=gpu_uuid,pid,used_memory,process_name',
+            '--format=csv,noheader,nounits',
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        except (subprocess.TimeoutExpired, OSError):
+            return
+        if result.returncode != 0:
+            return
+        if self.recorder is not None:
+            self.recorder.write('apps', result.stdout)
+        self._processes = parse_compute_apps(result.stdout)
+        self._process_key = key
+        self._process_time = now
+
+    def collect(self):
+        """返回最新一帧GPU信息，格式与 parse_gpu_info() 相同"""
+        try:
+            with self._lock:
+                proc = self._proc
+                hung = time.monotonic() - self._last_line_time > self.hang_timeout
+            if proc is None or proc.poll() is not None or hung:
+                if proc is not None:
+                    self.restarts += 1
+                    print(f"⚠️  nvidia-smi 流式进程{'无响应' if hung else '已退出'}，正在重启 (第{self.restarts}次)")
+                self._start()
+            if not self._frame_ready.wait(timeout=self.hang_timeout):
+                print("错误: 等待nvidia-smi输出超时")
+                return None
+        except FileNotFoundError:
+            print("错误: 未找到nvidia-smi命令，请确保已安装NVIDIA驱动")
+            return None
+        with self._lock:
+            frame = self._latest
+            age = time.monotonic() - self._latest_time
+            stale = age > self.hang_timeout
+            # smi 为最新一帧距今的时间，nvidia-smi 卡住时会持续增大
+            self.last_timings = {'smi': age, 'parse': self._latest_parse_time}
+        if not frame or stale:
+            return None
+        self._refresh_processes(frame)
+        # 进程列表在两次刷新之间被多个样本共用，每个样本复制一份，之后合并 pmon 使用率、
+        # 补充进程信息时不会改到之前的样本（包括增量编码器保存的已确认基准）
+        gpus = []
+        for gpu in frame:
+            gpu_info = dict(gpu)
+            gpu_info['processes'] = [dict(process) for process in self._processes.get(gpu['uuid'], [])]
+            gpus.append(gpu_info)
+        return gpus
+
+    def close(self):
+        self._stop_process()
+
+class PmonMonitor:
+    """常驻 nvidia-smi pmon -s u 子进程，记录每个进程的 SM 和显存带宽使用率
+
+    不是独立的采集方式，而是把 sm_util/mem_util（%）合并到任意采集方式得到的
+    processes 列表中。列按表头解析，兼容带 jpg/ofa 列的新版驱动；
+    进程在采样周期内没有活动时 pmon 输出 '-'，记为 0。
+    子进程退出或卡死时和流式采集一样自动重启。
+    """
+
+    def __init__(self, nvidia_smi='nvidia-smi', delay=1):
+        self.nvidia_smi = nvidia_smi
+        self.delay = max(1, min(10, int(delay)))  # pmon 只接受1-10秒
+        self.max_age = max(3 * self.delay, 10)
+        self.restarts = 0
+        self._proc = None
+        self._lock = threading.Lock()
+        self._usage = {}  # {(gpu序号, pid): (sm, mem, 时间)}
+        self._last_line_time = 0
+
+    def _start(self):
+        self._stop_process()
+        proc = subprocess.Popen(
+            [self.nvidia_smi, 'pmon', '-s', 'u', '-d', str(self.delay)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+        )
+        with self._lock:
+            self._proc = proc
+            self._last_line_time = time.monotonic()
+        threading.Thread(target=self._read_stream, args=(proc,), daemon=True).start()
+
+    def _stop_process(self):
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.poll() is None:
+            proc.kill()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+
+    @staticmethod
+    def _percent(value):
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+
+    def _read_stream(self, proc):
+        columns = None
+        for line in proc.stdout:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == '#':
+                # 第一行表头是列名（gpu pid type sm mem ...），第二行是单位
+                if columns is None or fields[1] == 'gpu':
+                    columns = {name: i for i, name in enumerate(fields[1:])}
+                continue
+            with self._lock:
+                if proc is not self._proc:
+                    return
+                self._last_line_time = time.monotonic()
+            if columns is None or len(fields) < len(columns):
+                continue
+            try:
+                key = (int(fields[columns['gpu']]), int(fields[columns['pid']]))
+            except (KeyError, ValueError):
+                continue  # 没有进程的GPU输出 pid 为 '-'
+            usage = (self._percent(fields[columns['sm']]), self._percent(fields[columns['mem']]), time.monotonic())
+            with self._lock:
+                self._usage[key] = usage
+
+    def merge(self, gpus):
+        """把最近一个周期的进程使用率合并到 gpus 的 processes 中（原地修改）"""
+        try:
+            with self._lock:
+                proc = self._proc
+                hung = time.monotonic() - self._last_line_time > self.max_age
+            if proc is None or proc.poll() is not None or hung:
+                if proc is not None:
+                    self.restarts += 1
+                    print(f"⚠️  nvidia-smi pmon 进程{'无响应' if hung else '已退出'}，正在重启 (第{self.restarts}次)")
+                self._start()
+        except FileNotFoundError:
+            print("错误: 未找到nvidia-smi命令，无法采集进程使用率")
+            return gpus
+        now = time.monotonic()
+        with self._lock:
+            # 顺便清理已退出进程的记录
+            self._usage = {key: usage for key, usage in self._usage.items() if now - usage[2] <= self.max_age}
+            usage = dict(self._usage)
+        for gpu in gpus:
+            try:
+                index = int(gpu.get('index'))
+            except (TypeError, ValueError):
+                continue
+            for process in gpu.get('processes', []):
+                try:
+                    found = usage.get((index, int(process.get('pid'))))
+                except (TypeError, ValueError):
+                    continue
+                if found is not None:
+                    process['sm_util'], process['mem_util'] = found[0], found[1]
+        return gpus
+
+    def close(self):
+        self._stop_process()
+
+# NVML 常量
+NVML_SUCCESS = 0
+NVML_ERROR_NOT_SUPPORTED = 3
+NVML_ERROR_INSUFFICIENT_SIZE = 7
+NVML_TEMPERATURE_GPU = 0
+NVML_VALUE_NOT_AVAILABLE = ctypes.c_ulonglong(-1).value
+
+class NvmlError(Exception):
+    """NVML调用返回非成功状态码"""
+
+    def __init__(self, func, code):
+        super().__init__(f"{func} 返回错误码 {code}")
+        self.code = code
+
+class NvmlMemory(ctypes.Structure):
+    _fields_ = [
+        ('total', ctypes.c_ulonglong),
+        ('free', ctypes.c_ulonglong),
+        ('used', ctypes.c_ulonglong),
+    ]
+
+class NvmlUtilization(ctypes.Structure):
+    _fields_ = [
+        ('gpu', ctypes.c_uint),
+        ('memory', ctypes.c_uint),
+    ]
+
+class NvmlProcessInfo(ctypes.Structure):
+    _fields_ = [
+        ('pid', ctypes.c_uint),
+        ('usedGpuMemory', ctypes.c_ulonglong),
+        ('gpuInstanceId', ctypes.c_uint),
+        ('computeInstanceId', ctypes.c_uint),
+    ]
+
+class NvmlPciInfo(ctypes.Structure):
+    _fields_ = [
+        ('busIdLegacy', ctypes.c_char * 16),
+        ('domain', ctypes.c_uint),
+        ('bus', ctypes.c_uint),
+        ('device', ctypes.c_uint),
+        ('pciDeviceId', ctypes.c_uint),
+        ('pciSubSystemId', ctypes.c_uint),
+        ('busId', ctypes.c_char * 32),
+    ]
+
+class NvmlProcessInfoV1(ctypes.Structure):
+    _fields_ = [
+        ('pid', ctypes.c_uint),
+        ('usedGpuMemory', ctypes.c_ulonglong),
+    ]
+
+def load_nvml(lib_path=None):
+    """加载 libnvidia-ml；lib_path 为 'mock' 时加载纯Python模拟库"""
+    if lib_path == 'mock':
+        from gpu_monitor_nvml_mock import MockNvml
+        return MockNvml()
+    return ctypes.CDLL(lib_path or 'libnvidia-ml.so.1')
+
+class NvmlCollector(Collector):
+    """通过 ctypes 直接调用 NVML 采集，不启动子进程也不解析XML
+
+    设备句柄、型号、UUID 在初始化时获取一次并在之后的采样中复用。
+    """
+
+    name = 'nvml'
+
+    def __init__(self, lib_path=None):
+        self._lib = load_nvml(lib_path)
+        self._call('nvmlInit_v2')
+        try:
+            self._get_processes = self._resolve_process_query()
+            count = ctypes.c_uint()
+            self._call('nvmlDeviceGetCount_v2', ctypes.byref(count))
+            driver_version = self._get_system_string('nvmlSystemGetDriverVersion', 80)
+            self._devices = []
+            for i in range(count.value):
+                handle = ctypes.c_void_p()
+                self._call('nvmlDeviceGetHandleByIndex_v2', ctypes.c_uint(i), ctypes.byref(handle))
+                self._devices.append({
+                    'index': i,
+                    'handle': handle,
+                    'name': self._get_string('nvmlDeviceGetName', handle, 96) or 'Unknown',
+                    'uuid': self._get_string('nvmlDeviceGetUUID', handle, 80),
+                    'pci_bus_id': self._get_pci_bus_id(handle),
+                    'driver_version': driver_version,
+                })
+        except Exception:
+            self._lib.nvmlShutdown()
+            raise
+        self._process_names = {}
+        # 复用的输出缓冲区
+        self._uint = ctypes.c_uint()
+        self._memory = NvmlMemory()
+        self._utilization = NvmlUtilization()
+        self._process_buffer = (self._process_struct * 64)()
+
+    def _call(self, func, *args):
+        code = getattr(self._lib, func)(*args)
+        if code != NVML_SUCCESS:
+            raise NvmlError(func, code)
+
+    def _get_string(self, func, handle, size):
+        buffer = ctypes.create_string_buffer(size)
+        try:
+            self._call(func, handle, buffer, ctypes.c_uint(size))
+        except NvmlError:
+            return None
+        return buffer.value.decode('utf-8', 'replace')
+
+    def _get_system_string(self, func, size):
+        buffer = ctypes.create_string_buffer(size)
+        try:
+            self._call(func, buffer, ctypes.c_uint(size))
+        except (NvmlError, AttributeError):
+            return None
+        return buffer.value.decode('utf-8', 'replace')
+
+    def _get_pci_bus_id(self, handle):
+        pci = NvmlPciInfo()
+        try:
+            self._call('nvmlDeviceGetPciInfo_v3', handle, ctypes.byref(pci))
+        except (NvmlError, AttributeError):
+            return None
+        return pci.busId.decode('utf-8', 'replace') or None
+
+    def _resolve_process_query(self):
+        """选择驱动支持的进程查询接口（新驱动的 _v3/_v2 结构体更大）"""
+        for func in ('nvmlDeviceGetComputeRunningProcesses_v3',
+                     'nvmlDeviceGetComputeRunningProcesses_v2'):
+            if hasattr(self._lib, func):
+                self._process_struct = NvmlProcessInfo
+                return getattr(self._lib, func)
+        self._process_struct = NvmlProcessInfoV1
+        return self._lib.nvmlDeviceGetComputeRunningProcesses
+
+    def _read_uint(self, func, *args):
+        try:
+            self._call(func, *args, ctypes.byref(self._uint))
+        except NvmlError:
+            return None
+        return self._uint.value
+
+    def _read_processes(self, handle):
+        count = ctypes.c_uint(len(self._process_buffer))
+        code = self._get_processes(handle, ctypes.byref(count), self._process_buffer)
+        if code == NVML_ERROR_INSUFFICIENT_SIZE:
+            self._process_buffer = (self._process_struct * (count.value + 16))()
+            count = ctypes.c_uint(len(self._process_buffer))
+            code = self._get_processes(handle, ctypes.byref(count), self._process_buffer)
+        if code != NVML_SUCCESS:
+            return []
+        processes = []
+        for info in self._process_buffer[:count.value]:
+            memory = info.usedGpuMemory
+            processes.append({
+                'pid': info.pid,
+                'name': self._process_name(info.pid),
+                'memory': None if memory == NVML_VALUE_NOT_AVAILABLE else memory // MIB,
+            })
+        return processes
+
+    def _process_name(self, pid):
+        name = self._process_names.get(pid)
+        if name is None:
+            buffer = ctypes.create_string_buffer(256)
+            try:
+                self._call('nvmlSystemGetProcessName', ctypes.c_uint(pid), buffer, ctypes.c_uint(256))
+                name = buffer.value.decode('utf-8', 'replace') or 'Unknown'
+            except NvmlError:
+                name = 'Unknown'
+            self._process_names[pid] = name
+        return name
+
+    def collect(self):
+        try:
+            gpus = []
+            seen_pids = set()
+            for device in self._devices:
+                handle = device['handle']
+                temperature = self._read_uint('nvmlDeviceGetTemperature', handle, ctypes.c_uint(NVML_TEMPERATURE_GPU))
+                power_draw = self._read_uint('nvmlDeviceGetPowerUsage', handle)
+                power_limit = self._read_uint('nvmlDeviceGetEnforcedPowerLimit', handle)
+                try:
+                    self._call('nvmlDeviceGetUtilizationRates', handle, ctypes.byref(self._utilization))
+                    utilization = self._utilization.gpu
+                except NvmlError:
+                    utilization = None
+                self._call('nvmlDeviceGetMemoryInfo', handle, ctypes.byref(self._memory))
+                memory_used = self._memory.used // MIB
+                memory_total = self._memory.total // MIB
+                gpu_info = {
+                    'index': device['index'],
+                    'uuid': device['uuid'],
+                    'name': device['name'],
+                    'pci_bus_id': device['pci_bus_id'],
+                    'driver_version': device['driver_version'],
+                    'temperature': temperature,
+                    'utilization': utilization,
+                    'memory_used': memory_used,
+                    'memory_total': memory_total,
+                    'power_draw': None if power_draw is None else round(power_draw / 1000, 2),
+                    'power_limit': None if power_limit is None else round(power_limit / 1000, 2),
+                    'memory_percent': _percent(memory_used, memory_total),
+                    'processes': self._read_processes(handle),
+                }
+                seen_pids.update(p['pid'] for p in gpu_info['processes'])
+                gpus.append(gpu_info)
+            # 清理已退出进程的名称缓存
+            for pid in list(self._process_names):
+                if pid not in seen_pids:
+                    del self._process_names[pid]
+            if self.recorder is not None:
+                # NVML 没有文本输出，记录采集结果
+                self.recorder.write('nvml', json.dumps(gpus))
+            return gpus
+        except NvmlError as e:
+            print(f"错误: NVML采集失败 - {str(e)}")
+            return None
+
+    def close(self):
+        if self._lib is not None:
+            self._lib.nvmlShutdown()
+            self._lib = None
+
+def create_collector(kind, interval, nvidia_smi='nvidia-smi', nvml_lib=None, metrics=()):
+    """按名称创建采集器；NVML不可用时回退到 nvidia-smi XML 采集
+
+    附加指标组（metrics）目前只有XML采集器支持，auto 模式下请求附加指标时直接使用XML采集。
+    """
+    if metrics and kind in ('nvml', 'stream'):
+        print(f"⚠️  {kind} 采集方式不支持附加指标 {','.join(metrics)}，已忽略")
+    if kind == 'nvml' or (kind == 'auto' and not metrics):
+        try:
+            return NvmlCollector(nvml_lib)
+        except (OSError, AttributeError, NvmlError) as e:
+            print(f"⚠️  无法加载NVML ({str(e)})，回退到 nvidia-smi 采集")
+            return SmiXmlCollector(nvidia_smi)
+    if kind == 'stream':
+        return SmiStreamCollector(interval, nvidia_smi=nvidia_smi)
+    return SmiXmlCollector(nvidia_smi, metrics)
+
+class CollectorRecorder:
+    """把采集器读到的原始输出追加写入记录文件，供 --replay 回放
+
+    JSON Lines 格式，每行 {"t": 读取时间(epoch秒), "kind": 类型, "data": 原始输出}，类型为
+    xml（nvidia-smi -q -x 的完整输出）、csv（流式采集的一帧）、apps（--query-compute-apps 的输出）
+    或 nvml（NVML 没有文本输出，记录采集结果的JSON）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, kind, data):
+        line = json.dumps({'t': round(time.time(), 3), 'kind': kind, 'data': data}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class ReplayCollector(Collector):
+    """按记录时间回放 --record 记录的原始输出，经过与实时采集相同的解析代码
+
+    回放时间轴按 speed 倍速推进，collect() 返回当前时刻之前最新的一帧（没有到期的记录时等待）；
+    所有记录都按顺序解析，便于在没有GPU的机器上测量解析和发送路径。记录读完后 finished 为 True。
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, speed=1.0, metrics=()):
+        self.path = path
+        self.speed = speed
+        self.plan = XmlFieldPlan(metrics) if metrics else DEFAULT_XML_PLAN
+        self.static_cache = {}
+        self.finished = False
+        self.replayed = 0
+        self.parse_seconds = 0.0
+        self._file = open(path, encoding='utf-8')
+        self._closed = threading.Event()
+        self._gpus = None
+        self._frame = None
+        self._processes = {}
+        self._next = self._read()
+        self._t0 = self._next['t'] if self._next else 0
+        self._start = time.monotonic()
+
+    def _read(self):
+        for line in self._file:
+            try:
+                return json.loads(line)
+            except ValueError:
+                continue  # 记录时被中断的半行
+        return None
+
+    def _due(self, record):
+        return self._start + (record['t'] - self._t0) / self.speed
+
+    def _apply(self, record):
+        kind, data = record.get('kind'), record.get('data')
+        start = time.perf_counter()
+        if kind == 'xml':
+            extracted = self.plan.extract(io.BytesIO(data.encode('utf-8')))
+            self._gpus = build_xml_gpus(self.plan, extracted, self.static_cache)
+        elif kind == 'csv':
+            self._frame = [gpu for gpu in map(parse_stream_line, data.splitlines()) if gpu is not None]
+        elif kind == 'apps':
+            self._processes = parse_compute_apps(data)
+        elif kind == 'nvml':
+            self._gpus = json.loads(data)
+        else:
+            return
+        if self._frame is not None:
+            self._gpus = [dict(gpu, processes=list(self._processes.get(gpu['uuid'], []))) for gpu in self._frame]
+        self.parse_seconds += time.perf_counter() - start
+        self.replayed += 1
+
+    def collect(self):
+        if self._next is None:
+            self.finished = True
+            return None
+        wait = self._due(self._next) - time.monotonic()
+        if wait > 0 and self._closed.wait(wait):
+            return None
+        parse_seconds = self.parse_seconds
+        while self._next is not None and self._due(self._next) <= time.monotonic():
+            try:
+                self._apply(self._next)
+            except (ET.ParseError, ValueError, KeyError, AttributeError) as e:
+                print(f"⚠️  跳过无法解析的记录: {str(e)}")
+            self._next = self._read()
+        self.last_timings = {'parse': self.parse_seconds - parse_seconds}
+        return [dict(gpu, processes=[dict(p) for p in gpu.get('processes', [])]) for gpu in self._gpus or []] or None
+
+    def close(self):
+        self._closed.set()
+        self._file.close()
+
+class ServerLink:
+    """到服务端的持久HTTP连接
+
+    使用带连接池的 requests.Session 保持 keep-alive，避免每次上报都重新握手；
+    连接失败后按指数退避（带随机抖动）等待，再重建会话重连。
+    """
+
+    def __init__(self, server_url, timeout=5, backoff_base=1, backoff_max=60, compress=None):
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+        self.compress = compress
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reconnects = 0
+        # 服务端只接受旧版字符串样本（不认识 schema 2）时为 True，重连后重新协商
+        self.legacy = False
+        self._backoff = 0
+        self._retry_at = 0
+        # 已关闭会话的累计统计
+        self._closed_connections = 0
+        self._closed_requests = 0
+        self._session = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Connection'] = 'keep-alive'
+        return session
+
+    def _pool_counts(self):
+        """当前会话连接池中已建立的连接数和已发出的请求数"""
+        pools = self._session.get_adapter(self.server_url).poolmanager.pools
+        connections = requests_total = 0
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            requests_total += pool.num_requests
+        return connections, requests_total
+
+    def reconnect(self):
+        """关闭当前会话（及其连接池），下次请求时建立新连接"""
+        connections, requests_total = self._pool_counts()
+        self._closed_connections += connections
+        self._closed_requests += requests_total
+        self._session.close()
+        self._session = self._new_session()
+        self.reconnects += 1
+        self.legacy = False  # 服务端可能已经升级
+
+    def retry_in(self):
+        """距离允许下一次请求还有多少秒（0 表示可以立即发送）"""
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def mark_success(self):
+        self._backoff = 0
+        self._retry_at = 0
+
+    def mark_failure(self, reconnect=False):
+        self._backoff = min(max(self._backoff * 2, self.backoff_base), self.backoff_max)
+        self._retry_at = time.monotonic() + self._backoff * random.uniform(0.5, 1.0)
+        if reconnect:
+            self.reconnect()
+
+    def post(self, path, **kwargs):
+        """发送POST请求；设置了 compress 时压缩尚未压缩的请求体"""
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'json' in kwargs:
+            kwargs['data'] = json.dumps(kwargs.pop('json')).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        if self.compress and kwargs.get('data') is not None and 'Content-Encoding' not in headers:
+            kwargs['data'] = compress_body(kwargs['data'], self.compress)
+            headers['Content-Encoding'] = self.compress
+        return self._session.post(f"{self.server_url}{path}", headers=headers, **kwargs)
+
+    def stats(self):
+        """连接复用统计: (建立的连接数, 请求数, 复用率)"""
+        connections, requests_total = self._pool_counts()
+        connections += self._closed_connections
+        total = self._closed_requests + requests_total
+        reuse = (total - connections) / total if total else 0.0
+        return connections, total, reuse
+
+    def close(self):
+        self._session.close()
+
+class SampleSpool:
+    """基于内存映射文件的有界环形缓存，保存发送失败的样本
+
+    文件头记录读写位置、样本数量和序号，进程重启后可继续补传；
+    空间不足时丢弃最旧的样本。每条记录为 [长度 u32][序号 u64][JSON]。
+    非线程安全，只应由负责发送的线程使用。
+    """
+
+    MAGIC = b'GPUSPOOL'
+    VERSION = 1
+    # magic, version, capacity, head, tail, count, next_seq, dropped, spool_id
+    HEADER = struct.Struct('<8sIQQQQQQ16s')
+    HEADER_SIZE = 128
+    RECORD = struct.Struct('<IQ')
+    WRAP = 0xFFFFFFFF
+
+    def __init__(self, path, size_mb=16):
+        self.path = path
+        capacity = int(size_mb * 1024 * 1024)
+        exists = os.path.exists(path) and os.path.getsize(path) > self.HEADER_SIZE
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists or not self._load_header():
+            self._file.truncate(self.HEADER_SIZE + capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+            self.capacity = capacity
+            self.head = self.tail = self.count = self.dropped = 0
+            self.next_seq = 1
+            self.spool_id = os.urandom(8).hex().encode()
+            self._save_header()
+
+    def _load_header(self):
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        (magic, version, self.capacity, self.head, self.tail, self.count,
+         self.next_seq, self.dropped, self.spool_id) = self.HEADER.unpack_from(self._mmap, 0)
+        if (magic != self.MAGIC or version != self.VERSION or
+                self.HEADER_SIZE + self.capacity != len(self._mmap)):
+            print(f"⚠️  缓存文件 {self.path} 格式不匹配，已重建")
+            self._mmap.close()
+            return False
+        return True
+
+    def _save_header(self):
+        self.HEADER.pack_into(self._mmap, 0, self.MAGIC, self.VERSION, self.capacity, self.head,
+                              self.tail, self.count, self.next_seq, self.dropped, self.spool_id)
+
+    def _record_at(self, offset):
+        """返回 (记录起点, 序号, 负载长度)；遇到回绕标记时从数据区开头读取"""
+        if offset + self.RECORD.size > self.capacity:
+            offset = 0
+        length, seq = self.RECORD.unpack_from(self._mmap, self.HEADER_SIZE + offset)
+        if length == self.WRAP:
+            offset = 0
+            length, seq = self.RECORD.unpack_from(self._mmap, self.HEADER_SIZE)
+        return offset, seq, length
+
+    def _drop_oldest(self):
+        offset, _, length = self._record_at(self.tail)
+        self.tail = offset + self.RECORD.size + length
+        self.count -= 1
+        self.dropped += 1
+
+    def append(self, payload):
+        """追加一条样本（bytes），空间不足时丢弃最旧的样本"""
+        size = self.RECORD.size + len(payload)
+        if size > self.capacity // 2:
+            print(f"⚠️  样本过大 ({len(payload)} 字节)，无法写入缓存")
+            return False
+        while True:
+            if self.count == 0:
+                self.head = self.tail = 0
+            if self.count and self.head == self.tail:
+                self._drop_oldest()  # 已写满
+            elif self.head >= self.tail:
+                if self.head + size <= self.capacity:
+                    break
+                # 尾部空间不足，写回绕标记后从头开始
+                if self.head + self.RECORD.size <= self.capacity:
+                    self.RECORD.pack_into(self._mmap, self.HEADER_SIZE + self.head, self.WRAP, 0)
+                self.head = 0
+            elif self.tail - self.head >= size:
+                break
+            else:
+                self._drop_oldest()
+        position = self.HEADER_SIZE + self.head
+        self.RECORD.pack_into(self._mmap, position, len(payload), self.next_seq)
+        self._mmap[position + self.RECORD.size:position + size] = payload
+        self.head += size
+        self.count += 1
+        self.next_seq += 1
+        self._save_header()
+        self._mmap.flush()
+        return True
+
+    def peek(self, limit):
+        """按写入顺序返回最旧的最多 limit 条样本: [(序号, bytes), ...]"""
+        records = []
+        offset = self.tail
+        for _ in range(min(limit, self.count)):
+            offset, seq, length = self._record_at(offset)
+            start = self.HEADER_SIZE + offset + self.RECORD.size
+            records.append((seq, bytes(self._mmap[start:start + length])))
+            offset += self.RECORD.size + length
+        return records
+
+    def discard(self, n):
+        """删除最旧的 n 条样本（已成功补传）"""
+        for _ in range(min(n, self.count)):
+            offset, _, length = self._record_at(self.tail)
+            self.tail = offset + self.RECORD.size + length
+            self.count -= 1
+        self._save_header()
+        self._mmap.flush()
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+class DeltaEncoder:
+    """增量上报编码器
+
+    每隔 keyframe_every 个样本发送一次完整的关键帧，其余样本只发送相对
+    上一条已被服务端确认（ack）的样本发生变化的字段。
+    """
+
+    def __init__(self, keyframe_every=12):
+        self.keyframe_every = keyframe_every
+        self.seq = 0
+        self._acked_seq = None
+        self._acked_gpus = None
+        self._since_keyframe = 0
+
+    def encode(self, payload):
+        """返回要发送的数据（关键帧或增量）"""
+        self.seq += 1
+        wire = {key: value for key, value in payload.items() if key != 'gpus'}
+        wire['seq'] = self.seq
+        if self._acked_gpus is None or self._since_keyframe >= self.keyframe_every:
+            wire['keyframe'] = True
+            wire['gpus'] = payload['gpus']
+        else:
+            changes, removed = make_delta(self._acked_gpus, payload['gpus'])
+            wire['base_seq'] = self._acked_seq
+            wire['changes'] = changes
+            if removed:
+                wire['removed'] = removed
+        return wire
+
+    def ack(self, wire, gpus):
+        """服务端确认后把该样本作为下一次增量的基准"""
+        self._acked_seq = wire['seq']
+        self._acked_gpus = gpus
+        self._since_keyframe = 0 if wire.get('keyframe') else self._since_keyframe + 1
+
+    def reset(self):
+        """基准失效（服务端重启、补传了缓存等），下一次发送关键帧"""
+        self._acked_seq = None
+        self._acked_gpus = None
+
+class StaticInventory:
+    """GPU静态清单的注册状态（每个上报目标一份）
+
+    型号、UUID、总显存等静态属性变化时（包括首次上报）向服务端注册一次，
+    之后的样本只带动态字段、GPU UUID 和清单ID；旧版服务端没有注册接口时始终发送完整样本。
+    """
+
+    def __init__(self):
+        self.inventory_id = None
+        self.supported = True
+        self._inventory = None
+
+    def reset(self):
+        """服务端不认识当前清单（例如刚重启），下次上报前重新注册"""
+        self.inventory_id = None
+
+    def _register(self, link, payload, inventory):
+        response = link.post(REGISTER_PATH, json={
+            'schema': payload.get('schema', SCHEMA_VERSION),
+            'server_name': payload['server_name'],
+            'gpus': inventory,
+        })
+        if response.status_code == 404:
+            self.supported = False
+            print(f"ℹ️  服务器 {link.server_url} 不支持清单注册，改为发送完整样本")
+            return False
+        if response.status_code != 200:
+            print(f"警告: 清单注册失败，服务器 {link.server_url} 返回状态码 {response.status_code}")
+            return False
+        self.inventory_id = response.json()['inventory_id']
+        self._inventory = inventory
+        print(f"🗂️  已向 {link.server_url} 注册GPU清单 {self.inventory_id}（{len(inventory)} 个GPU）")
+        return True
+
+    def strip(self, link, payload):
+        """返回要上报的样本：注册成功时去掉静态字段并附带清单ID，否则原样返回"""
+        gpus = payload.get('gpus', [])
+        if not self.supported or not all(gpu.get('uuid') for gpu in gpus):
+            return payload
+        inventory, dynamic = split_static(gpus)
+        if self.inventory_id is None or inventory != self._inventory:
+            self.inventory_id = None
+            if not self._register(link, payload, inventory):
+                return payload
+        return dict(payload, gpus=dynamic, inventory_id=self.inventory_id)
+
+class AdaptiveInterval:
+    """根据指标变化程度调整采样间隔
+
+    使用率、显存或进程列表发生明显变化时立即回到最短间隔，
+    连续保持稳定时按 backoff 倍数逐步放慢，直到最长间隔（同时也是心跳间隔）。
+    未启用自适应时（min_interval == max_interval）始终返回固定间隔。
+    """
+
+    def __init__(self, min_interval, max_interval, backoff=1.5,
+                 util_threshold=5, memory_threshold=2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.util_threshold = util_threshold      # 使用率变化（百分点）
+        self.memory_threshold = memory_threshold  # 显存占用变化（占总显存的百分点）
+        self.interval = min_interval
+        self._previous = None
+
+    def _snapshot(self, gpus):
+        snapshot = {}
+        for gpu in gpus:
+            total = parse_number(gpu.get('memory_total')) or 0
+            used = parse_number(gpu.get('memory_used')) or 0
+            snapshot[gpu.get('index')] = (
+                parse_number(gpu.get('utilization')) or 0,
+                used * 100 / total if total else 0,
+                frozenset(p.get('pid') for p in gpu.get('processes', [])),
+            )
+        return snapshot
+
+    def _changed(self, previous, current):
+        if previous is None or previous.keys() != current.keys():
+            return True
+        for index, (util, memory, pids) in current.items():
+            old_util, old_memory, old_pids = previous[index]
+            if (abs(util - old_util) >= self.util_threshold
+                    or abs(memory - old_memory) >= self.memory_threshold
+                    or pids != old_pids):
+                return True
+        return False
+
+    def update(self, gpus):
+        """根据最新样本返回下一次采样前的等待时间（秒）"""
+        current = self._snapshot(gpus)
+        if self._changed(self._previous, current):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self._previous = current
+        return self.interval
+
+class WindowAggregator:
+    """在两次上报之间累积高频样本，上报时附带窗口内各指标的统计值
+
+    上报的数据仍以最后一个样本为准（兼容旧版服务端），每块GPU额外带
+    aggregates = {字段: {min, max, mean, p95}} 和 window_samples（窗口内样本数）。
+    """
+
+    def __init__(self, fields=AGGREGATE_FIELDS):
+        self.fields = fields
+        self._values = {}
+        self._last = None
+
+    def add(self, gpus):
+        for gpu in gpus:
+            record = normalize_gpu(gpu)
+            values = self._values.setdefault(gpu.get('index'), {field: [] for field in self.fields})
+            for field in self.fields:
+                if record[field] is not None:
+                    values[field].append(record[field])
+        self._last = gpus
+
+    @staticmethod
+    def summarize(values):
+        ordered = sorted(values)
+        return {
+            'min': ordered[0],
+            'max': ordered[-1],
+            'mean': round(sum(ordered) / len(ordered), 2),
+            'p95': ordered[math.ceil(0.95 * len(ordered)) - 1],
         }
+
+    def flush(self):
+        """返回带窗口统计的最后一个样本并开始新窗口，窗口为空时返回 None"""
+        if self._last is None:
+            return None
+        gpus = []
+        for gpu in self._last:
+            values = self._values.get(gpu.get('index'), {})
+            gpu = dict(gpu)
+            gpu['aggregates'] = {field: self.summarize(v) for field, v in values.items() if v}
+            gpu['window_samples'] = max((len(v) for v in values.values()), default=0)
+            gpus.append(gpu)
+        self._values = {}
+        self._last = None
+        return gpus
+
+class ProcessInfoCache:
+    """从 /proc/<pid> 补充进程的用户、完整命令行、容器ID和启动时间
+
+    每次上报只读取一次各进程的 /proc/<pid>/stat（多块GPU上的同一进程只读一次），
+    按 (pid, 启动时间) 缓存其余信息，长时间运行的训练任务只完整读取一次；
+    本次没有出现的进程从缓存中移除，pid 被复用时启动时间不同也不会误用旧信息。
+    """
+
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        self.enabled = os.path.isdir(proc_root)
+        self._cache = {}
+        self._users = {}
+        self._boot_time = None
+        self._clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self, pid, name, mode='r'):
+        with open(f"{self.proc_root}/{pid}/{name}", mode) as f:
+            return f.read()
+
+    def _start_ticks(self, pid):
+        stat = self._read(pid, 'stat')
+        # 进程名可能含空格和括号，从最后一个 ')' 之后开始按字段拆分；starttime 是第22个字段
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+
+    def _boot(self):
+        if self._boot_time is None:
+            self._boot_time = 0
+            try:
+                with open(f"{self.proc_root}/stat") as f:
+                    for line in f:
+                        if line.startswith('btime '):
+                            self._boot_time = int(line.split()[1])
+                            break
+            except OSError:
+                pass
+        return self._boot_time
+
+    def _user(self, uid):
+        if uid not in self._users:
+            try:
+                import pwd
+                self._users[uid] = pwd.getpwuid(uid).pw_name
+            except (ImportError, KeyError):
+                self._users[uid] = str(uid)
+        return self._users[uid]
+
+    @staticmethod
+    def _container(cgroup):
+        """从 cgroup 路径中找出容器ID（docker/containerd/podman 的64位十六进制ID）"""
+        for line in cgroup.splitlines():
+            for part in reversed(line.rsplit(':', 1)[-1].split('/')):
+                part = part.rsplit('-', 1)[-1].replace('.scope', '')
+                if len(part) == 64 and all(c in '0123456789abcdef' for c in part):
+                    return part[:12]
+        return None
+
+    def _load(self, pid, start_ticks):
+        info = {}
+        try:
+            info['user'] = self._user(os.stat(f"{self.proc_root}/{pid}").st_uid)
+            cmdline = self._read(pid, 'cmdline', 'rb').rstrip(b'\0').replace(b'\0', b' ')
+            info['cmdline'] = cmdline.decode(errors='replace')
+            info['container'] = self._container(self._read(pid, 'cgroup'))
+        except OSError:
+            pass
+        started = self._boot() + start_ticks / self._clock_ticks
+        info['started'] = datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')
+        return info
+
+    def enrich(self, gpus):
+        """给所有GPU的进程补充信息（原地修改），并清理已退出进程的缓存"""
+        if not self.enabled:
+            return gpus
+        seen = {}
+        for gpu in gpus:
+            for process in gpu.get('processes', []):
+                try:
+                    pid = int(process.get('pid'))
+                except (TypeError, ValueError):
+                    continue
+                if pid not in seen:
+                    try:
+                        key = (pid, self._start_ticks(pid))
+                    except (OSError, ValueError, IndexError):
+                        # 进程已退出或在其他PID命名空间（容器内看不到宿主机进程）
+                        seen[pid] = None
+                        continue
+                    if key not in self._cache:
+                        self._cache[key] = self._load(*key)
+                    seen[pid] = key
+                if seen[pid] is not None:
+                    process.update(self._cache[seen[pid]])
+        live = set(seen.values())
+        for key in [key for key in self._cache if key not in live]:
+            del self._cache[key]
+        return gpus
+
+class HostMetrics:
+    """从 /proc 读取主机级指标（CPU、内存、负载、网络、磁盘IO）
+
+    各 /proc 文件只打开一次，之后每次 seek(0) 重新读取；累计计数器（CPU时间、
+    网卡字节数、磁盘扇区数）与上一次读取做差，换算为区间内的百分比和速率。
+    第一次读取没有上一次的计数，速率类指标为 None。
+    """
+
+    FILES = ['stat', 'meminfo', 'loadavg', 'net/dev', 'diskstats']
+    SECTOR_BYTES = 512
+
+    def __init__(self, proc_root='/proc'):
+        self._files = {}
+        for name in self.FILES:
+            try:
+                self._files[name] = open(f"{proc_root}/{name}")
+            except OSError:
+                pass
+        self.enabled = bool(self._files)
+        self._previous = None
+        try:
+            self._disks = set(os.listdir('/sys/block'))  # 只列出整块磁盘，不含分区
+        except OSError:
+            self._disks = None
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _read(self, name):
+        f = self._files.get(name)
+        if f is None:
+            return ''
+        f.seek(0)
+        return f.read()
+
+    def _whole_disk(self, name):
+        """只统计整块物理磁盘，跳过分区和 loop/ram/dm/md 等虚拟设备，避免重复计数"""
+        if name.startswith(VIRTUAL_DISK_PREFIXES):
+            return False
+        if self._disks is not None:
+            return name in self._disks
+        return not name[-1].isdigit()
+
+    def _counters(self):
+        cpu = self._read('stat').split('\n', 1)[0].split()[1:]
+        cpu = [int(v) for v in cpu]
+        net_rx = net_tx = 0
+        for line in self._read('net/dev').splitlines()[2:]:
+            iface, _, values = line.partition(':')
+            if iface.strip() == 'lo':
+                continue
+            values = values.split()
+            net_rx += int(values[0])
+            net_tx += int(values[8])
+        disk_read = disk_write = 0
+        for line in self._read('diskstats').splitlines():
+            values = line.split()
+            if len(values) >= 10 and self._whole_disk(values[2]):
+                disk_read += int(values[5])
+                disk_write += int(values[9])
+        return {
+            'time': time.monotonic(),
+            'cpu_total': sum(cpu[:8]),  # user..steal，guest 已计入 user
+            'cpu_idle': cpu[3] + (cpu[4] if len(cpu) > 4 else 0),
+            'cpu_iowait': cpu[4] if len(cpu) > 4 else 0,
+            'net_rx': net_rx,
+            'net_tx': net_tx,
+            'disk_read': disk_read * self.SECTOR_BYTES,
+            'disk_write': disk_write * self.SECTOR_BYTES,
+        }
+
+    def read(self):
+        """返回 host 块：百分比为 %，内存为 MiB，网络和磁盘速率为 MiB/s"""
+        if not self.enabled:
+            return None
+        current = self._counters()
+        meminfo = {}
+        for line in self._read('meminfo').splitlines():
+            key, _, value = line.partition(':')
+            if key in ('MemTotal', 'MemAvailable'):
+                meminfo[key] = int(value.split()[0]) / 1024
+        load = self._read('loadavg').split()
+        mem_total = meminfo.get('MemTotal')
+        mem_used = mem_total - meminfo['MemAvailable'] if mem_total and 'MemAvailable' in meminfo else None
+        host = {
+            'cpu_percent': None,
+            'iowait_percent': None,
+            'mem_total': round(mem_total) if mem_total else None,
+            'mem_used': round(mem_used) if mem_used is not None else None,
+            'mem_percent': round(mem_used / mem_total * 100, 1) if mem_used is not None else None,
+            'load1': float(load[0]) if load else None,
+            'load5': float(load[1]) if load else None,
+            'load15': float(load[2]) if load else None,
+            'net_rx': None,
+            'net_tx': None,
+            'disk_read': None,
+            'disk_write': None,
+        }
+        previous, self._previous = self._previous, current
+        if previous is not None:
+            total = current['cpu_total'] - previous['cpu_total']
+            if total > 0:
+                idle = current['cpu_idle'] - previous['cpu_idle']
+                host['cpu_percent'] = round((total - idle) / total * 100, 1)
+                host['iowait_percent'] = round((current['cpu_iowait'] - previous['cpu_iowait']) / total * 100, 1)
+            elapsed = current['time'] - previous['time']
+            if elapsed > 0:
+                for key in ('net_rx', 'net_tx', 'disk_read', 'disk_write'):
+                    host[key] = round((current[key] - previous[key]) / elapsed / MIB, 2)
+        return host
+
+    def benchmark(self, rounds=200):
+        """测量单次读取的平均耗时（秒），用于评估采集开销"""
+        previous = self._previous
+        start = time.perf_counter()
+        for _ in range(rounds):
+            self.read()
+        self._previous = previous
+        return (time.perf_counter() - start) / rounds
+
+class LatencyHistogram:
+    """固定桶的耗时直方图（毫秒），分位数按所在桶的上界估计（不超过最大值）"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS + [self.max], self.counts):
+            seen += n
+            if seen >= rank:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def summary(self, buckets=False):
+        result = {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': round(self.max, 3),
+        }
+        if buckets:
+            result['buckets'] = {str(bound): n for bound, n in zip(LATENCY_BUCKETS_MS + ['+Inf'], self.counts) if n}
+        return result
+
+class ClientStats:
+    """客户端自身的运行指标：各阶段耗时直方图（毫秒）、发送队列、CPU 和内存占用
+
+    阶段: collect=一次采集的总耗时, smi=等待 nvidia-smi, parse=解析, enrich=补充进程/主机信息,
+    tick_lag=上报节拍的延迟, send=发送一个样本（含重试和写缓存）。
+    observe() 可在采集线程和各发送线程中调用；summary() 为启动以来的累计值（本地接口使用），
+    window_summary() 为上次调用以来的窗口统计（定期附加到上报数据中）。
+    """
+
+    def __init__(self, targets=()):
+        self.targets = targets
+        self._started = time.monotonic()
+        self._started_cpu = self._cpu_seconds()
+        self._total = {}
+        self._window = {}
+        self._window_usage = (self._started, self._cpu_seconds())
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            for histograms in (self._total, self._window):
+                histogram = histograms.get(stage)
+                if histogram is None:
+                    histogram = histograms[stage] = LatencyHistogram()
+                histogram.observe(ms)
+
+    @staticmethod
+    def _cpu_seconds():
+        times = os.times()
+        return times.user + times.system
+
+    @staticmethod
+    def _rss_mb():
+        try:
+            with open('/proc/self/statm') as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / MIB, 1)
+
+    def _targets_summary(self):
+        return {target.link.server_url: {
+            'queue': target.samples.qsize(),
+            'dropped': target.dropped,
+            'sent': target.sent,
+            'failed': target.failed,
+        } for target in self.targets}
+
+    def _summary(self, stages, since, cpu_since):
+        elapsed = time.monotonic() - since
+        cpu = self._cpu_seconds()
+        return {
+            'stages': stages,
+            'targets': self._targets_summary(),
+            'cpu_percent': round((cpu - cpu_since) / elapsed * 100, 2) if elapsed > 0 else None,
+            'rss_mb': self._rss_mb(),
+            'window': round(elapsed, 1),
+        }
+
+    def summary(self):
+        with self._lock:
+            stages = {stage: histogram.summary(buckets=True) for stage, histogram in self._total.items()}
+        return self._summary(stages, self._started, self._started_cpu)
+
+    def window_summary(self):
+        with self._lock:
+            histograms, self._window = self._window, {}
+            (since, cpu_since), self._window_usage = self._window_usage, (time.monotonic(), self._cpu_seconds())
+        return self._summary({stage: histogram.summary() for stage, histogram in histograms.items()}, since, cpu_since)
+
+class _StatsHandler(http.server.BaseHTTPRequestHandler):
+    stats = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.stats.summary()).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def start_stats_server(address, stats):
+    """在本地端口（[地址:]端口）或 Unix socket（unix:路径）上提供 GET /metrics，返回 ClientStats.summary()"""
+    handler = type('StatsHandler', (_StatsHandler,), {'stats': stats})
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = _UnixHTTPServer(path, handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def next_tick(previous, period, now):
+    """从上一个节拍按固定周期推进到 now 之后的第一个节拍，错过的节拍直接跳过"""
+    tick = previous + period
+    if tick < now:
+        tick += (int((now - tick) // period) + 1) * period
+    return tick
+
+class Sampler:
+    """采集线程：按单调时钟的固定节拍采样，每个样本交给所有上报目标
+
+    节拍按 time.monotonic() 累加，不受采集和发送耗时影响，服务端变慢也不会拖慢采样；
+    某次采集超时错过节拍时跳到下一个未来的节拍，不补采。
+    某个节拍中任何一步出错只记录错误并跳过该节拍，采集线程不会退出。
+    """
+
+    def __init__(self, collector, scheduler, server_name, targets, aggregator=None, sample_every=None,
+                 process_info=None, host_metrics=None, process_util=None, stats=None, stats_every=0):
+        self.collector = collector
+        self.stats = stats
+        self.stats_every = stats_every
+        self.reported = 0
+        self.process_util = process_util
+        self.process_info = process_info
+        self.host_metrics = host_metrics
+        self.scheduler = scheduler
+        self.server_name = server_name
+        self.targets = targets
+        self.aggregator = aggregator
+        self.sample_every = sample_every
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _collect(self):
+        started = time.perf_counter()
+        try:
+            return self.collector.collect()
+        except Exception as e:
+            print(f"❌ 采集时发生未预期的错误: {str(e)}")
+            return None
+        finally:
+            if self.stats is not None:
+                self.stats.observe('collect', time.perf_counter() - started)
+                for stage, seconds in self.collector.last_timings.items():
+                    if seconds is not None:
+                        self.stats.observe(stage, seconds)
+
+    def _run(self):
+        next_report = time.monotonic()
+        tick = next_report
+        while not self._stop.is_set():
+            try:
+                next_report, tick = self._step(next_report, tick)
+            except Exception as e:
+                print(f"❌ 采样时发生未预期的错误: {str(e)}")
+                next_report = tick = next_tick(next_report, self.scheduler.interval, time.monotonic())
+            self._stop.wait(max(0, tick - time.monotonic()))
+
+    def _step(self, next_report, tick):
+        """执行一个节拍（采集，到上报时间时补充信息并交给各目标），返回 (下次上报时间, 下个节拍)"""
+        gpus = self._collect()
+        if self.aggregator is not None and gpus is not None:
+            self.aggregator.add(gpus)
+        now = time.monotonic()
+        if now >= next_report:
+            # 先推进上报时间，本次上报中途出错时也不会在下个节拍重试同一次上报
+            report_at, next_report = next_report, next_tick(next_report, self.scheduler.interval, now)
+            if self.aggregator is not None:
+                gpus = self.aggregator.flush()
+            if gpus is None:
+                if not getattr(self.collector, 'finished', False):
+                    print("⚠️  无法获取GPU信息，等待下次尝试...")
+            else:
+                started = time.perf_counter()
+                self.scheduler.update(gpus)
+                next_report = next_tick(report_at, self.scheduler.interval, now)
+                if self.process_util is not None:
+                    self.process_util.merge(gpus)
+                if self.process_info is not None:
+                    self.process_info.enrich(gpus)
+                host = self.host_metrics.read() if self.host_metrics is not None else None
+                payload = build_payload(self.server_name, gpus, host)
+                self.reported += 1
+                if self.stats is not None:
+                    self.stats.observe('enrich', time.perf_counter() - started)
+                    self.stats.observe('tick_lag', max(0.0, now - report_at))
+                    if self.stats_every and self.reported % self.stats_every == 0:
+                        payload['client_stats'] = self.stats.window_summary()
+                for target in self.targets:
+                    target.offer(payload)
+        # 窗口聚合时在两次上报之间按 sample_every 高频采样
+        if self.aggregator is None:
+            return next_report, next_report
+        return next_report, min(next_tick(tick, self.sample_every, now), next_report)
+
+def build_payload(server_name, gpu_data, host=None):
+    """构造上报的数据"""
+    payload = {
+        'schema': SCHEMA_VERSION,
+        'server_name': server_name,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'gpus': gpu_data
+    }
+    if host is not None:
+        payload['host'] = host
+    return payload
+
+def _post_sample(link, wire, binary):
+    if binary:
+        return link.post('/api/update', data=encode_binary_sample(wire),
+                         headers={'Content-Type': BINARY_CONTENT_TYPE})
+    return link.post('/api/update', json=wire)
+
+def _post_legacy(link, payload):
+    """按旧版格式发送一条完整样本：字符串字段、不压缩（旧版服务端不解压请求体）"""
+    return link.post('/api/update', json=legacy_sample(payload), headers={'Content-Encoding': 'identity'})
+
+def _rejects_schema(response):
+    """400 响应是否表示服务端不认识带类型的样本
+
+    新版服务端的 400 带 error 字段，只有 unsupported_schema 需要改发旧版格式，样本本身无效（invalid_sample）时不改发；
+    不带 error 字段（或不是JSON）的 400 来自不认识 schema 2 的旧版服务端（如无法解析压缩或二进制的请求体）。
+    """
+    if response.status_code != 400:
+        return False
+    try:
+        error = response.json().get('error')
+    except (ValueError, AttributeError):
+        return True
+    return error is None or error == 'unsupported_schema'
+
+def _negotiate_legacy(link, response, payload):
+    """服务端不认识带类型的样本时按旧版格式重发一次；旧版服务端接受后，该连接之后都发送旧版格式"""
+    if link.legacy or not _rejects_schema(response):
+        return response
+    response = _post_legacy(link, payload)
+    if response.status_code == 200:
+        link.legacy = True
+        print(f"ℹ️  服务器 {link.server_url} 不接受带类型的样本，改为发送旧版格式")
+    return response
+
+def send_data_to_server(link, payload, encoder=None, binary=False, inventory=None):
+    """发送GPU数据到服务端；传入 encoder 时按增量协议发送，binary 时使用二进制格式，
+    传入 inventory 时静态属性只在注册时发送一次。
+    旧版服务端（不认识 schema 2）改为发送完整的旧版字符串样本。"""
+    wait = link.retry_in()
+    if wait > 0:
+        print(f"⏳ 服务端连接退避中，{wait:.1f}秒后重试")
+        return False
+    
+    try:
+        if link.legacy:
+            response = _post_legacy(link, payload)
+            if response.status_code == 200:
+                link.mark_success()
+                return True
+            print(f"警告: 服务器 {link.server_url} 返回错误状态码 {response.status_code}")
+            link.mark_failure()
+            return False
         
-        response = requests.post(
-            f"{server_url}/api/update",
-            json=payload,
-            timeout=5
-        )
+        sample = inventory.strip(link, payload) if inventory else payload
+        wire = encoder.encode(sample) if encoder else sample
+        response = _post_sample(link, wire, binary)
+        
+        if response.status_code == 409 and (encoder or inventory):
+            # 服务端没有对应的基准或清单（例如刚重启），重新注册并改发关键帧
+            try:
+                conflict = response.json()
+            except ValueError:
+                conflict = {}
+            if inventory and conflict.get('need_register'):
+                inventory.reset()
+                sample = inventory.strip(link, payload)
+            if encoder:
+                encoder.reset()
+            wire = encoder.encode(sample) if encoder else sample
+            response = _post_sample(link, wire, binary)
         
+        response = _negotiate_legacy(link, response, payload)
         if response.status_code == 200:
+            if encoder and not link.legacy:
+                encoder.ack(wire, sample['gpus'])
+            link.mark_success()
             return True
         else:
-            print(f"警告: 服务器返回错误状态码 {response.status_code}")
+            print(f"警告: 服务器 {link.server_url} 返回错误状态码 {response.status_code}")
+            link.mark_failure()
             return False
     
     except requests.exceptions.ConnectionError:
-        print(f"错误: 无法连接到服务器 {server_url}")
+        print(f"错误: 无法连接到服务器 {link.server_url}")
+        link.mark_failure(reconnect=True)
         return False
     except requests.exceptions.Timeout:
-        print(f"错误: 连接服务器超时")
+        print(f"错误: 连接服务器 {link.server_url} 超时")
+        link.mark_failure(reconnect=True)
         return False
     except Exception as e:
         print(f"错误: 发送数据失败 - {str(e)}")
+        link.mark_failure(reconnect=True)
         return False
 
+def _replay_one_by_one(link, spool, records):
+    """旧版服务端没有批量接口时逐条补传，返回已处理的条数（补传成功或被服务端拒绝而丢弃）
+
+    服务端拒绝的样本（除 404/408/409/429 外的 4xx）记录后丢弃，不会卡住之后的缓存；
+    服务端只接受旧版格式时按旧版格式补传。
+    """
+    done = 0
+    for _, sample in records:
+        if link.legacy:
+            response = _post_legacy(link, json.loads(sample))
+        else:
+            response = link.post('/api/update', data=sample,
+                                 headers={'Content-Type': 'application/json'})
+            response = _negotiate_legacy(link, response, json.loads(sample))
+        status = response.status_code
+        if status != 200:
+            if 400 <= status < 500 and status not in RETRYABLE_STATUS:
+                print(f"警告: 服务器拒绝缓存样本（状态码 {status}），已丢弃")
+            else:
+                break
+        done += 1
+    spool.discard(done)
+    return done
+
+def flush_spool(link, server_name, spool, batch_size=SPOOL_BATCH_SIZE):
+    """把缓存的样本按时间顺序分批压缩补传，全部补传完成返回 True
+
+    每批附带缓存ID和每条样本的序号，服务端跳过已入库的序号：批次已入库但响应丢失时，
+    即使重试前又缓存了新样本、批次边界变了，也不会重复入库。
+    """
+    while spool.count:
+        wait = link.retry_in()
+        if wait > 0:
+            print(f"⏳ 服务端连接退避中，{wait:.1f}秒后补传缓存")
+            return False
+        records = spool.peek(batch_size)
+        try:
+            if link.legacy:
+                # 旧版格式只能逐条发送
+                response = None
+            else:
+                response = link.post(
+                    BATCH_PATH,
+                    data=build_batch_body(server_name, [sample for _, sample in records],
+                                          spool.spool_id.decode(), [seq for seq, _ in records]),
+                    headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+                    timeout=max(link.timeout, 30)
+                )
+            # 没有批量接口（404），或不认识批次中带类型的样本（400）时逐条补传
+            if response is None or response.status_code in (400, 404):
+                sent = _replay_one_by_one(link, spool, records)
+                if sent < len(records):
+                    link.mark_failure()
+                    return False
+            elif response.status_code == 409:
+                # 该缓存的上一批还在服务端处理中，缓存保留到下次补传时重试（已入库的序号会被跳过）
+                print("⏳ 服务端仍在处理同一缓存的上一批样本，稍后重试")
+                link.mark_failure()
+                return False
+            elif response.status_code != 200:
+                print(f"警告: 批量补传失败，服务器返回状态码 {response.status_code}")
+                link.mark_failure()
+                return False
+            else:
+                spool.discard(len(records))
+        except requests.exceptions.RequestException as e:
+            print(f"错误: 批量补传失败 - {str(e)}")
+            link.mark_failure(reconnect=True)
+            return False
+        link.mark_success()
+        print(f"📤 已补传 {len(records)} 条缓存样本，剩余 {spool.count} 条")
+    return True
+
+class ReportTarget:
+    """一个上报目标：独立的连接、增量编码器、断线缓存、样本队列和发送线程
+
+    多个目标之间互不影响，某个服务端变慢或断开只会让它自己的队列积压或写入缓存。
+    队列满（发送长时间阻塞）时丢弃最旧的样本。
+    """
+
+    max_failures = 5
+
+    def __init__(self, link, encoder=None, spool=None, binary=False, queue_size=64, label='', inventory=None,
+                 stats=None):
+        self.link = link
+        self.stats = stats
+        self.encoder = encoder
+        self.inventory = inventory
+        self.spool = spool
+        self.binary = binary
+        self.label = label
+        self.samples = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def close(self):
+        self.link.close()
+        if self.spool is not None:
+            self.spool.close()
+
+    def offer(self, payload):
+        while True:
+            try:
+                self.samples.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    self.samples.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def send(self, payload):
+        """发送一个样本；有积压时先写入缓存，保证补传顺序"""
+        spool = self.spool
+        if spool is not None and spool.count:
+            spool.append(json.dumps(payload).encode())
+            success = flush_spool(self.link, payload['server_name'], spool)
+            if success and self.encoder:
+                self.encoder.reset()  # 补传改变了服务端的基准
+        else:
+            success = send_data_to_server(self.link, payload, self.encoder, binary=self.binary,
+                                          inventory=self.inventory)
+            if not success and spool is not None:
+                spool.append(json.dumps(payload).encode())
+        return success
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                payload = self.samples.get(timeout=1)
+            except queue.Empty:
+                continue
+            started = time.perf_counter()
+            try:
+                success = self.send(payload)
+            except Exception as e:
+                print(f"❌ {self.label}发生未预期的错误: {str(e)}")
+                continue
+            finally:
+                if self.stats is not None:
+                    self.stats.observe('send', time.perf_counter() - started)
+            
+            if success:
+                self.sent += 1
+                self.consecutive_failures = 0
+                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                connections, total, reuse = self.link.stats()
+                print(f"✅ [{current_time}] {self.label}数据发送成功 - {len(payload['gpus'])} 个GPU "
+                      f"(连接复用率 {reuse * 100:.0f}%, {total}次请求/{connections}个连接)")
+            else:
+                self.failed += 1
+                self.consecutive_failures += 1
+                spooled = f", 已缓存 {self.spool.count} 条" if self.spool is not None else ""
+                dropped = f", 队列溢出丢弃 {self.dropped} 条" if self.dropped else ""
+                print(f"❌ {self.label}数据发送失败 "
+                      f"(连续失败: {self.consecutive_failures}/{self.max_failures}{spooled}{dropped})")
+                
+                if self.consecutive_failures >= self.max_failures:
+                    print(f"⚠️  {self.label}连续失败{self.max_failures}次，请检查网络连接和服务端状态")
+                    self.consecutive_failures = 0  # 重置计数器，继续尝试
+
+def default_spool_path(server_name):
+    """默认的缓存文件: $XDG_STATE_HOME/gpu-monitor/<服务器名称>.spool（未设置时为 ~/.local/state）"""
+    state_home = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    safe = ''.join(c if c.isalnum() or c in '.-_' else '_' for c in server_name)
+    return os.path.join(state_home, 'gpu-monitor', f"{safe}.spool")
+
+def target_spool_path(path, server_url, multiple):
+    """多个上报目标时每个目标使用单独的缓存文件（按服务端地址区分）"""
+    if not path or not multiple:
+        return path
+    root, ext = os.path.splitext(path)
+    host = server_url.split('://', 1)[-1].rstrip('/')
+    safe = ''.join(c if c.isalnum() or c in '.-' else '_' for c in host)
+    return f"{root}.{safe}{ext}"
+
 def main():
     parser = argparse.ArgumentParser(description='GPU监控客户端')
-    parser.add_argument('--server', type=str, required=True, 
-                       help='服务端地址，例如: http://192.168.1.100:5000')
+    parser.add_argument('--server', type=str, required=True, nargs='+',
+                       help='服务端地址，可指定多个（同一份采样同时上报到所有服务端），例如: http://192.168.1.100:5000')
     parser.add_argument('--name', type=str, default=None,
                        help='服务器名称 (默认使用主机名)')
     parser.add_argument('--interval', type=int, default=5,
                        help='更新间隔（秒）(默认: 5)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='自适应采样间隔：指标变化时按 --min-interval 快速采样，空闲稳定时逐步放慢到 --max-interval')
+    parser.add_argument('--min-interval', type=float, default=1,
+                       help='自适应采样的最短间隔（秒）(默认: 1)')
+    parser.add_argument('--max-interval', type=float, default=30,
+                       help=f'自适应采样的最长间隔，也是心跳间隔，不能超过{HEARTBEAT_LIMIT}秒 (默认: 30)')
+    parser.add_argument('--sample-every', type=float, default=None,
+                       help='窗口聚合：在上报间隔内每隔多少秒采样一次（如0.25），上报时附带 min/max/mean/p95，'
+                            '建议配合 nvml 或 stream 采集方式 (默认: 关闭)')
+    parser.add_argument('--collector', choices=['auto', 'nvml', 'xml', 'stream'], default='auto',
+                       help='采集方式: nvml=通过NVML库直接读取, xml=每次调用 nvidia-smi -q -x, '
+                            'stream=常驻 nvidia-smi -lms 流式采集, auto=优先NVML，不可用时回退到xml (默认: auto)')
+    parser.add_argument('--nvidia-smi', type=str, default='nvidia-smi',
+                       help='nvidia-smi 可执行文件路径 (默认: nvidia-smi)')
+    parser.add_argument('--nvml-lib', type=str, default=None,
+                       help='libnvidia-ml 路径 (默认: libnvidia-ml.so.1)，设为 mock 使用模拟库测试')
+    parser.add_argument('--wire', choices=['json', 'binary'], default='json',
+                       help='上报格式: json, binary=紧凑的定长二进制格式，数值直接以数字发送（需要新版服务端）(默认: json)')
+    parser.add_argument('--compress', choices=['none', 'gzip', 'zstd'], default='none',
+                       help='压缩上报的请求体，zstd 需要安装 zstandard（需要新版服务端）(默认: none)')
+    parser.add_argument('--delta', action='store_true',
+                       help='增量上报：定期发送完整关键帧，其余样本只发送变化的字段（需要新版服务端）')
+    parser.add_argument('--keyframe-every', type=int, default=12,
+                       help='增量上报时每隔多少个样本发送一次关键帧 (默认: 12)')
+    parser.add_argument('--no-inventory', action='store_true',
+                       help='每个样本都携带GPU静态属性（型号、UUID、总显存等），不向服务端注册静态清单')
+    parser.add_argument('--process-util', action='store_true',
+                       help='常驻 nvidia-smi pmon 采集每个进程的SM和显存带宽使用率，合并到进程列表中')
+    parser.add_argument('--no-process-info', action='store_true',
+                       help='不从 /proc 读取进程的用户、命令行、容器ID和启动时间')
+    parser.add_argument('--no-host-metrics', action='store_true',
+                       help='不采集主机级指标（CPU、内存、负载、网络、磁盘IO）')
+    parser.add_argument('--queue-size', type=int, default=64,
+                       help='每个服务端的待发送样本队列长度，发送阻塞导致队列满时丢弃最旧的样本 (默认: 64)')
+    parser.add_argument('--spool', type=str, default=None,
+                       help='发送失败时缓存样本的文件，恢复连接后批量补传，设为空字符串关闭；'
+                            '多个服务端时按地址分别使用 <文件名>.<地址>.spool '
+                            '(默认: $XDG_STATE_HOME/gpu-monitor/<服务器名称>.spool，未设置时为 ~/.local/state)')
+    parser.add_argument('--spool-size', type=float, default=16,
+                       help='缓存文件大小（MB），写满后丢弃最旧的样本 (默认: 16)')
+    parser.add_argument('--record', type=str, default=None,
+                       help='把采集器读到的 nvidia-smi 原始输出（带时间戳）追加写入该文件，供 --replay 回放')
+    parser.add_argument('--replay', type=str, default=None,
+                       help='不调用 nvidia-smi，回放 --record 记录的输出（经过相同的解析和发送路径），回放完毕后退出')
+    parser.add_argument('--speed', type=float, default=1,
+                       help='回放倍速，各采样间隔同时按该倍数缩短 (默认: 1)')
+    parser.add_argument('--stats-every', type=int, default=12,
+                       help='每隔多少个样本在上报数据中附带一次客户端自身的耗时统计（采集、解析、发送等），0 关闭 (默认: 12)')
+    parser.add_argument('--stats-listen', type=str, default=None,
+                       help='在本地提供客户端自身指标的HTTP接口 GET /metrics，格式为 [地址:]端口 或 unix:路径，'
+                            '例如 127.0.0.1:9101 (默认: 关闭)')
+    parser.add_argument('--metrics', type=str, default='',
+                       help=f"附加采集的指标组，逗号分隔，可选: {','.join(OPTIONAL_METRICS)} (仅xml采集方式)")
     args = parser.parse_args()
     
     server_name = args.name if args.name else get_hostname()
+    if args.spool is None:
+        args.spool = default_spool_path(server_name)
+    metrics = [m.strip() for m in args.metrics.split(',') if m.strip()]
+    unknown = set(metrics) - set(OPTIONAL_METRICS)
+    if unknown:
+        parser.error(f"未知的指标组: {', '.join(sorted(unknown))}")
+    if args.compress == 'zstd' and zstandard is None:
+        parser.error("使用 --compress zstd 需要先安装 zstandard: pip install zstandard")
+    if args.delta and args.wire == 'binary':
+        parser.error("--delta 只支持JSON格式，不能与 --wire binary 同时使用")
+    if args.interval <= 0:
+        parser.error("--interval 必须大于0")
+    if args.sample_every is not None and args.sample_every <= 0:
+        parser.error("--sample-every 必须大于0")
+    if args.adaptive and not 0 < args.min_interval <= args.max_interval <= HEARTBEAT_LIMIT:
+        parser.error(f"自适应采样要求 0 < --min-interval <= --max-interval <= {HEARTBEAT_LIMIT}")
+    if args.replay and args.record:
+        parser.error("--record 和 --replay 不能同时使用")
+    if args.replay and args.process_util:
+        parser.error("--replay 不支持 --process-util")
+    if args.speed <= 0:
+        parser.error("--speed 必须大于0")
+    if args.stats_every < 0:
+        parser.error("--stats-every 不能小于0")
+    if args.replay and not os.path.exists(args.replay):
+        parser.error(f"记录文件不存在: {args.replay}")
+    # 回放时所有间隔按倍速缩短
+    speed = args.speed if args.replay else 1
     
     print(f"===========================================")
     print(f"GPU监控客户端启动")
     print(f"服务器名称: {server_name}")
-    print(f"目标服务端: {args.server}")
-    print(f"更新间隔: {args.interval}秒")
+    print(f"目标服务端: {', '.join(args.server)}")
+    if args.adaptive:
+        print(f"更新间隔: 自适应 {args.min_interval:g}-{args.max_interval:g}秒")
+    else:
+        print(f"更新间隔: {args.interval}秒")
+    if args.replay:
+        print(f"回放记录: {args.replay} ({speed:g}倍速)")
     print(f"===========================================")
     print()
     
-    consecutive_failures = 0
-    max_failures = 5
+    if args.adaptive:
+        scheduler = AdaptiveInterval(args.min_interval / speed, args.max_interval / speed)
+    else:
+        scheduler = AdaptiveInterval(args.interval / speed, args.interval / speed)
+    aggregator = WindowAggregator() if args.sample_every else None
+    sample_every = args.sample_every / speed if args.sample_every else None
+    sample_interval = min(sample_every, scheduler.min_interval) if aggregator else scheduler.min_interval
+    if args.replay:
+        collector = ReplayCollector(args.replay, speed, metrics)
+    else:
+        collector = create_collector(args.collector, sample_interval, nvidia_smi=args.nvidia_smi,
+                                     nvml_lib=args.nvml_lib, metrics=metrics)
+    if args.record:
+        collector.recorder = CollectorRecorder(args.record)
+        print(f"原始输出记录到: {args.record}")
+    print(f"采集方式: {collector.name}")
+    multiple = len(args.server) > 1
+    stats = ClientStats()
+    targets = []
+    for server_url in args.server:
+        link = ServerLink(server_url, compress=None if args.compress == 'none' else args.compress)
+        encoder = DeltaEncoder(args.keyframe_every) if args.delta else None
+        spool_path = target_spool_path(args.spool, server_url, multiple)
+        spool = None
+        if spool_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(spool_path)), exist_ok=True)
+                spool = SampleSpool(spool_path, args.spool_size)
+            except OSError as e:
+                print(f"⚠️  无法打开缓存文件 {spool_path}，断线期间的样本不会缓存 - {str(e)}")
+        if spool is not None and spool.count:
+            print(f"{spool_path} 中有 {spool.count} 条未发送的样本，将在连接恢复后补传")
+        inventory = None if args.no_inventory else StaticInventory()
+        targets.append(ReportTarget(link, encoder, spool, binary=args.wire == 'binary',
+                                    queue_size=args.queue_size, label=f"[{server_url}] " if multiple else '',
+                                    inventory=inventory, stats=stats))
+    stats.targets = targets
+    stats_server = start_stats_server(args.stats_listen, stats) if args.stats_listen else None
+    if stats_server is not None:
+        print(f"客户端指标接口: {args.stats_listen} (GET /metrics)")
     
-    while True:
-        try:
-            # 获取GPU信息
-            gpu_data = parse_gpu_info()
-            
-            if gpu_data is None:
-                print("⚠️  无法获取GPU信息，等待下次尝试...")
-                time.sleep(args.interval)
-                continue
-            
-            # 发送到服务端
-            success = send_data_to_server(args.server, server_name, gpu_data)
-            
-            if success:
-                consecutive_failures = 0
-                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                print(f"✅ [{current_time}] 数据发送成功 - {len(gpu_data)} 个GPU")
-            else:
-                consecutive_failures += 1
-                print(f"❌ 数据发送失败 (连续失败: {consecutive_failures}/{max_failures})")
-                
-                if consecutive_failures >= max_failures:
-                    print(f"⚠️  连续失败{max_failures}次，请检查网络连接和服务端状态")
-                    consecutive_failures = 0  # 重置计数器，继续尝试
-            
-        except KeyboardInterrupt:
-            print("\n\n收到中断信号，正在退出...")
-            break
-        except Exception as e:
-            print(f"❌ 发生未预期的错误: {str(e)}")
-        
-        # 等待指定间隔
-        time.sleep(args.interval)
+    # 采集线程按固定节拍产出样本，每个目标由自己的线程并行发送
+    # 回放时本机的 /proc 和主机指标与记录无关，不采集
+    process_info = None if args.no_process_info or args.replay else ProcessInfoCache()
+    host_metrics = None if args.no_host_metrics or args.replay else HostMetrics()
+    if host_metrics is not None and host_metrics.enabled:
+        print(f"主机指标单次采集耗时: {host_metrics.benchmark() * 1e6:.0f} µs")
+    process_util = PmonMonitor(args.nvidia_smi) if args.process_util else None
+    sampler = Sampler(collector, scheduler, server_name, targets, aggregator, sample_every,
+                      process_info, host_metrics, process_util, stats, args.stats_every)
+    sampler.start()
+    for target in targets:
+        target.start()
+    
+    exit_code = 0
+    try:
+        while not getattr(collector, 'finished', False):
+            if not sampler.is_alive():
+                # 采集线程只会因为无法恢复的错误退出，此时不再有样本产生，退出让守护进程重启客户端
+                print("❌ 采集线程意外退出，客户端退出")
+                exit_code = 1
+                break
+            time.sleep(0.2)
+        else:
+            # 回放完毕，等待队列中的样本发送完
+            deadline = time.monotonic() + 30
+            while any(not target.samples.empty() for target in targets) and time.monotonic() < deadline:
+                time.sleep(0.1)
+            print(f"回放完毕: {collector.replayed} 条记录，平均解析耗时 "
+                  f"{collector.parse_seconds / max(collector.replayed, 1) * 1e6:.0f} µs")
+    except KeyboardInterrupt:
+        print("\n\n收到中断信号，正在退出...")
+    finally:
+        sampler.stop()
+        for target in targets:
+            target.stop()
+        if stats_server is not None:
+            stats_server.shutdown()
+            stats_server.server_close()
+            if args.stats_listen.startswith('unix:'):
+                os.unlink(args.stats_listen[len('unix:'):])
+        collector.close()
+        if collector.recorder is not None:
+            collector.recorder.close()
+            print(f"已记录 {collector.recorder.records} 条原始输出到 {collector.recorder.path}")
+        if host_metrics is not None:
+            host_metrics.close()
+        if process_util is not None:
+            process_util.close()
+        for target in targets:
+            target.close()
+    if exit_code:
+        sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
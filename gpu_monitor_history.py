@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+"""
+GPU监控历史数据存储 - 按 epoch 时间桶对齐的列式环形缓冲（geek版服务端的历史图表使用）
+
+原始样本只保留最近1小时，同时逐个样本累加到1分钟、15分钟、1小时三级汇总桶（count/sum/min/max），
+各级分别保留12小时、7天、8周；查询时按时间范围选择最粗的、仍能给出足够点数的一级。
+可选的 SQLite 数据库（HistoryDB）持久保存原始样本（默认7天）和各级汇总（各自的保留时长），服务端重启后从中恢复各级历史。
+"""
+
+import math
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain, groupby
+from operator import itemgetter
+
+# 原始样本的时间桶秒数和每台服务器保留的桶数（1小时）
+HISTORY_INTERVAL = 5
+RAW_HISTORY_POINTS = 720
+# 汇总级别: (每个桶的秒数, 保留的桶数)
+ROLLUP_TIERS = [
+    (60, 720),     # 1分钟，12小时
+    (900, 672),    # 15分钟，7天
+    (3600, 1344),  # 1小时，8周
+]
+# 图表默认显示的点数
+HISTORY_POINTS = 100
+# 数据库后台写入: 每批最多的行数、最长的提交间隔（秒）、等待写入的行数上限
+HISTORY_DB_BATCH = 5000
+HISTORY_DB_FLUSH_SECONDS = 1.0
+HISTORY_DB_QUEUE_LIMIT = 500000
+# 数据库读取连接池的连接数
+HISTORY_DB_READERS = 4
+# 数据库保留原始点的天数（与15分钟一级的保留时长相同）
+HISTORY_DB_RAW_DAYS = 7
+
+class HistoryStore:
+    """按时间桶对齐的列式环形缓冲
+
+    时间按整数桶号 int(epoch秒 // interval) 划分，桶号 b 固定写入环形数组的位置 b % capacity。
+    每台服务器有自己的桶号数组（记录每个位置当前属于哪个桶）和若干指标列，每列是预分配的
+    float64 数组（array('d')），缺失值为 NaN；各服务器独立写入，互不影响，
+    同一时间桶内的多个样本以最后一个为准。每列固定占用 capacity × 8 字节，
+    最新桶号落后所有服务器中最新桶号一整圈的服务器连同它的列一起删除。
+    多台服务器叠加显示时由 overlay() 统一对齐到同一段桶号区间，可按 step 把连续的桶合并为一个点。
+    """
+
+    def __init__(self, capacity=RAW_HISTORY_POINTS, interval=HISTORY_INTERVAL):
+        self.capacity = capacity
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.buckets = {}  # {server_name: array('q')}，每个位置当前所属的桶号，-1 表示空
+        self.columns = {}  # {server_name: {(序列, 键): array('d')}}
+        self.labels = {}   # {server_name: {gpu_id: 当前序号}}
+        self.first = {}    # {server_name: 最早写入的桶号}
+        self.latest = {}   # {server_name: 最新写入的桶号}
+        self.end = None    # 所有服务器中最新的桶号
+
+    def bucket(self, timestamp):
+        """epoch秒所在的桶号"""
+        return int(timestamp // self.interval)
+
+    def slot(self, server_name, timestamp):
+        """返回样本应写入的位置，样本已滚出该服务器的保留范围时返回 None
+
+        时间桶第一次写入时清空该位置在这台服务器各列中的旧值。
+        """
+        bucket = self.bucket(timestamp)
+        slot = bucket % self.capacity
+        with self.lock:
+            buckets = self.buckets.get(server_name)
+            if buckets is None:
+                buckets = self.buckets[server_name] = array('q', [-1]) * self.capacity
+                self.columns[server_name] = {}
+                self.labels[server_name] = {}
+                self.first[server_name] = self.latest[server_name] = bucket
+            if bucket <= self.latest[server_name] - self.capacity:
+                return None
+            if buckets[slot] != bucket:
+                buckets[slot] = bucket
+                for column in self.columns[server_name].values():
+                    self._clear(column, slot)
+            self.first[server_name] = min(self.first[server_name], bucket)
+            if bucket > self.latest[server_name]:
+                self.latest[server_name] = bucket
+            if self.end is None or bucket > self.end:
+                self.end = bucket
+                for name in [name for name, latest in self.latest.items() if latest <= bucket - self.capacity]:
+                    del self.buckets[name], self.columns[name], self.labels[name], self.first[name], self.latest[name]
+            return slot
+
+    def record(self, server_name, slot, series, key, value):
+        """写入一个值；列在第一次写入时按环形数组长度预分配"""
+        with self.lock:
+            self._put(server_name, slot, series, key, value)
+
+    def _put(self, server_name, slot, series, key, value):
+        self._write(self._column(server_name, series, key), slot, value)
+
+    def _column(self, server_name, series, key):
+        columns = self.columns[server_name]
+        column = columns.get((series, key))
+        if column is None:
+            column = columns[(series, key)] = self._new_column()
+        return column
+
+    def label(self, server_name, gpu_id, index):
+        with self.lock:
+            self.labels[server_name][gpu_id] = index
+
+    def _new_column(self):
+        return array('d', [math.nan]) * self.capacity
+
+    def _clear(self, column, slot):
+        column[slot] = math.nan
+
+    def _write(self, column, slot, value):
+        column[slot] = math.nan if value is None else value
+
+    def _read(self, series, column, start, valid, step=1):
+        values = [value if ok and not math.isnan(value) else None
+                  for value, ok in zip(self._ordered(column, start), valid)]
+        if step == 1:
+            return values
+        # 合并后的点: *_peak 序列取最大值，其余序列取均值（一位小数），整段缺失为 None
+        merged = []
+        for i in range(0, len(values), step):
+            present = [value for value in values[i:i + step] if value is not None]
+            if not present:
+                merged.append(None)
+            elif series.endswith('_peak'):
+                merged.append(max(present))
+            else:
+                merged.append(round(sum(present) / len(present), 1))
+        return merged
+
+    def _ordered(self, column, start):
+        """从桶号 start 对应的位置起，按时间先后依次给出整圈的值（两段零拷贝切片）"""
+        view = memoryview(column)
+        offset = start % self.capacity
+        return chain(view[offset:], view[:offset])
+
+    def covers(self, start_time, end_time):
+        """保留范围是否覆盖 [start_time, end_time]（以 end_time 和最新数据中较晚的一个为准往前算）"""
+        newest = end_time if self.end is None else max(end_time, self.end * self.interval)
+        return newest - start_time <= self.capacity * self.interval
+
+    def step(self, start_time, end_time, points):
+        """[start_time, end_time] 内的桶数超过 points 时，每个点需要合并的桶数"""
+        count = self.bucket(end_time) - self.bucket(start_time) + 1
+        return max(1, -(-count // points))
+
+    def overlay(self, start_time=None, end_time=None, step=1):
+        """把所有服务器对齐到同一段桶号区间，可用 epoch 秒限定范围
+
+        返回 (区间起始桶号, 点数, {server_name: {(序列, 键): 值列表}})，值列表中缺失的桶为 None。
+        step 大于1时从起始桶号开始每 step 个连续的桶合并为一个点（最后一个点可能不足 step 个桶）。
+        每台服务器只比较一次桶号数组得到有效位置，各列再按位置整段取值，不做逐点查找。
+        """
+        with self.lock:
+            if self.end is None or not self.latest:
+                return 0, 0, {}
+            start = max(self.end - self.capacity + 1, min(self.first.values()))
+            end = self.end
+            if start_time is not None:
+                start = max(start, self.bucket(start_time))
+            if end_time is not None:
+                end = min(end, self.bucket(end_time))
+            count = max(end - start + 1, 0)
+            aligned = {}
+            for server_name, columns in self.columns.items():
+                valid = [bucket == start + i
+                         for i, bucket in enumerate(self._ordered(self.buckets[server_name], start))][:count]
+                aligned[server_name] = {key: self._read(key[0], column, start, valid, step)
+                                        for key, column in columns.items()}
+            return start, -(-count // step), aligned
+
+    def nbytes(self):
+        with self.lock:
+            columns = sum(len(columns) + 1 for columns in self.columns.values())
+        return columns * self.capacity * 8
+
+class RollupStore(HistoryStore):
+    """汇总级别：每个时间桶保存样本数、总和、最小值和最大值
+
+    每列是 (count, sum, min, max) 四个预分配数组，每个样本写入时直接累加，
+    读取时 *_peak 序列取最大值，其余序列取均值。
+    """
+
+    def _new_column(self):
+        return (array('d', [0.0]) * self.capacity, array('d', [0.0]) * self.capacity,
+                array('d', [math.nan]) * self.capacity, array('d', [math.nan]) * self.capacity)
+
+    def _clear(self, column, slot):
+        count, total, low, high = column
+        count[slot] = total[slot] = 0.0
+        low[slot] = high[slot] = math.nan
+
+    def _write(self, column, slot, value):
+        if value is None:
+            return
+        count, total, low, high = column
+        if count[slot]:
+            if value < low[slot]:
+                low[slot] = value
+            elif value > high[slot]:
+                high[slot] = value
+        else:
+            low[slot] = high[slot] = value
+        count[slot] += 1
+        total[slot] += value
+
+    def merge(self, server_name, slot, series, key, count, total, low, high):
+        """把一个桶的汇总值合并到位置 slot"""
+        with self.lock:
+            self._merge(self._column(server_name, series, key), slot, count, total, low, high)
+
+    def merge_many(self, server_name, series, key, rows):
+        """把一个序列的多个桶 [(序列ID, 桶号, count, sum, min, max)]（数据库 rollups() 的行）合并进来
+
+        桶号已占用对应位置时直接合并，只在位置属于别的桶时才调用 slot()（启动恢复时每台服务器每个桶一次）。
+        """
+        capacity = self.capacity
+        with self.lock:
+            buckets = self.buckets.get(server_name)
+            column = None
+            for _, bucket, count, total, low, high in rows:
+                slot = bucket % capacity
+                if buckets is None or buckets[slot] != bucket:
+                    if self.slot(server_name, bucket * self.interval) is None:
+                        continue
+                    buckets = self.buckets[server_name]
+                if column is None:
+                    counts, totals, lows, highs = column = self._column(server_name, series, key)
+                if counts[slot]:
+                    if low < lows[slot]:
+                        lows[slot] = low
+                    if high > highs[slot]:
+                        highs[slot] = high
+                else:
+                    lows[slot], highs[slot] = low, high
+                counts[slot] += count
+                totals[slot] += total
+
+    @staticmethod
+    def _merge(column, slot, count, total, low, high):
+        counts, totals, lows, highs = column
+        if counts[slot]:
+            if low < lows[slot]:
+                lows[slot] = low
+            if high > highs[slot]:
+                highs[slot] = high
+        else:
+            lows[slot], highs[slot] = low, high
+        counts[slot] += count
+        totals[slot] += total
+
+    def _read(self, series, column, start, valid, step=1):
+        count, total, low, high = column
+        counts = [n if ok else 0.0 for n, ok in zip(self._ordered(count, start), valid)]
+        if series.endswith('_peak'):
+            values = list(self._ordered(high, start))[:len(counts)]
+            return [max((value for value, n in zip(values[i:i + step], counts[i:i + step]) if n), default=None)
+                    for i in range(0, len(counts), step)]
+        # 合并多个桶时按样本数加权，与直接用更粗的桶汇总的结果相同
+        values = list(self._ordered(total, start))[:len(counts)]
+        merged = []
+        for i in range(0, len(counts), step):
+            n = sum(counts[i:i + step])
+            merged.append(round(sum(values[i:i + step]) / n, 1) if n else None)
+        return merged
+
+    def nbytes(self):
+        with self.lock:
+            columns = sum(len(columns) * 4 + 1 for columns in self.columns.values())
+        return columns * self.capacity * 8
+
+class TieredHistory:
+    """原始样本 + 多级汇总的历史数据
+
+    slot() 返回样本在每一级中的位置，record() 同时写入每一级（O(级数)），
+    各级共用一把锁。select() 按查询的时间范围和点数选择级别。
+    attach() 接入数据库后，每个写入的值（以及GPU序号的变化）同时交给数据库的后台线程保存。
+    """
+
+    def __init__(self, interval=HISTORY_INTERVAL, capacity=RAW_HISTORY_POINTS, rollups=ROLLUP_TIERS):
+        self.lock = threading.RLock()
+        self.tiers = [HistoryStore(capacity, interval)] + [RollupStore(points, seconds)
+                                                           for seconds, points in rollups]
+        for tier in self.tiers:
+            tier.lock = self.lock
+        self.db = None
+        self._labels = {}  # {(server_name, gpu_id): 已保存到数据库的序号}
+
+    @property
+    def retention(self):
+        """最长一级的保留秒数"""
+        return max(tier.capacity * tier.interval for tier in self.tiers)
+
+    @property
+    def interval(self):
+        return self.tiers[0].interval
+
+    def slot(self, server_name, timestamp):
+        """返回样本的时间和在各级中的位置，所有级别都已滚出保留范围时返回 None"""
+        with self.lock:
+            slots = [tier.slot(server_name, timestamp) for tier in self.tiers]
+        return None if all(slot is None for slot in slots) else (timestamp, slots)
+
+    def record(self, server_name, point, series, key, value):
+        timestamp, slots = point
+        with self.lock:
+            for tier, slot in zip(self.tiers, slots):
+                if slot is not None:
+                    tier._put(server_name, slot, series, key, value)
+            if self.db is not None:
+                self.db.add((server_name, '' if key is None else key, timestamp, series, value))
+
+    def attach(self, db, now=None):
+        """从数据库恢复各级历史，之后写入的值同时保存到数据库；返回恢复的原始点数
+
+        原始级别按时间索引读取保留范围内的原始点，汇总级别直接读取数据库中该级保留范围内已汇总的桶，
+        不再从原始点重新统计；GPU序号从数据库恢复。恢复完成后才启动数据库的后台线程，
+        写入和清理不会与恢复同时进行。
+        """
+        now = time.time() if now is None else now
+        series = db.series()
+        restored = 0
+        with self.lock:
+            raw = self.tiers[0]
+            slots = {}  # {(server_name, 桶号): 位置}，按时间顺序读取时同一个桶的各序列只调用一次 slot()
+            for series_id, timestamp, value in db.since(now - raw.capacity * raw.interval):
+                server_name, key, name = series[series_id]
+                point = (server_name, int(timestamp // raw.interval))
+                slot = slots.get(point, -1)
+                if slot == -1:
+                    slot = slots[point] = raw.slot(server_name, timestamp)
+                if slot is not None:
+                    raw._put(server_name, slot, name, key or None, value)
+                    restored += 1
+            for tier in self.tiers[1:]:
+                rows = db.rollups(tier.interval, tier.bucket(now) - tier.capacity + 1)
+                for series_id, buckets in groupby(rows, itemgetter(0)):
+                    server_name, key, name = series[series_id]
+                    tier.merge_many(server_name, name, key or None, buckets)
+            for server_name, gpu_id, index in db.labels():
+                self._labels[(server_name, gpu_id)] = index
+                for tier in self.tiers:
+                    if server_name in tier.labels:
+                        tier.labels[server_name][gpu_id] = index
+            self.db = db
+        db.start()
+        return restored
+
+    def label(self, server_name, gpu_id, index):
+        with self.lock:
+            for tier in self.tiers:
+                if server_name in tier.labels:
+                    tier.label(server_name, gpu_id, index)
+            if self.db is not None and self._labels.get((server_name, gpu_id)) != index:
+                self._labels[(server_name, gpu_id)] = index
+                self.db.label(server_name, gpu_id, index)
+
+    def select(self, start_time, end_time, points):
+        """为 [start_time, end_time] 选择级别
+
+        只考虑保留范围能覆盖整个区间的级别：其中最粗的、仍能给出至少 points 个点的一级；
+        都不够 points 个点时取其中最细的一级。没有级别能覆盖时取保留最久的一级。
+        返回的级别可能有多于 points 个桶，由 overlay() 按 step() 合并。
+        """
+        covering = [tier for tier in self.tiers if tier.covers(start_time, end_time)]
+        if not covering:
+            return max(self.tiers, key=lambda tier: tier.capacity * tier.interval)
+        for tier in reversed(covering):
+            if (end_time - start_time) / tier.interval >= points:
+                return tier
+        return covering[0]
+
+    def nbytes(self):
+        return sum(tier.nbytes() for tier in self.tiers)
+
+class HistoryDB:
+    """历史数据的 SQLite 持久化（WAL 模式）
+
+    序列表 series(id, server, gpu, series) 把 服务器/GPU/序列 映射为整数ID，gpu 列为 GPU 的 UUID
+    （主机指标为指标名，服务器级的总显存为空串）；原始点每个值一行 points(series_id, ts, value)，
+    按 (series_id, ts) 和 ts 建索引，保留 raw_retention 秒。
+    各级汇总在写入时一并计算：每批原始点写入后在同一个事务中按 tiers 的各级桶宽统计 count/sum/min/max，
+    累加到 rollups(tier, series_id, bucket, ...)，每级只保留该级的保留时长；
+    GPU 当前序号保存在 labels 表中。启动恢复只按时间索引读取最近1小时的原始点和各级保留范围内的汇总行。
+    add() 只把行放入内存队列，由后台线程每攒够 batch 行或每隔 flush_interval 秒在一个事务中批量写入，
+    上报请求的耗时与磁盘无关；队列超过上限（磁盘长时间写不动）时丢弃新行并计数。
+    后台线程由 start() 启动（TieredHistory.attach() 恢复完历史之后），启动后和之后每小时清理一次。
+    读取使用固定的参数化 SQL（sqlite3 按语句文本缓存预编译结果），连接取自最多 readers 个连接的共享池。
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, server TEXT NOT NULL, gpu TEXT NOT NULL, '
+        'series TEXT NOT NULL, UNIQUE (server, gpu, series))',
+        'CREATE TABLE IF NOT EXISTS points (series_id INTEGER NOT NULL, ts REAL NOT NULL, value REAL)',
+        'CREATE INDEX IF NOT EXISTS points_series_ts ON points (series_id, ts)',
+        'CREATE INDEX IF NOT EXISTS points_ts ON points (ts)',
+        'CREATE TABLE IF NOT EXISTS rollups (tier INTEGER NOT NULL, series_id INTEGER NOT NULL, '
+        'bucket INTEGER NOT NULL, count INTEGER, total REAL, low REAL, high REAL, '
+        'PRIMARY KEY (tier, series_id, bucket)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS labels (server TEXT NOT NULL, gpu TEXT NOT NULL, position INTEGER, '
+        'PRIMARY KEY (server, gpu))',
+    ]
+    ADD_SERIES = 'INSERT OR IGNORE INTO series (server, gpu, series) VALUES (?, ?, ?)'
+    SERIES_ID = 'SELECT id FROM series WHERE server = ? AND gpu = ? AND series = ?'
+    SERIES = 'SELECT id, server, gpu, series FROM series'
+    LAST_POINT = 'SELECT MAX(rowid) FROM points'
+    INSERT = 'INSERT INTO points (series_id, ts, value) VALUES (?, ?, ?)'
+    # 把 rowid 大于 ? 的新点按桶累加到一级汇总（GROUP BY 和累加都在 SQLite 中完成）；
+    # NOT INDEXED 让 SQLite 按 rowid 范围只读这一批，而不是为了 GROUP BY 扫描整个 (series_id, ts) 索引
+    ROLLUP = ('INSERT INTO rollups (tier, series_id, bucket, count, total, low, high) '
+              'SELECT ?, series_id, CAST(ts / ? AS INTEGER), COUNT(value), SUM(value), MIN(value), MAX(value) '
+              'FROM points NOT INDEXED WHERE rowid > ? AND value IS NOT NULL GROUP BY series_id, CAST(ts / ? AS INTEGER) '
+              'ON CONFLICT (tier, series_id, bucket) DO UPDATE SET count = count + excluded.count, '
+              'total = total + excluded.total, low = MIN(low, excluded.low), high = MAX(high, excluded.high)')
+    LABEL = 'INSERT OR REPLACE INTO labels (server, gpu, position) VALUES (?, ?, ?)'
+    LABELS = 'SELECT server, gpu, position FROM labels'
+    RANGE = ('SELECT series.series, points.ts, points.value FROM series JOIN points ON points.series_id = series.id '
+             'WHERE series.server = ? AND series.gpu = ? AND points.ts >= ? AND points.ts <= ? ORDER BY points.ts')
+    SINCE = 'SELECT series_id, ts, value FROM points WHERE ts >= ? ORDER BY ts'
+    ROLLUPS = ('SELECT series_id, bucket, count, total, low, high FROM rollups '
+               'WHERE tier = ? AND bucket >= ? ORDER BY series_id, bucket')
+    PRUNE = 'DELETE FROM points WHERE ts < ?'
+    PRUNE_ROLLUPS = 'DELETE FROM rollups WHERE tier = ? AND bucket < ?'
+
+    def __init__(self, path, raw_retention=None, tiers=ROLLUP_TIERS, batch=HISTORY_DB_BATCH,
+                 flush_interval=HISTORY_DB_FLUSH_SECONDS, queue_limit=HISTORY_DB_QUEUE_LIMIT,
+                 readers=HISTORY_DB_READERS):
+        self.path = path
+        self.raw_retention = raw_retention
+        self.tiers = tiers
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.written = 0
+        self.commits = 0
+        self.dropped = 0
+        self._pending = deque()
+        self._labels = deque()
+        self._series = {}  # 写入线程的 (server, gpu, series) → id 缓存
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._writer = None
+        self._readers = queue.LifoQueue()
+        self._reader_slots = threading.Semaphore(readers)
+        self._reader_conns = []
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def start(self):
+        """启动后台写入线程（之前 add() 的行在队列中等待）"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, daemon=True)
+            self._writer.start()
+
+    def add(self, row):
+        """(server, gpu, ts, series, value) 放入写入队列"""
+        if len(self._pending) >= self.queue_limit:
+            self.dropped += 1
+            return
+        self._pending.append(row)
+        if len(self._pending) >= self.batch:
+            self._wake.set()
+
+    def label(self, server_name, gpu, position):
+        """记录GPU的当前序号（只在变化时调用）"""
+        self._labels.append((server_name, gpu, position))
+
+    def _series_id(self, conn, server_name, gpu, series):
+        key = (server_name, gpu, series)
+        conn.execute(self.ADD_SERIES, key)
+        series_id = self._series[key] = conn.execute(self.SERIES_ID, key).fetchone()[0]
+        return series_id
+
+    def _write(self, conn, rows):
+        """一个事务写入一批原始点，并把它们累加到各级汇总"""
+        ids = self._series
+        points = []
+        for server_name, gpu, ts, series, value in rows:
+            series_id = ids.get((server_name, gpu, series)) or self._series_id(conn, server_name, gpu, series)
+            points.append((series_id, ts, value))
+        (last,) = conn.execute(self.LAST_POINT).fetchone()
+        conn.executemany(self.INSERT, points)
+        for interval, _ in self.tiers:
+            conn.execute(self.ROLLUP, (interval, interval, last or 0, interval))
+
+    def _run(self):
+        conn = self._connect()
+        last_prune = 0
+        while True:
+            closing = self._closed.is_set()
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while self._pending:
+                rows = [self._pending.popleft() for _ in range(min(self.batch, len(self._pending)))]
+                try:
+                    with conn:
+                        self._write(conn, rows)
+                    self.written += len(rows)
+                    self.commits += 1
+                except sqlite3.Error as e:
+                    self._series.clear()  # 回滚的事务中新建的序列ID无效
+                    print(f"写入历史数据库失败: {e}")
+            if self._labels:
+                labels = [self._labels.popleft() for _ in range(len(self._labels))]
+                try:
+                    with conn:
+                        conn.executemany(self.LABEL, labels)
+                except sqlite3.Error as e:
+                    print(f"写入历史数据库失败: {e}")
+            if time.time() - last_prune >= 3600:
+                last_prune = time.time()
+                self._prune(conn, last_prune)
+            if closing:
+                break
+        conn.close()
+
+    def _prune(self, conn, now):
+        """删除超过 raw_retention 的原始点，以及超过各级保留时长的汇总"""
+        try:
+            with conn:
+                if self.raw_retention:
+                    conn.execute(self.PRUNE, (now - self.raw_retention,))
+                for interval, points in self.tiers:
+                    conn.execute(self.PRUNE_ROLLUPS, (interval, int(now // interval) - points))
+        except sqlite3.Error as e:
+            print(f"清理历史数据库失败: {e}")
+
+    def close(self):
+        """写完队列中的行后停止后台线程，关闭读取连接"""
+        if self._writer is not None:
+            self._closed.set()
+            self._wake.set()
+            self._writer.join()
+        for conn in self._reader_conns:
+            conn.close()
+
+    @contextmanager
+    def _reader(self):
+        """从共享池借用一个读取连接，池中没有空闲连接且已达上限时等待"""
+        with self._reader_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                self._reader_conns.append(conn)
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+
+    def range(self, server_name, gpu, start, end):
+        """一块GPU（或一个服务器级指标）在 [start, end] 内的原始点: [(series, ts, value)]"""
+        with self._reader() as conn:
+            return conn.execute(self.RANGE, (server_name, gpu, start, end)).fetchall()
+
+    def series(self):
+        """{series_id: (server, gpu, series)}"""
+        with self._reader() as conn:
+            return {row[0]: row[1:] for row in conn.execute(self.SERIES)}
+
+    def labels(self):
+        """[(server, gpu, 序号)]"""
+        with self._reader() as conn:
+            return conn.execute(self.LABELS).fetchall()
+
+    def since(self, start):
+        """start 之后的原始点 (series_id, ts, value)，按时间排序（按 ts 索引读取）"""
+        with self._reader() as conn:
+            yield from conn.execute(self.SINCE, (start,))
+
+    def rollups(self, interval, start_bucket):
+        """桶宽为 interval 的一级中桶号不小于 start_bucket 的汇总 (series_id, bucket, count, sum, min, max)，
+        按序列和桶号排序"""
+        with self._reader() as conn:
+            yield from conn.execute(self.ROLLUPS, (interval, start_bucket))
+
+if __name__ == '__main__':
+    # 写入基准: 20台服务器 × 8块GPU，每个样本约40个值，按服务端 store_sample 的方式写入内存历史和数据库
+    import os
+    import tempfile
+
+    servers, gpus, samples = 20, 8, 20000
+    host_fields = ('cpu_percent', 'iowait_percent', 'mem_percent')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.db')
+        history = TieredHistory()
+        db = HistoryDB(path, raw_retention=HISTORY_DB_RAW_DAYS * 86400)
+        history.attach(db)
+        now = time.time() - samples // servers * HISTORY_INTERVAL
+        start = time.perf_counter()
+        for i in range(samples):
+            server_name = f'server{i % servers}'
+            point = history.slot(server_name, now + i // servers * HISTORY_INTERVAL)
+            history.record(server_name, point, 'total_memory_percent', None, i % 100)
+            for gpu in range(gpus):
+                gpu_id = f'GPU-{gpu}'
+                history.label(server_name, gpu_id, gpu)
+                for series in ('gpu_memory', 'gpu_memory_peak', 'gpu_utilization', 'gpu_utilization_peak'):
+                    history.record(server_name, point, series, gpu_id, (i + gpu) % 100)
+            for field in host_fields:
+                history.record(server_name, point, 'host', field, i % 100)
+        accepted = time.perf_counter() - start
+        db.close()
+        committed = time.perf_counter() - start
+        print(f"样本: {samples}，数据库行: {db.written}，事务: {db.commits}，丢弃: {db.dropped}")
+        print(f"接收: {samples / accepted:.0f} 样本/秒（每个样本 {accepted / samples * 1e6:.0f} µs，含内存历史）")
+        print(f"落盘: {samples / committed:.0f} 样本/秒，{db.written / committed:.0f} 行/秒（含各级汇总的累加）")
+
+        reader = HistoryDB(path)
+        start = time.perf_counter()
+        rows = reader.range('server0', 'GPU-0', now, now + 3600)
+        print(f"范围读取: 1小时 {len(rows)} 行，{(time.perf_counter() - start) * 1000:.2f} ms")
+        reader.close()
+
+    # 启动恢复基准: 同样规模，数据库中有 raw_hours 小时的原始点和各级保留时长内的全部汇总
+    # （1分钟12小时、15分钟7天、1小时8周），在 SQLite 中直接生成后测量 attach()
+    raw_hours = 6
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.db')
+        db = HistoryDB(path)
+        names = [(f'server{server}', '', 'total_memory_percent') for server in range(servers)]
+        names += [(f'server{server}', f'GPU-{gpu}', series) for server in range(servers) for gpu in range(gpus)
+                  for series in ('gpu_memory', 'gpu_memory_peak', 'gpu_utilization', 'gpu_utilization_peak')]
+        names += [(f'server{server}', field, 'host') for server in range(servers) for field in host_fields]
+        now = time.time()
+        start = time.perf_counter()
+        conn = db._connect()
+        with conn:
+            conn.executemany(HistoryDB.ADD_SERIES, names)
+            conn.executemany(HistoryDB.LABEL, [(f'server{server}', f'GPU-{gpu}', gpu)
+                                               for server in range(servers) for gpu in range(gpus)])
+            conn.execute('WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ?) '
+                         'INSERT INTO points (series_id, ts, value) SELECT id, ? - i * ?, i % 100 FROM n, series',
+                         (raw_hours * 3600 // HISTORY_INTERVAL - 1, now, HISTORY_INTERVAL))
+            for seconds, points in ROLLUP_TIERS:
+                conn.execute('WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ?) '
+                             'INSERT INTO rollups (tier, series_id, bucket, count, total, low, high) '
+                             'SELECT ?, id, ? - i, ?, ? * 50, 0, 100 FROM n, series',
+                             (points - 1, seconds, int(now // seconds), seconds // HISTORY_INTERVAL,
+                              seconds // HISTORY_INTERVAL))
+        raw_rows = conn.execute('SELECT COUNT(*) FROM points').fetchone()[0]
+        rollup_rows = conn.execute('SELECT COUNT(*) FROM rollups').fetchone()[0]
+        conn.close()
+        print(f"生成恢复基准数据库: {len(names)} 个序列，{raw_rows} 个原始点（{raw_hours}小时），"
+              f"{rollup_rows} 个汇总桶，{time.perf_counter() - start:.1f} s，"
+              f"{os.path.getsize(path) / 1024 / 1024:.0f} MB")
+        history = TieredHistory()
+        start = time.perf_counter()
+        restored = history.attach(db, now)
+        print(f"启动恢复: {restored} 个原始点 + {rollup_rows} 个汇总桶，{time.perf_counter() - start:.2f} s，"
+              f"内存历史 {history.nbytes() / 1024 / 1024:.0f} MB")
+        db.close()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+GPU监控服务端公共部分 - 三个版本的服务端共用的样本入库和 API 接口
+各服务端创建一个 MonitorState，并注册 create_blueprint(state) 返回的 Blueprint：
+/api/update、/api/register、/api/update/batch、/api/data、/api/process_events、/api/process_history
+"""
+
+import json
+import time
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+
+from gpu_monitor_protocol import (BATCH_PATH, REGISTER_PATH, BodyTooLarge, DeltaBaseMismatch, InventoryStore,
+                                  ProcessEventLog, ProcessHistory, ResponseCache, SpoolProgress, StateStore,
+                                  UnknownInventory, UnsupportedSchema, cached_response, expand_sample,
+                                  process_table_events, normalize_sample, read_json, read_sample)
+
+# 数据过期时间（秒）
+DATA_TIMEOUT = 60
+# 页面和 /api/data 含在线状态和当前时间，缓存最多复用的秒数
+RESPONSE_CACHE_SECONDS = 5
+
+def sample_time(data):
+    """样本自带的采集时间（客户端本地时间），无法解析时使用当前时间"""
+    try:
+        return datetime.strptime(data.get('timestamp'), '%Y-%m-%d %H:%M:%S').timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+def rejected(error):
+    """无法处理的请求返回 400；error 字段区分不支持的样本格式版本（客户端改发旧版格式）和其他无效请求。
+    解压后超过上限的请求体返回 413。"""
+    if isinstance(error, BodyTooLarge):
+        return jsonify({'status': 'error', 'message': str(error), 'error': 'too_large'}), 413
+    code = 'unsupported_schema' if isinstance(error, UnsupportedSchema) else 'invalid_sample'
+    return jsonify({'status': 'error', 'message': str(error), 'error': code}), 400
+
+class MonitorState:
+    """服务端的全部共享状态
+
+    gpu_data: 各服务器的最新样本（写入时复制的只读快照，读取方不加锁）
+    spool_progress: 各客户端缓存已补传入库的最大样本序号（补传按样本去重）
+    process_history / process_events: 每个GPU进程最近的使用率、进程启动/结束事件
+    inventory: 客户端注册的GPU静态清单，样本中只带动态字段
+    response_cache: 页面和API响应按数据版本（gpu_data.version，每次入库加一）缓存压缩结果
+    服务端需要在入库时额外处理样本（如 geek 版记录历史图表）时用 on_store 注册回调。
+    """
+
+    def __init__(self, data_timeout=DATA_TIMEOUT, cache_seconds=RESPONSE_CACHE_SECONDS):
+        self.data_timeout = data_timeout
+        self.cache_seconds = cache_seconds
+        self.gpu_data = StateStore()
+        self.spool_progress = SpoolProgress()
+        self.process_history = ProcessHistory()
+        self.process_events = ProcessEventLog()
+        self.inventory = InventoryStore()
+        self.response_cache = ResponseCache()
+        self._store_hooks = []
+
+    def on_store(self, hook):
+        """注册入库回调 hook(server_name, data, sampled_at)，在新样本发布之前调用；可用作装饰器"""
+        self._store_hooks.append(hook)
+        return hook
+
+    def page_version(self):
+        """页面类响应的缓存版本：数据版本 + 时间片"""
+        return (self.gpu_data.version, int(time.time() // self.cache_seconds))
+
+    def servers(self):
+        """各服务器的最新数据及在线状态（用于页面和 /api/data）"""
+        current_timestamp = time.time()
+        servers = {}
+        for server_name, data in self.gpu_data.snapshot().items():
+            servers[server_name] = {
+                'online': (current_timestamp - data.get('last_update', 0)) < self.data_timeout,
+                'timestamp': data.get('timestamp', 'N/A'),
+                'gpus': data.get('gpus', []),
+                'host': data.get('host'),
+                'client_stats': data.get('client_stats')
+            }
+        return servers
+
+    def store_sample(self, server_name, data, sampled_at=None):
+        """保存一条样本（旧版字符串字段在此统一转换为数值）
+
+        实时样本 sampled_at 为 None；补传样本传入其采集时间（秒），供入库回调按采集时间记录。
+        """
+        data = normalize_sample(data)
+        record = {
+            'timestamp': data.get('timestamp'),
+            'gpus': data.get('gpus', []),
+            'host': data.get('host'),
+            'client_stats': data.get('client_stats'),
+            'seq': data.get('seq'),
+            'last_update': time.time()
+        }
+        for hook in self._store_hooks:
+            hook(server_name, data, sampled_at)
+        self.process_history.record(server_name, data.get('gpus', []), data.get('timestamp'))
+        # 回调和进程记录写完后再发布，读取方看到新版本时这些数据也已更新；
+        # 客户端每隔若干个样本才附带一次自身的耗时统计，中间的样本沿用上一次的
+        self.gpu_data.put(server_name, record, sticky=('client_stats',))
+
+def create_blueprint(state):
+    """返回注册了公共接口的 Blueprint，各接口读写 state"""
+    api = Blueprint('gpu_monitor', __name__)
+
+    @api.route('/api/update', methods=['POST'])
+    def update_gpu_data():
+        """接收客户端发送的GPU数据"""
+        try:
+            data = read_sample(request)
+            server_name = data.get('server_name', 'unknown')
+
+            # 增量样本基于上一条已确认的样本还原，再按清单补全静态字段；顺带得到进程启动/结束事件
+            events = []
+            try:
+                data = expand_sample(data, state.gpu_data.get(server_name), events)
+            except DeltaBaseMismatch as e:
+                return jsonify({'status': 'error', 'message': str(e), 'need_keyframe': True}), 409
+            try:
+                data = state.inventory.expand(data)
+            except UnknownInventory as e:
+                return jsonify({'status': 'error', 'message': str(e), 'need_register': True}), 409
+
+            state.store_sample(server_name, data)
+            state.process_events.record(server_name, events, data.get('timestamp'))
+
+            return jsonify({'status': 'success', 'message': 'Data updated', 'ack_seq': data.get('seq')}), 200
+        except Exception as e:
+            return rejected(e)
+
+    @api.route(REGISTER_PATH, methods=['POST'])
+    def register_inventory():
+        """客户端注册GPU静态清单，返回之后样本中引用的清单ID"""
+        try:
+            data = normalize_sample(read_json(request))
+            inventory_id = state.inventory.register(data.get('server_name', 'unknown'), data.get('gpus', []))
+            return jsonify({'status': 'success', 'inventory_id': inventory_id}), 200
+        except Exception as e:
+            return rejected(e)
+
+    @api.route(BATCH_PATH, methods=['POST'])
+    def update_gpu_data_batch():
+        """接收客户端断线期间缓存的样本（按时间顺序，gzip压缩，带缓存ID和每条样本的序号）
+
+        补传的样本按各自的采集时间入库，而不是按接收时间。
+        整批先解析和校验，全部有效才入库；序号不大于该缓存已入库最大序号的样本跳过，
+        重试（即使批次边界变了）不会重复入库。同一个缓存的批次仍在处理时返回 409（客户端稍后重试）。
+        """
+        try:
+            data = read_json(request)
+            server_name = data.get('server_name', 'unknown')
+            samples = [normalize_sample(sample) for sample in data.get('samples', [])]
+            for sample in samples:
+                if not isinstance(sample.get('gpus', []), list):
+                    raise ValueError("样本的 gpus 字段必须是列表")
+            spool_id = data.get('spool_id')
+            seqs = data.get('seqs') if spool_id else [0] * len(samples)
+            if (not isinstance(seqs, list) or len(seqs) != len(samples) or
+                    not all(isinstance(seq, int) for seq in seqs)):
+                raise ValueError("seqs 必须是与 samples 等长的整数列表")
+        except Exception as e:
+            return rejected(e)
+
+        if spool_id and not state.spool_progress.begin(spool_id):
+            return jsonify({'status': 'error', 'message': 'Batch in progress', 'retry': True}), 409
+        stored = skipped = 0
+        try:
+            done = state.spool_progress.stored(spool_id) if spool_id else 0
+            for seq, sample in zip(seqs, samples):
+                if spool_id and seq <= done:
+                    skipped += 1
+                    continue
+                previous = state.gpu_data.get(server_name)
+                state.store_sample(server_name, sample, sample_time(sample))
+                if previous:
+                    state.process_events.record(
+                        server_name, process_table_events(previous['gpus'], state.gpu_data.get(server_name)['gpus']),
+                        sample.get('timestamp'))
+                if spool_id:
+                    state.spool_progress.advance(spool_id, seq)
+                stored += 1
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+        finally:
+            if spool_id:
+                state.spool_progress.end(spool_id)
+        return jsonify({'status': 'success', 'message': 'Batch stored', 'count': stored, 'skipped': skipped}), 200
+
+    @api.route('/api/data')
+    def get_data():
+        """API接口 - 返回JSON格式的数据"""
+        return cached_response(request, state.response_cache, 'data', state.page_version(),
+                               lambda: json.dumps(state.servers()), 'application/json')
+
+    @api.route('/api/process_events')
+    def get_process_events():
+        """返回最近的GPU进程启动/结束事件，可用 ?server=名称 过滤
+
+        缓存按参数区分，只缓存不过滤和过滤已知服务器的响应，任意的 ?server= 取值不会让缓存无限增长。
+        """
+        server_name = request.args.get('server')
+        if server_name is not None and state.gpu_data.get(server_name) is None:
+            return jsonify(state.process_events.snapshot(server_name))
+        return cached_response(request, state.response_cache, f"process_events:{server_name}", state.gpu_data.version,
+                               lambda: json.dumps(state.process_events.snapshot(server_name)), 'application/json')
+
+    @api.route('/api/process_history')
+    def get_process_history():
+        """返回每个GPU进程最近的SM/显存带宽使用率和显存占用"""
+        return cached_response(request, state.response_cache, 'process_history', state.gpu_data.version,
+                               lambda: json.dumps(state.process_history.snapshot()), 'application/json')
+
+    return api
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+NVML模拟库 - 在没有GPU的机器上测试客户端的NVML采集
+运行方式: python gpu_monitor_client.py --server http://your-server:5000 --collector nvml --nvml-lib mock
+"""
+
+import time
+
+NVML_SUCCESS = 0
+NVML_ERROR_INVALID_ARGUMENT = 2
+NVML_ERROR_NOT_FOUND = 6
+NVML_ERROR_INSUFFICIENT_SIZE = 7
+
+MIB = 1024 * 1024
+DRIVER_VERSION = '535.104.05'
+
+# 默认模拟两块GPU，其中一块上有训练进程
+DEFAULT_DEVICES = [
+    {
+        'name': 'NVIDIA GeForce RTX 3090',
+        'uuid': 'GPU-00000000-mock-0000-0000-000000000000',
+        'pci_bus_id': '00000000:01:00.0',
+        'temperature': 45,
+        'memory_total': 24576 * MIB,
+        'memory_used': 1024 * MIB,
+        'power_limit': 350000,
+        'processes': [(4242, 'python train.py', 900 * MIB)],
+    },
+    {
+        'name': 'NVIDIA GeForce RTX 3090',
+        'uuid': 'GPU-00000001-mock-0000-0000-000000000000',
+        'pci_bus_id': '00000000:02:00.0',
+        'temperature': 38,
+        'memory_total': 24576 * MIB,
+        'memory_used': 0,
+        'power_limit': 350000,
+        'processes': [],
+    },
+]
+
+def _target(ref):
+    """取出 ctypes.byref() 包装的对象"""
+    return getattr(ref, '_obj', ref)
+
+class MockNvml:
+    """模拟 libnvidia-ml 的 ctypes 接口
+
+    方法名和参数与真实库一致（句柄为 c_void_p，输出参数为 byref），
+    利用率和功耗随时间变化，便于观察图表。
+    """
+
+    def __init__(self, devices=None):
+        self.devices = [dict(d) for d in (devices or DEFAULT_DEVICES)]
+        self.initialized = False
+        self.calls = 0
+
+    def _device(self, handle):
+        index = (handle.value or 0) - 1
+        if not self.initialized or not 0 <= index < len(self.devices):
+            return None
+        self.calls += 1
+        return self.devices[index]
+
+    def nvmlInit_v2(self):
+        self.initialized = True
+        return NVML_SUCCESS
+
+    def nvmlShutdown(self):
+        self.initialized = False
+        return NVML_SUCCESS
+
+    def nvmlSystemGetDriverVersion(self, buffer, size):
+        buffer.value = DRIVER_VERSION.encode()[:size.value - 1]
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetPciInfo_v3(self, handle, pci):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        _target(pci).busId = device['pci_bus_id'].encode()
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetCount_v2(self, count):
+        _target(count).value = len(self.devices)
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetHandleByIndex_v2(self, index, handle):
+        if not 0 <= index.value < len(self.devices):
+            return NVML_ERROR_INVALID_ARGUMENT
+        # 句柄从1开始，避免与空指针混淆
+        _target(handle).value = index.value + 1
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetName(self, handle, buffer, size):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        buffer.value = device['name'].encode()[:size.value - 1]
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetUUID(self, handle, buffer, size):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        buffer.value = device['uuid'].encode()[:size.value - 1]
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetTemperature(self, handle, sensor, temperature):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        _target(temperature).value = device['temperature']
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetUtilizationRates(self, handle, utilization):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        busy = 1 if device['processes'] else 0
+        _target(utilization).gpu = busy * (50 + int(time.time()) % 50)
+        _target(utilization).memory = busy * (20 + int(time.time()) % 30)
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetMemoryInfo(self, handle, memory):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        memory = _target(memory)
+        memory.total = device['memory_total']
+        memory.used = device['memory_used']
+        memory.free = device['memory_total'] - device['memory_used']
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetPowerUsage(self, handle, power):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        _target(power).value = 30000 + (200000 if device['processes'] else 0)
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetEnforcedPowerLimit(self, handle, limit):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        _target(limit).value = device['power_limit']
+        return NVML_SUCCESS
+
+    def nvmlDeviceGetComputeRunningProcesses_v3(self, handle, count, infos):
+        device = self._device(handle)
+        if device is None:
+            return NVML_ERROR_INVALID_ARGUMENT
+        count = _target(count)
+        processes = device['processes']
+        if count.value < len(processes):
+            count.value = len(processes)
+            return NVML_ERROR_INSUFFICIENT_SIZE
+        for info, (pid, _, used) in zip(infos, processes):
+            info.pid = pid
+            info.usedGpuMemory = used
+        count.value = len(processes)
+        return NVML_SUCCESS
+
+    def nvmlSystemGetProcessName(self, pid, buffer, size):
+        for device in self.devices:
+            for process_pid, name, _ in device['processes']:
+                if process_pid == pid.value:
+                    buffer.value = name.encode()[:size.value - 1]
+                    return NVML_SUCCESS
+        return NVML_ERROR_NOT_FOUND
+
+if __name__ == '__main__':
+    import gpu_monitor_client
+
+    collector = gpu_monitor_client.NvmlCollector('mock')
+    start = time.perf_counter()
+    for _ in range(1000):
+        gpus = collector.collect()
+    elapsed = (time.perf_counter() - start) / 1000
+    collector.close()
+    print(gpus)
+    print(f"平均采样耗时: {elapsed * 1e6:.1f} µs")
@@ -0,0 +1,737 @@
+#!/usr/bin/env python3
+"""
+GPU监控协议工具 - 客户端与各版本服务端共用的请求解码和批量上报辅助函数
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import math
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+from types import MappingProxyType
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖，未安装时只支持 gzip
+    zstandard = None
+
+# 批量上报接口路径
+BATCH_PATH = '/api/update/batch'
+# 静态清单注册接口路径
+REGISTER_PATH = '/api/register'
+# 不随样本变化的GPU静态属性，注册时发送一次，之后的样本按 uuid 引用
+STATIC_FIELDS = ['name', 'uuid', 'memory_total', 'power_limit', 'pci_bus_id', 'driver_version']
+# 服务端记住补传进度的客户端缓存数量
+SPOOL_PROGRESS_SIZE = 4096
+
+# 二进制上报格式
+BINARY_CONTENT_TYPE = 'application/x-gpu-monitor'
+BINARY_MAGIC = b'GPUM'
+BINARY_VERSION = 1
+# magic, 版本, 保留, GPU数量, 序号, 采集时间(epoch秒)
+BINARY_HEADER = struct.Struct('<4sBBHId')
+# 序号, 温度, 使用率, 已用显存, 总显存, 显存百分比, 功耗, 功耗上限, 进程数
+BINARY_GPU = struct.Struct('<H7fH')
+# pid, 进程显存
+BINARY_PROCESS = struct.Struct('<If')
+BINARY_STRING = struct.Struct('<H')
+# 进程的核心字段，其余字段作为附加字段编码
+PROCESS_CORE = {'pid', 'name', 'memory'}
+
+# 每个进程保留的历史点数，以及进程消失多久后删除其历史（秒）
+PROCESS_HISTORY_SIZE = 60
+PROCESS_HISTORY_IDLE = 600
+# 服务端保留的进程启动/结束事件条数
+PROCESS_EVENT_LOG_SIZE = 1000
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = 1024
+# 请求体解压后的上限（字节）；一批补传样本解压后通常只有几百KB
+MAX_DECODED_BODY = 32 * 1024 * 1024
+
+# 样本格式版本：1 = 旧版字符串字段（如 '1234 MiB'、'N/A'），
+# 2 = 带类型的样本，数值字段为数字（单位见 NUMERIC_FIELDS），缺失为 null
+SCHEMA_VERSION = 2
+
+# 服务端内部使用的数值字段（单位固定，缺失为 None）
+NUMERIC_FIELDS = [
+    'temperature',     # °C
+    'utilization',     # %
+    'memory_used',     # MiB
+    'memory_total',    # MiB
+    'memory_percent',  # %
+    'power_draw',      # W
+    'power_limit',     # W
+]
+# 旧版（schema 1）样本中带单位的字段；缺失时旧版客户端对这两个百分比字段发送 '0'
+LEGACY_UNITS = {'memory_used': 'MiB', 'memory_total': 'MiB', 'power_draw': 'W', 'power_limit': 'W'}
+LEGACY_ZERO_FIELDS = ('utilization', 'memory_percent')
+
+class BodyTooLarge(ValueError):
+    """解压后的请求体超过上限（服务端返回 413）"""
+
+def decode_body(raw, content_encoding=None, limit=MAX_DECODED_BODY):
+    """按 Content-Encoding 解压请求体
+
+    流式解压，最多输出 limit 字节，超过时抛出 BodyTooLarge，几KB的压缩炸弹不会解压出几GB的数据。
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return raw
+    if encoding in ('gzip', 'deflate'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(raw, limit + 1)
+        except zlib.error as e:
+            raise ValueError(f"请求体解压失败: {str(e)}")
+        if len(body) > limit:
+            raise BodyTooLarge(f"解压后的请求体超过 {limit} 字节")
+        if not decompressor.eof:
+            raise ValueError("请求体解压失败: 压缩数据不完整")
+        return body
+    if encoding == 'zstd' and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(raw)) as reader:
+                body = reader.read(limit + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"请求体解压失败: {str(e)}")
+        if len(body) > limit:
+            raise BodyTooLarge(f"解压后的请求体超过 {limit} 字节")
+        return body
+    raise ValueError(f"不支持的Content-Encoding: {content_encoding}")
+
+def compress_body(raw, encoding):
+    """按指定编码压缩（gzip 或 zstd）"""
+    if encoding == 'gzip':
+        return gzip.compress(raw, compresslevel=6)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError('未安装 zstandard，无法使用 zstd 压缩')
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return raw
+
+def choose_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择响应压缩方式，优先 zstd"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(name.strip().lower())
+    if zstandard is not None and 'zstd' in accepted:
+        return 'zstd'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+class ResponseCache:
+    """按数据版本缓存响应体及其压缩结果
+
+    每个接口只保留最新版本：版本不变时直接返回缓存，
+    不同压缩方式的结果在第一次请求时生成。
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, version, encoding, build):
+        """返回 name 在 version 下按 encoding 压缩的响应体，未缓存时调用 build() 生成"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                if encoding in entry[1]:
+                    return entry[1][encoding]
+                raw = entry[1][None]
+            else:
+                raw = None
+        if raw is None:
+            raw = build()
+            if isinstance(raw, str):
+                raw = raw.encode('utf-8')
+        body = raw if encoding is None else compress_body(raw, encoding)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != version:
+                entry = (version, {None: raw})
+                self._entries[name] = entry
+            entry[1][encoding] = body
+        return body
+
+def cached_response(request, cache, name, version, build, mimetype):
+    """生成按 Accept-Encoding 协商压缩、按版本缓存的 Flask 响应"""
+    from flask import Response  # 客户端也会导入本模块，但不依赖Flask
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    raw = cache.get(name, version, None, build)
+    if encoding is not None and len(raw) >= COMPRESS_MIN_SIZE:
+        body = cache.get(name, version, encoding, build)
+    else:
+        body, encoding = raw, None
+    response = Response(body, mimetype=mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def read_json(request):
+    """从Flask请求中读取（可能经过压缩的）JSON请求体"""
+    body = decode_body(request.get_data(), request.headers.get('Content-Encoding'))
+    return json.loads(body)
+
+def read_sample(request):
+    """读取 /api/update 的请求体，支持JSON和二进制格式"""
+    if request.mimetype == BINARY_CONTENT_TYPE:
+        body = decode_body(request.get_data(), request.headers.get('Content-Encoding'))
+        return decode_binary_sample(body)
+    return read_json(request)
+
+def parse_number(value):
+    """把 '1234 MiB'、'45'、'N/A' 之类的旧版字符串转换为数值，缺失返回 None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if isinstance(value, float) and math.isnan(value) else float(value)
+    try:
+        return float(str(value).split()[0])
+    except (ValueError, IndexError):
+        return None
+
+def normalize_gpu(gpu):
+    """把一块GPU的数据转换为数值记录（已是数值的字段保持不变）"""
+    record = dict(gpu)
+    for field in NUMERIC_FIELDS:
+        record[field] = parse_number(gpu.get(field))
+    if record['memory_percent'] is None and record['memory_used'] is not None and record['memory_total']:
+        record['memory_percent'] = round(record['memory_used'] / record['memory_total'] * 100, 1)
+    record['processes'] = [
+        dict(process, pid=_parse_pid(process.get('pid')), memory=parse_number(process.get('memory')))
+        for process in gpu.get('processes') or []
+    ]
+    return record
+
+def _parse_pid(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+class UnsupportedSchema(ValueError):
+    """样本的格式版本高于服务端支持的版本（或不是整数），客户端可改发旧版格式"""
+
+def normalize_sample(data):
+    """入库前统一转换一次，之后的各处处理都直接使用数值
+
+    新版客户端（schema >= 2）发送的已是数值，直接使用；旧版字符串样本在此解析一次。
+    """
+    schema = data.get('schema', 1)
+    if not isinstance(schema, int) or schema > SCHEMA_VERSION:
+        raise UnsupportedSchema(f"不支持的样本格式版本: {schema}")
+    if schema >= 2:
+        return data
+    if data.get('gpus'):
+        data = dict(data, gpus=[normalize_gpu(gpu) for gpu in data['gpus']])
+    return data
+
+def legacy_gpu(gpu):
+    """normalize_gpu 的逆转换：数值字段转回旧版字符串（'1234 MiB'、'45'、'N/A'）"""
+    record = dict(gpu)
+    for field in NUMERIC_FIELDS:
+        if field not in gpu:
+            continue
+        value = gpu[field]
+        if value is None and field in LEGACY_ZERO_FIELDS:
+            value = 0
+        record[field] = format_number(value, LEGACY_UNITS.get(field))
+    record['processes'] = [
+        dict(process, memory=format_number(process.get('memory'), 'MiB'))
+        for process in gpu.get('processes') or []
+    ]
+    return record
+
+def legacy_sample(data):
+    """把带类型的样本转换为旧版字符串格式（不带 schema），发给只认识旧版样本的服务端"""
+    data = {key: value for key, value in data.items() if key != 'schema'}
+    if data.get('gpus'):
+        data['gpus'] = [legacy_gpu(gpu) for gpu in data['gpus']]
+    return data
+
+def format_number(value, unit=None):
+    """模板过滤器：数值转为显示文本，缺失显示 N/A"""
+    # None、模板中不存在的字段（jinja2 的 Undefined 为假值）和空字符串都视为缺失
+    if value is None or (not value and value != 0):
+        return 'N/A'
+    text = str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+    return f"{text} {unit}" if unit else text
+
+def _pack_string(parts, text):
+    data = (text or '').encode('utf-8')[:0xFFFF]
+    parts.append(BINARY_STRING.pack(len(data)))
+    parts.append(data)
+
+def _unpack_string(body, offset):
+    (length,) = BINARY_STRING.unpack_from(body, offset)
+    offset += BINARY_STRING.size
+    return body[offset:offset + length].decode('utf-8'), offset + length
+
+def _float_or_nan(value):
+    value = parse_number(value)
+    return math.nan if value is None else value
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else round(value, 2)
+
+def encode_binary_sample(payload, seq=0):
+    """把样本编码为紧凑的二进制格式（数值字段为 float32，缺失为 NaN）
+
+    GPU 的型号、UUID 和进程名为长度前缀字符串，其余非核心字段放在每块GPU的 JSON 附加段中；
+    进程的附加字段（用户、命令行等）按进程顺序放在附加段的 _process_extras 里。
+    """
+    try:
+        sampled_at = datetime.strptime(payload['timestamp'], '%Y-%m-%d %H:%M:%S').timestamp()
+    except (KeyError, TypeError, ValueError):
+        sampled_at = math.nan
+    gpus = payload.get('gpus', [])
+    parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(gpus), seq, sampled_at)]
+    _pack_string(parts, payload.get('server_name'))
+    core = set(NUMERIC_FIELDS) | {'index', 'name', 'uuid', 'processes'}
+    for gpu in gpus:
+        processes = gpu.get('processes') or []
+        parts.append(BINARY_GPU.pack(
+            int(gpu.get('index', 0)),
+            *(_float_or_nan(gpu.get(field)) for field in NUMERIC_FIELDS),
+            len(processes)
+        ))
+        _pack_string(parts, gpu.get('name'))
+        _pack_string(parts, gpu.get('uuid'))
+        extras = {key: value for key, value in gpu.items() if key not in core}
+        process_extras = [{key: value for key, value in process.items() if key not in PROCESS_CORE}
+                          for process in processes]
+        if any(process_extras):
+            extras['_process_extras'] = process_extras
+        _pack_string(parts, json.dumps(extras, separators=(',', ':')) if extras else '')
+        for process in processes:
+            try:
+                pid = int(process.get('pid'))
+            except (TypeError, ValueError):
+                pid = 0
+            parts.append(BINARY_PROCESS.pack(pid, _float_or_nan(process.get('memory'))))
+            _pack_string(parts, process.get('name'))
+    # 样本级附加字段（如主机指标 host）放在末尾的 JSON 段，旧版解码器会忽略
+    extras = {key: value for key, value in payload.items()
+              if key not in ('schema', 'server_name', 'timestamp', 'gpus', 'seq')}
+    if extras:
+        _pack_string(parts, json.dumps(extras, separators=(',', ':')))
+    return b''.join(parts)
+
+def decode_binary_sample(body):
+    """把二进制样本直接解码为服务端使用的数值记录"""
+    magic, version, _, gpu_count, seq, sampled_at = BINARY_HEADER.unpack_from(body, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError('不是GPU监控二进制样本')
+    if version != BINARY_VERSION:
+        raise ValueError(f"不支持的二进制格式版本: {version}")
+    offset = BINARY_HEADER.size
+    server_name, offset = _unpack_string(body, offset)
+    gpus = []
+    for _ in range(gpu_count):
+        index, *values, process_count = BINARY_GPU.unpack_from(body, offset)
+        offset += BINARY_GPU.size
+        gpu = {'index': index}
+        gpu['name'], offset = _unpack_string(body, offset)
+        gpu['uuid'], offset = _unpack_string(body, offset)
+        extras, offset = _unpack_string(body, offset)
+        extras = json.loads(extras) if extras else {}
+        process_extras = extras.pop('_process_extras', None) or [{}] * process_count
+        gpu.update(extras)
+        gpu.update(zip(NUMERIC_FIELDS, map(_nan_to_none, values)))
+        processes = []
+        for _ in range(process_count):
+            pid, memory = BINARY_PROCESS.unpack_from(body, offset)
+            offset += BINARY_PROCESS.size
+            name, offset = _unpack_string(body, offset)
+            processes.append(dict(process_extras[len(processes)], pid=pid, name=name, memory=_nan_to_none(memory)))
+        gpu['processes'] = processes
+        gpus.append(gpu)
+    sample = {
+        'schema': SCHEMA_VERSION,
+        'server_name': server_name,
+        'timestamp': (None if math.isnan(sampled_at) else
+                      datetime.fromtimestamp(sampled_at).strftime('%Y-%m-%d %H:%M:%S')),
+        'gpus': gpus,
+    }
+    if offset < len(body):
+        extras, offset = _unpack_string(body, offset)
+        sample.update(json.loads(extras))
+    if seq:
+        sample['seq'] = seq
+        sample['keyframe'] = True
+    return sample
+
+class StateStore:
+    """各服务器最新状态的存储：写入时复制，读取不加锁
+
+    写入方在锁内复制当前映射、替换一台服务器的记录，再整体发布为新的只读快照；
+    读取方用 snapshot() 取得当前快照的引用后随意遍历，不会遇到
+    "dictionary changed size during iteration"，也不会读到写了一半的记录。
+    记录发布后不再修改（更新时整条替换）。version 随每次发布加一，用作响应缓存的版本号。
+    """
+
+    def __init__(self):
+        self._snapshot = MappingProxyType({})
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def get(self, server_name):
+        return self._snapshot.get(server_name)
+
+    def put(self, server_name, record, sticky=()):
+        """发布一台服务器的新记录；sticky 中的字段在新记录里为空时沿用上一条记录的值"""
+        with self._lock:
+            previous = self._snapshot.get(server_name)
+            if previous:
+                for field in sticky:
+                    if record.get(field) is None:
+                        record[field] = previous.get(field)
+            state = dict(self._snapshot)
+            state[server_name] = record
+            self._snapshot = MappingProxyType(state)
+            self.version += 1
+
+class SpoolProgress:
+    """每个客户端缓存（spool_id）已入库的最大样本序号，补传按样本去重
+
+    缓存中样本的序号严格递增，序号不大于已入库最大序号的样本是重复提交（例如上一批已入库但响应丢失，
+    重试时批次边界又因新写入的样本而变化），直接跳过。同一个缓存同时只处理一个批次。
+    """
+
+    def __init__(self, size=SPOOL_PROGRESS_SIZE):
+        self.size = size
+        self._stored = OrderedDict()
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    def begin(self, spool_id):
+        """开始处理该缓存的一个批次，已有批次在处理中时返回 False"""
+        with self._lock:
+            if spool_id in self._busy:
+                return False
+            self._busy.add(spool_id)
+            return True
+
+    def end(self, spool_id):
+        with self._lock:
+            self._busy.discard(spool_id)
+
+    def stored(self, spool_id):
+        """已入库的最大序号，没有记录时为 0"""
+        with self._lock:
+            return self._stored.get(spool_id, 0)
+
+    def advance(self, spool_id, seq):
+        """记下已入库的序号（每条样本入库后调用，中途失败时已入库的部分不会重复）"""
+        with self._lock:
+            self._stored[spool_id] = max(seq, self._stored.get(spool_id, 0))
+            self._stored.move_to_end(spool_id)
+            while len(self._stored) > self.size:
+                self._stored.popitem(last=False)
+
+class ProcessHistory:
+    """每个GPU进程最近若干个样本的环形缓冲（按 服务器 / GPU序号:pid 区分）
+
+    记录样本时间、SM使用率、显存带宽使用率和显存占用；进程消失超过 idle 秒后删除。
+    """
+
+    def __init__(self, size=PROCESS_HISTORY_SIZE, idle=PROCESS_HISTORY_IDLE):
+        self.size = size
+        self.idle = idle
+        self._servers = {}
+        self._lock = threading.Lock()
+
+    def record(self, server_name, gpus, timestamp=None):
+        now = time.time()
+        timestamp = timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            series = self._servers.setdefault(server_name, {})
+            for gpu in gpus:
+                for process in gpu.get('processes') or []:
+                    key = f"{gpu.get('index')}:{process.get('pid')}"
+                    entry = series.get(key)
+                    if entry is None:
+                        entry = series[key] = {'gpu': gpu.get('index'), 'pid': process.get('pid'),
+                                               'points': deque(maxlen=self.size)}
+                    entry['name'] = process.get('name')
+                    entry['last_seen'] = now
+                    entry['points'].append((timestamp, process.get('sm_util'),
+                                            process.get('mem_util'), process.get('memory')))
+            for key in [key for key, entry in series.items() if now - entry['last_seen'] > self.idle]:
+                del series[key]
+
+    def snapshot(self):
+        """按服务器整理为图表数据：各进程的序列对齐到该服务器的时间点并集，缺失为 None"""
+        with self._lock:
+            servers = {name: {key: dict(entry, points=list(entry['points'])) for key, entry in series.items()}
+                       for name, series in self._servers.items()}
+        result = {}
+        for server_name, series in servers.items():
+            timestamps = sorted({point[0] for entry in series.values() for point in entry['points']})
+            processes = {}
+            for key, entry in series.items():
+                by_time = {point[0]: point for point in entry['points']}
+                columns = [by_time.get(ts, (ts, None, None, None)) for ts in timestamps]
+                processes[key] = {
+                    'gpu': entry['gpu'],
+                    'pid': entry['pid'],
+                    'name': entry['name'],
+                    'sm_util': [point[1] for point in columns],
+                    'mem_util': [point[2] for point in columns],
+                    'memory': [point[3] for point in columns],
+                }
+            result[server_name] = {'timestamps': timestamps, 'processes': processes}
+        return result
+
+class ProcessEventLog:
+    """GPU进程启动/结束事件的环形日志（最新的在最后）"""
+
+    def __init__(self, size=PROCESS_EVENT_LOG_SIZE):
+        self._events = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, server_name, events, timestamp=None):
+        if not events:
+            return
+        timestamp = timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            for event in events:
+                self._events.append(dict(event, server_name=server_name, timestamp=timestamp))
+
+    def snapshot(self, server_name=None):
+        with self._lock:
+            events = list(self._events)
+        if server_name is not None:
+            events = [event for event in events if event['server_name'] == server_name]
+        return events
+
+def _process_event(kind, gpu, process):
+    return {'event': kind, 'gpu': gpu.get('index'), 'uuid': gpu.get('uuid'), 'pid': process.get('pid'),
+            'name': process.get('name'), 'user': process.get('user'), 'memory': process.get('memory')}
+
+def process_table_events(previous_gpus, gpus):
+    """比较两次完整的进程表，返回进程启动/结束事件（GPU按 UUID，旧版样本按序号对应）"""
+    def table(gpu_list):
+        return {(gpu.get('uuid') or gpu.get('index'), str(process.get('pid'))): (gpu, process)
+                for gpu in gpu_list for process in gpu.get('processes') or []}
+    before = table(previous_gpus)
+    after = table(gpus)
+    events = [_process_event('end', *before[key]) for key in before if key not in after]
+    events.extend(_process_event('start', *after[key]) for key in after if key not in before)
+    return events
+
+class UnknownInventory(Exception):
+    """样本引用的清单ID服务端不认识（如服务端重启），客户端需要重新注册"""
+
+def split_static(gpus):
+    """拆分为 (静态清单, 只含动态字段的GPU列表)；动态部分保留 uuid 用于关联清单"""
+    inventory = [{field: gpu.get(field) for field in STATIC_FIELDS} for gpu in gpus]
+    dynamic = [{field: value for field, value in gpu.items() if field == 'uuid' or field not in STATIC_FIELDS}
+               for gpu in gpus]
+    return inventory, dynamic
+
+def inventory_id(server_name, inventory):
+    """清单内容的哈希，相同的清单（包括服务端重启后重新注册）得到相同的ID"""
+    raw = json.dumps([server_name, inventory], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+class InventoryStore:
+    """服务端保存的GPU静态清单（按清单ID，每台服务器只保留最新的一份）
+
+    各样本中的静态字段直接引用清单中的同一对象，不再每次重复保存。
+    """
+
+    def __init__(self):
+        self._inventories = {}
+        self._by_server = {}
+        self._lock = threading.Lock()
+
+    def register(self, server_name, inventory):
+        key = inventory_id(server_name, inventory)
+        gpus = {gpu['uuid']: {field: gpu.get(field) for field in STATIC_FIELDS}
+                for gpu in inventory if gpu.get('uuid')}
+        with self._lock:
+            previous = self._by_server.get(server_name)
+            if previous != key:
+                self._inventories.pop(previous, None)
+                self._inventories[key] = {'server_name': server_name, 'gpus': gpus}
+                self._by_server[server_name] = key
+        return key
+
+    def get(self, key):
+        with self._lock:
+            return self._inventories.get(key)
+
+    def expand(self, data):
+        """给引用清单的样本补全各GPU的静态字段，不带 inventory_id 的样本原样返回"""
+        key = data.get('inventory_id')
+        if not key:
+            return data
+        inventory = self.get(key)
+        if inventory is None or inventory['server_name'] != data.get('server_name'):
+            raise UnknownInventory(f"未知的清单ID {key}")
+        static = inventory['gpus']
+        gpus = []
+        for gpu in data.get('gpus', []):
+            fields = static.get(gpu.get('uuid'))
+            if fields is None:
+                raise UnknownInventory(f"清单 {key} 中没有GPU {gpu.get('uuid')}")
+            gpus.append(dict(gpu, **fields))
+        return dict(data, gpus=gpus)
+
+def build_batch_body(server_name, samples, spool_id=None, seqs=None):
+    """把已序列化的样本（JSON bytes）拼成gzip压缩的批量请求体，避免重复编解码
+
+    spool_id 和 seqs（每条样本在缓存中的序号）供服务端按样本去重。
+    """
+    body = b'{"server_name":' + json.dumps(server_name).encode()
+    if spool_id is not None:
+        body += b',"spool_id":' + json.dumps(spool_id).encode() + b',"seqs":' + json.dumps(seqs).encode()
+    body += b',"samples":[' + b','.join(samples) + b']}'
+    return gzip.compress(body, compresslevel=6)
+
+class DeltaBaseMismatch(Exception):
+    """增量样本引用的基准与服务端保存的不一致，需要客户端重发关键帧"""
+
+def diff_processes(base_processes, processes):
+    """计算进程表相对 base_processes 的变化（按 pid 对应）
+
+    返回 {'added': [新进程], 'changed': {pid: 变化或新增的字段}, 'removed_fields': {pid: [不再上报的字段]},
+    'removed': [pid], 'order': [pid]}，省略空的部分。服务端按原顺序更新、新进程追加在末尾，
+    与新进程表的顺序不一致时才带 order。
+    """
+    base = {str(process.get('pid')): process for process in base_processes}
+    diff = {'added': [], 'changed': {}, 'removed_fields': {}}
+    for process in processes:
+        key = str(process.get('pid'))
+        old = base.pop(key, None)
+        if old is None:
+            diff['added'].append(process)
+        elif old != process:
+            changed = {field: value for field, value in process.items() if field not in old or old[field] != value}
+            if changed:
+                diff['changed'][key] = changed
+            removed_fields = [field for field in old if field not in process]
+            if removed_fields:
+                diff['removed_fields'][key] = removed_fields
+    diff['removed'] = [old.get('pid') for old in base.values()]
+    expected = [str(process.get('pid')) for process in base_processes if str(process.get('pid')) not in base]
+    expected += [str(process.get('pid')) for process in diff['added']]
+    if expected != [str(process.get('pid')) for process in processes]:
+        diff['order'] = [process.get('pid') for process in processes]
+    return {part: value for part, value in diff.items() if value}
+
+def apply_process_diff(base_processes, diff):
+    """把 diff_processes() 的结果应用到 base_processes，返回 (新的进程表, 结束的进程, 新启动的进程)"""
+    removed = {str(pid) for pid in diff.get('removed', [])}
+    changed = diff.get('changed', {})
+    removed_fields = diff.get('removed_fields', {})
+    processes = []
+    ended = []
+    for process in base_processes:
+        key = str(process.get('pid'))
+        if key in removed:
+            ended.append(process)
+        elif key in changed or key in removed_fields:
+            process = dict(process, **changed.get(key, {}))
+            for field in removed_fields.get(key, ()):
+                process.pop(field, None)
+            processes.append(process)
+        else:
+            processes.append(process)
+    added = diff.get('added', [])
+    processes.extend(added)
+    if 'order' in diff:
+        position = {str(pid): i for i, pid in enumerate(diff['order'])}
+        processes.sort(key=lambda process: position.get(str(process.get('pid')), len(position)))
+    return processes, ended, added
+
+def make_delta(base_gpus, gpus):
+    """计算 gpus 相对 base_gpus 的变化
+
+    返回 (changes, removed)：changes 以GPU序号（字符串）为键，只包含变化或新增的字段，
+    不再上报的字段列在 removed_fields 中，新出现的GPU包含全部字段；removed 为消失的GPU序号列表。
+    进程表变化时不发送整个 processes，而是 process_changes（见 diff_processes）。
+    """
+    base = {str(gpu.get('index')): gpu for gpu in base_gpus}
+    changes = {}
+    for gpu in gpus:
+        key = str(gpu.get('index'))
+        old = base.pop(key, None)
+        if old is None:
+            changes[key] = gpu
+            continue
+        changed = {field: value for field, value in gpu.items() if field not in old or old[field] != value}
+        if ('processes' in changed and isinstance(old.get('processes'), list) and isinstance(gpu['processes'], list)
+                and old.get('uuid') == gpu.get('uuid')):
+            changed['process_changes'] = diff_processes(old['processes'], changed.pop('processes'))
+        removed_fields = [field for field in old if field not in gpu]
+        if removed_fields:
+            changed['removed_fields'] = removed_fields
+        if changed:
+            changes[key] = changed
+    return changes, sorted(base)
+
+def apply_delta(base_gpus, changes, removed=(), events=None):
+    """把 make_delta() 的结果应用到 base_gpus，返回新的完整GPU列表
+
+    传入 events 列表时，顺带把进程表变化产生的启动/结束事件追加进去。
+    """
+    gpus = {str(gpu.get('index')): gpu for gpu in base_gpus}
+    # 消失的GPU、新出现的GPU和换了卡（UUID变化）的GPU带的是完整进程表，最后按 UUID 统一比较
+    replaced_before = [gpus.pop(key) for key in removed if key in gpus]
+    replaced_after = []
+    for key, changed in changes.items():
+        old = gpus.get(key)
+        gpu = dict(old or {})
+        gpu.update(changed)
+        for field in gpu.pop('removed_fields', ()):
+            gpu.pop(field, None)
+        process_changes = gpu.pop('process_changes', None)
+        if process_changes is not None:
+            gpu['processes'], ended, started = apply_process_diff(gpu.get('processes') or [], process_changes)
+            if events is not None:
+                events.extend(_process_event('end', gpu, process) for process in ended)
+                events.extend(_process_event('start', gpu, process) for process in started)
+        elif 'processes' in changed or old is None:
+            if old is not None:
+                replaced_before.append(old)
+            replaced_after.append(gpu)
+        gpus[key] = gpu
+    if events is not None and (replaced_before or replaced_after):
+        events.extend(process_table_events(replaced_before, replaced_after))
+    return sorted(gpus.values(), key=lambda gpu: int(gpu.get('index', 0)))
+
+def expand_sample(data, previous, events=None):
+    """把增量样本还原为完整样本
+
+    previous 为服务端保存的该服务器上一条记录（含 seq 和 gpus），
+    关键帧和不带 seq 的旧版样本原样返回。
+    传入 events 列表时追加进程启动/结束事件：增量样本直接取自进程表的变化，
+    完整样本与 previous 的进程表比较（没有 previous 时不产生事件）。
+    """
+    if 'changes' not in data:
+        if events is not None and previous:
+            events.extend(process_table_events(previous.get('gpus', []), data.get('gpus', [])))
+        return data
+    if not previous or previous.get('seq') != data.get('base_seq'):
+        raise DeltaBaseMismatch(f"base_seq {data.get('base_seq')} 与服务端记录不一致")
+    full = {key: value for key, value in data.items()
+            if key not in ('changes', 'removed', 'base_seq')}
+    full['gpus'] = apply_delta(previous.get('gpus', []), data['changes'], data.get('removed', []), events)
+    return full
@@ -4,19 +4,22 @@ GPU监控服务端 - 收集并展示所有服务器的GPU状态
 运行方式: python gpu_monitor_server.py --port 5000
 """
 
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, render_template_string, request
+from werkzeug.serving import WSGIRequestHandler
 from datetime import datetime
 import argparse
 import threading
 import time
+from gpu_monitor_ingest import DATA_TIMEOUT, MonitorState, create_blueprint
+from gpu_monitor_protocol import cached_response, format_number
 
 app = Flask(__name__)
+app.add_template_filter(format_number, 'num')
 
-# 存储所有服务器的GPU信息
-# 格式: {server_name: {timestamp: ..., gpus: [...], system_info: {...}}}
-gpu_data = {}
-# 数据过期时间（秒）
-DATA_TIMEOUT = 60
+# 服务端共享状态（各服务器的最新样本、进程记录、GPU清单、响应缓存等），
+# 样本入库和公共接口（/api/update、/api/data、批量补传等）见 gpu_monitor_ingest.py
+state = MonitorState()
+app.register_blueprint(create_blueprint(state))
 
 # HTML模板
 HTML_TEMPLATE = """
@@ -242,6 +245,33 @@ HTML_TEMPLATE = """
                         <span class="info-value">{{ server_data.timestamp }}</span>
                     </div>
                     
+                    {% if server_data.host %}
+                    {% set host = server_data.host %}
+                    <div class="gpu-info" style="margin-bottom: 15px;">
+                        <span class="info-label">主机:</span>
+                        <span class="info-value">
+                            CPU {{ host.cpu_percent|num }}% (iowait {{ host.iowait_percent|num }}%) ·
+                            内存 {{ host.mem_used|num('MiB') }} / {{ host.mem_total|num('MiB') }} ·
+                            负载 {{ host.load1|num }} / {{ host.load5|num }} / {{ host.load15|num }} ·
+                            网络 ↓{{ host.net_rx|num('MiB/s') }} ↑{{ host.net_tx|num('MiB/s') }} ·
+                            磁盘 读{{ host.disk_read|num('MiB/s') }} 写{{ host.disk_write|num('MiB/s') }}
+                        </span>
+                    </div>
+                    {% endif %}
+                    
+                    {% if server_data.client_stats %}
+                    {% set client = server_data.client_stats %}
+                    <div class="gpu-info" style="margin-bottom: 15px;">
+                        <span class="info-label">客户端耗时 (p95):</span>
+                        <span class="info-value">
+                            采集 {{ (client.stages.collect or {}).p95|num('ms') }}
+                            (nvidia-smi {{ (client.stages.smi or {}).p95|num('ms') }}, 解析 {{ (client.stages.parse or {}).p95|num('ms') }}) ·
+                            发送 {{ (client.stages.send or {}).p95|num('ms') }} ·
+                            CPU {{ client.cpu_percent|num }}% · 内存 {{ client.rss_mb|num('MiB') }}
+                        </span>
+                    </div>
+                    {% endif %}
+                    
                     <div class="gpu-grid">
                         {% for gpu in server_data.gpus %}
                         <div class="gpu-card">
@@ -249,34 +279,34 @@ HTML_TEMPLATE = """
                             
                             <div class="gpu-info">
                                 <span class="info-label">温度:</span>
-                                <span class="info-value">{{ gpu.temperature }}°C</span>
+                                <span class="info-value">{{ gpu.temperature|num }}°C</span>
                             </div>
                             
                             <div class="gpu-info">
                                 <span class="info-label">GPU使用率:</span>
-                                <span class="info-value">{{ gpu.utilization }}%</span>
+                                <span class="info-value">{{ gpu.utilization|num }}%{% if gpu.aggregates and gpu.aggregates.utilization %} (峰值 {{ gpu.aggregates.utilization.max|num }}%, p95 {{ gpu.aggregates.utilization.p95|num }}%){% endif %}</span>
                                 <div class="progress-bar">
-                                    <div class="progress-fill {{ 'progress-low' if gpu.utilization|int < 50 else ('progress-medium' if gpu.utilization|int < 80 else 'progress-high') }}" 
-                                         style="width: {{ gpu.utilization }}%">
-                                        {{ gpu.utilization }}%
+                                    <div class="progress-fill {{ 'progress-low' if (gpu.utilization or 0) < 50 else ('progress-medium' if (gpu.utilization or 0) < 80 else 'progress-high') }}" 
+                                         style="width: {{ gpu.utilization or 0 }}%">
+                                        {{ gpu.utilization|num }}%
                                     </div>
                                 </div>
                             </div>
                             
                             <div class="gpu-info">
                                 <span class="info-label">显存使用:</span>
-                                <span class="info-value">{{ gpu.memory_used }} / {{ gpu.memory_total }}</span>
+                                <span class="info-value">{{ gpu.memory_used|num('MiB') }} / {{ gpu.memory_total|num('MiB') }}</span>
                                 <div class="progress-bar">
-                                    <div class="progress-fill {{ 'progress-low' if gpu.memory_percent|int < 50 else ('progress-medium' if gpu.memory_percent|int < 80 else 'progress-high') }}" 
-                                         style="width: {{ gpu.memory_percent }}%">
-                                        {{ gpu.memory_percent }}%
+                                    <div class="progress-fill {{ 'progress-low' if (gpu.memory_percent or 0) < 50 else ('progress-medium' if (gpu.memory_percent or 0) < 80 else 'progress-high') }}" 
+                                         style="width: {{ gpu.memory_percent or 0 }}%">
+                                        {{ gpu.memory_percent|num }}%
                                     </div>
                                 </div>
                             </div>
                             
                             <div class="gpu-info">
                                 <span class="info-label">功耗:</span>
-                                <span class="info-value">{{ gpu.power_draw }} / {{ gpu.power_limit }}</span>
+                                <span class="info-value">{{ gpu.power_draw|num('W') }} / {{ gpu.power_limit|num('W') }}</span>
                             </div>
                             
                             {% if gpu.processes %}
@@ -284,8 +314,8 @@ HTML_TEMPLATE = """
                                 <div class="process-title">运行中的进程 ({{ gpu.processes|length }}):</div>
                                 {% for proc in gpu.processes %}
                                 <div class="process-item">
-                                    <span class="process-name">{{ proc.name }} (PID: {{ proc.pid }})</span>
-                                    <span class="process-memory">{{ proc.memory }}</span>
+                                    <span class="process-name" title="{{ proc.cmdline or proc.name }}">{{ proc.name }} (PID: {{ proc.pid }}{% if proc.user %}, {{ proc.user }}{% endif %}{% if proc.container %}, 容器 {{ proc.container }}{% endif %})</span>
+                                    <span class="process-memory">{% if proc.sm_util is not none %}SM {{ proc.sm_util|num }}% · 带宽 {{ proc.mem_util|num }}% · {% endif %}{{ proc.memory|num('MiB') }}</span>
                                 </div>
                                 {% endfor %}
                             </div>
@@ -313,7 +343,7 @@ def clean_old_data():
     while True:
         current_time = time.time()
         offline_servers = []
-        for server_name, data in gpu_data.items():
+        for server_name, data in state.gpu_data.snapshot().items():
             if current_time - data.get('last_update', 0) > DATA_TIMEOUT:
                 offline_servers.append(server_name)
         
@@ -321,58 +351,20 @@ def clean_old_data():
 
 @app.route('/')
 def index():
-    """主页面 - 显示所有服务器的GPU信息"""
+    """主页面 - 显示所有服务器的GPU信息（按版本缓存，按 Accept-Encoding 压缩）"""
+    return cached_response(request, state.response_cache, 'index', state.page_version(), render_index, 'text/html')
+
+def render_index():
+    """渲染主页面"""
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     # 准备数据
-    servers = {}
-    current_timestamp = time.time()
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
+    servers = state.servers()
     
     return render_template_string(HTML_TEMPLATE, 
                                  servers=servers,
                                  current_time=current_time)
 
-@app.route('/api/update', methods=['POST'])
-def update_gpu_data():
-    """接收客户端发送的GPU数据"""
-    try:
-        data = request.get_json()
-        server_name = data.get('server_name', 'unknown')
-        
-        gpu_data[server_name] = {
-            'timestamp': data.get('timestamp'),
-            'gpus': data.get('gpus', []),
-            'last_update': time.time()
-        }
-        
-        return jsonify({'status': 'success', 'message': 'Data updated'}), 200
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 400
-
-@app.route('/api/data')
-def get_data():
-    """API接口 - 返回JSON格式的数据"""
-    current_timestamp = time.time()
-    servers = {}
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
-    
-    return jsonify(servers)
-
 def main():
     parser = argparse.ArgumentParser(description='GPU监控服务端')
     parser.add_argument('--port', type=int, default=5000, help='服务端口 (默认: 5000)')
@@ -389,7 +381,9 @@ def main():
     print(f"如果使用端口转发，请将客户端配置为您的公网地址")
     print(f"===========================================")
     
-    app.run(host=args.host, port=args.port, debug=False)
+    # 使用HTTP/1.1，让客户端的keep-alive连接可以被复用
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    app.run(host=args.host, port=args.port, debug=False, threaded=True)
 
 if __name__ == '__main__':
     main()
@@ -4,19 +4,23 @@ GPU监控服务端 - 增强版 - Geek风格 + 图表监控
 运行方式: python gpu_monitor_server_enhanced.py --port 5000
 """
 
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, render_template_string, request
+from werkzeug.serving import WSGIRequestHandler
 from datetime import datetime
 import argparse
 import threading
 import time
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import cached_response, format_number
 from collections import deque, defaultdict
 
 app = Flask(__name__)
+app.add_template_filter(format_number, 'num')
 
-# 存储所有服务器的GPU信息
-gpu_data = {}
-# 数据过期时间（秒）
-DATA_TIMEOUT = 60
+# 服务端共享状态（各服务器的最新样本、进程记录、GPU清单、响应缓存等），
+# 样本入库和公共接口（/api/update、/api/data、批量补传等）见 gpu_monitor_ingest.py
+state = MonitorState()
+app.register_blueprint(create_blueprint(state))
 
 # 存储历史数据用于图表显示（最近100个数据点）
 from collections import deque, defaultdict
@@ -829,6 +833,36 @@ HTML_TEMPLATE = """
                             <i class="far fa-clock"></i>
                             最后更新: <strong>{{ server_data.timestamp }}</strong>
                         </div>
+                        {% if server_data.host %}
+                        {% set host = server_data.host %}
+                        <div class="meta-item">
+                            <i class="fas fa-server"></i>
+                            CPU <strong>{{ host.cpu_percent|num }}%</strong> (iowait {{ host.iowait_percent|num }}%)
+                        </div>
+                        <div class="meta-item">
+                            <i class="fas fa-memory"></i>
+                            内存 <strong>{{ host.mem_used|num('MiB') }}</strong> / {{ host.mem_total|num('MiB') }}
+                        </div>
+                        <div class="meta-item">
+                            <i class="fas fa-tachometer-alt"></i>
+                            负载 <strong>{{ host.load1|num }}</strong> / {{ host.load5|num }} / {{ host.load15|num }}
+                        </div>
+                        <div class="meta-item">
+                            <i class="fas fa-network-wired"></i>
+                            网络 ↓{{ host.net_rx|num('MiB/s') }} ↑{{ host.net_tx|num('MiB/s') }}
+                        </div>
+                        <div class="meta-item">
+                            <i class="fas fa-hdd"></i>
+                            磁盘 读{{ host.disk_read|num('MiB/s') }} 写{{ host.disk_write|num('MiB/s') }}
+                        </div>
+                        {% endif %}
+                        {% if server_data.client_stats %}
+                        {% set client = server_data.client_stats %}
+                        <div class="meta-item" title="nvidia-smi p95 {{ (client.stages.smi or {}).p95|num('ms') }}, 解析 p95 {{ (client.stages.parse or {}).p95|num('ms') }}, 客户端 CPU {{ client.cpu_percent|num }}%, 内存 {{ client.rss_mb|num('MiB') }}">
+                            <i class="fas fa-stopwatch"></i>
+                            采集 p95 <strong>{{ (client.stages.collect or {}).p95|num('ms') }}</strong> · 发送 p95 {{ (client.stages.send or {}).p95|num('ms') }}
+                        </div>
+                        {% endif %}
                     </div>
                     
                     <div class="gpu-grid">
@@ -839,7 +873,7 @@ HTML_TEMPLATE = """
                                     <i class="fas fa-microchip"></i>
                                     GPU {{ gpu.index }}
                                 </div>
-                                {% set util = gpu.utilization|int %}
+                                {% set util = gpu.utilization or 0 %}
                                 <div class="gpu-status {{ 'idle' if util < 20 else ('busy' if util < 80 else 'full') }}">
                                     <i class="fas fa-circle"></i>
                                     {{ '空闲' if util < 20 else ('使用中' if util < 80 else '满载') }}
@@ -855,7 +889,7 @@ HTML_TEMPLATE = """
                                         <i class="fas fa-thermometer-half"></i>
                                         温度
                                     </div>
-                                    <div class="metric-value">{{ gpu.temperature }}°C</div>
+                                    <div class="metric-value">{{ gpu.temperature|num }}°C</div>
                                 </div>
                                 
                                 <!-- 功耗 -->
@@ -864,7 +898,7 @@ HTML_TEMPLATE = """
                                         <i class="fas fa-bolt"></i>
                                         功耗
                                     </div>
-                                    <div class="metric-value">{{ gpu.power_draw }}</div>
+                                    <div class="metric-value">{{ gpu.power_draw|num('W') }}</div>
                                 </div>
                                 
                                 <!-- GPU使用率 -->
@@ -875,13 +909,13 @@ HTML_TEMPLATE = """
                                     </div>
                                     <div class="metric-bar">
                                         <div class="progress-bar">
-                                            {% set util_val = gpu.utilization|int %}
+                                            {% set util_val = gpu.utilization or 0 %}
                                             <div class="progress-fill {{ 'progress-low' if util_val < 50 else ('progress-medium' if util_val < 80 else 'progress-high') }}" 
-                                                 style="width: {{ gpu.utilization }}%">
+                                                 style="width: {{ util_val }}%">
                                             </div>
                                         </div>
                                         <div class="progress-label">
-                                            <span>{{ gpu.utilization }}%</span>
+                                            <span>{{ gpu.utilization|num }}%{% if gpu.aggregates and gpu.aggregates.utilization %} (峰值 {{ gpu.aggregates.utilization.max|num }}%, p95 {{ gpu.aggregates.utilization.p95|num }}%){% endif %}</span>
                                         </div>
                                     </div>
                                 </div>
@@ -894,14 +928,14 @@ HTML_TEMPLATE = """
                                     </div>
                                     <div class="metric-bar">
                                         <div class="progress-bar">
-                                            {% set mem_val = gpu.memory_percent|int %}
+                                            {% set mem_val = gpu.memory_percent or 0 %}
                                             <div class="progress-fill {{ 'progress-low' if mem_val < 50 else ('progress-medium' if mem_val < 80 else 'progress-high') }}" 
-                                                 style="width: {{ gpu.memory_percent }}%">
+                                                 style="width: {{ mem_val }}%">
                                             </div>
                                         </div>
                                         <div class="progress-label">
-                                            <span>{{ gpu.memory_used }} / {{ gpu.memory_total }}</span>
-                                            <span>{{ gpu.memory_percent }}%</span>
+                                            <span>{{ gpu.memory_used|num('MiB') }} / {{ gpu.memory_total|num('MiB') }}</span>
+                                            <span>{{ gpu.memory_percent|num }}%</span>
                                         </div>
                                     </div>
                                 </div>
@@ -917,10 +951,10 @@ HTML_TEMPLATE = """
                                     {% for proc in gpu.processes %}
                                     <div class="process-item">
                                         <div class="process-info">
-                                            <div class="process-name">{{ proc.name }}</div>
-                                            <div class="process-pid">PID: {{ proc.pid }}</div>
+                                            <div class="process-name" title="{{ proc.cmdline or proc.name }}">{{ proc.name }}</div>
+                                            <div class="process-pid">PID: {{ proc.pid }}{% if proc.user %} · {{ proc.user }}{% endif %}{% if proc.container %} · {{ proc.container }}{% endif %}{% if proc.sm_util is not none %} · SM {{ proc.sm_util|num }}% · 带宽 {{ proc.mem_util|num }}%{% endif %}</div>
                                         </div>
-                                        <div class="process-memory">{{ proc.memory }}</div>
+                                        <div class="process-memory">{{ proc.memory|num('MiB') }}</div>
                                     </div>
                                     {% endfor %}
                                 </div>
@@ -1001,30 +1035,19 @@ def clean_old_data():
 
 @app.route('/')
 def index():
-    """主页面 - 显示所有服务器的GPU信息"""
+    """主页面 - 显示所有服务器的GPU信息（按版本缓存，按 Accept-Encoding 压缩）"""
+    return cached_response(request, state.response_cache, 'index', state.page_version(), render_index, 'text/html')
+
+def render_index():
+    """渲染主页面"""
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     # 准备数据
-    servers = {}
-    current_timestamp = time.time()
-    total_gpus = 0
-    online_count = 0
-    offline_count = 0
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        
-        if is_online:
-            online_count += 1
-            total_gpus += len(data.get('gpus', []))
-        else:
-            offline_count += 1
-        
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
+    servers = state.servers()
+    online = [server for server in servers.values() if server['online']]
+    total_gpus = sum(len(server['gpus']) for server in online)
+    online_count = len(online)
+    offline_count = len(servers) - online_count
     
     return render_template_string(
         HTML_TEMPLATE,
@@ -1036,39 +1059,6 @@ def index():
         offline_servers=offline_count
     )
 
-@app.route('/api/update', methods=['POST'])
-def update_gpu_data():
-    """接收客户端发送的GPU数据"""
-    try:
-        data = request.get_json()
-        server_name = data.get('server_name', 'unknown')
-        
-        gpu_data[server_name] = {
-            'timestamp': data.get('timestamp'),
-            'gpus': data.get('gpus', []),
-            'last_update': time.time()
-        }
-        
-        return jsonify({'status': 'success', 'message': 'Data updated'}), 200
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 400
-
-@app.route('/api/data')
-def get_data():
-    """API接口 - 返回JSON格式的数据"""
-    current_timestamp = time.time()
-    servers = {}
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
-    
-    return jsonify(servers)
-
 def main():
     parser = argparse.ArgumentParser(description='GPU监控服务端 - 增强版')
     parser.add_argument('--port', type=int, default=5000, help='服务端口 (默认: 5000)')
@@ -1085,7 +1075,9 @@ def main():
     print(f"如果使用端口转发，请将客户端配置为您的公网地址")
     print(f"===========================================")
     
-    app.run(host=args.host, port=args.port, debug=False)
+    # 使用HTTP/1.1，让客户端的keep-alive连接可以被复用
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    app.run(host=args.host, port=args.port, debug=False, threaded=True)
 
 if __name__ == '__main__':
     main()
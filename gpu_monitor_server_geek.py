@@ -5,31 +5,37 @@ GPU监控服务端 - 数据库控制台风格
 """
 
 from flask import Flask, render_template_string, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
 from datetime import datetime
 import argparse
+import json
 import threading
 import time
-from collections import deque, defaultdict
+from gpu_monitor_history import HISTORY_DB_RAW_DAYS, HISTORY_POINTS, HistoryDB, TieredHistory
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import cached_response, format_number
 
 app = Flask(__name__)
+app.add_template_filter(format_number, 'num')
 
-# 存储所有服务器的GPU信息
-gpu_data = {}
-# 数据过期时间（秒）
-DATA_TIMEOUT = 60
+# 服务端共享状态（各服务器的最新样本、进程记录、GPU清单、响应缓存等），
+# 样本入库和公共接口（/api/update、/api/data、批量补传等）见 gpu_monitor_ingest.py
+state = MonitorState()
+app.register_blueprint(create_blueprint(state))
 
 # 存储历史数据用于图表显示
-# 全局时间轴（所有服务器共享）
-global_timestamps = deque(maxlen=100)
-
-# 每个服务器的数据（使用全局时间轴的索引）
-history_data = defaultdict(lambda: {
-    'total_memory_percent': {},  # {timestamp: value}
-    'gpu_memory': defaultdict(dict)  # {gpu_id: {timestamp: value}}
-})
+# 时间按 epoch/5秒 划分为整数桶号，每个服务器保留最近1小时的原始样本，并汇总为1分钟/15分钟/1小时三级，
+# 每级每个指标一列定长数组
+# 列: ('total_memory_percent', None)、(序列, gpu_id)，gpu_id 为 UUID（旧版客户端为序号）、('host', 指标)
+# 客户端启用窗口聚合时，gpu_memory/gpu_utilization 记录窗口均值，*_peak 记录窗口最大值
+# 每级的 labels: {server_name: {gpu_id: 当前序号}}，GPU枚举顺序变化时历史仍按 UUID 连续
+history = TieredHistory()
+# 可选的持久化数据库（--history-db），重启后从中恢复历史
+history_db = None
+HISTORY_SERIES = ['gpu_memory', 'gpu_memory_peak', 'gpu_utilization', 'gpu_utilization_peak', 'host']
+HOST_HISTORY_FIELDS = ['cpu_percent', 'iowait_percent', 'mem_percent']
 
 server_start_time = time.time()
-last_update_time = None
 
 # 数据库控制台风格HTML模板
 HTML_TEMPLATE = """
@@ -262,6 +268,21 @@ HTML_TEMPLATE = """
             font-family: 'Roboto Mono', monospace;
         }
         
+        .server-host {
+            display: flex;
+            flex-wrap: wrap;
+            gap: 20px;
+            margin-bottom: 16px;
+            color: var(--text-secondary);
+            font-family: 'Roboto Mono', monospace;
+            font-size: 0.85em;
+        }
+        
+        .server-host em {
+            font-style: normal;
+            opacity: 0.7;
+        }
+        
         .server-badge {
             display: flex;
             align-items: center;
@@ -603,6 +624,17 @@ HTML_TEMPLATE = """
                     <i class="fas fa-chart-line"></i>
                     Total Memory Usage Over Time
                 </div>
+                <div class="server-selector">
+                    <label for="rangeSelect">Range:</label>
+                    <select id="rangeSelect" onchange="changeRange()">
+                        <option value="" selected>Latest</option>
+                        <option value="3600">1 hour</option>
+                        <option value="21600">6 hours</option>
+                        <option value="86400">1 day</option>
+                        <option value="604800">1 week</option>
+                        <option value="2419200">4 weeks</option>
+                    </select>
+                </div>
             </div>
             <div class="chart-container">
                 <canvas id="totalMemoryChart"></canvas>
@@ -614,9 +646,16 @@ HTML_TEMPLATE = """
             <div class="chart-header">
                 <div class="chart-title">
                     <i class="fas fa-chart-area"></i>
-                    Server GPU Memory Timeline
+                    Server GPU Timeline
                 </div>
                 <div class="server-selector">
+                    <label for="metricSelect">Metric:</label>
+                    <select id="metricSelect" onchange="updateServerChart()">
+                        <option value="gpu_memory" selected>Memory</option>
+                        <option value="gpu_utilization">Utilization</option>
+                        <option value="host">Host CPU / RAM</option>
+                        <option value="processes">Process SM</option>
+                    </select>
                     <label for="serverSelect">Server:</label>
                     <select id="serverSelect" onchange="updateServerChart()">
                         {% if servers %}
@@ -647,12 +686,34 @@ HTML_TEMPLATE = """
                     </div>
                 </div>
                 
+                {% if server_data.host %}
+                {% set host = server_data.host %}
+                <div class="server-host">
+                    <span><i class="fas fa-server"></i> CPU {{ host.cpu_percent|num }}% <em>iowait {{ host.iowait_percent|num }}%</em></span>
+                    <span><i class="fas fa-memory"></i> RAM {{ host.mem_used|num('MiB') }} / {{ host.mem_total|num('MiB') }}</span>
+                    <span><i class="fas fa-tachometer-alt"></i> Load {{ host.load1|num }} / {{ host.load5|num }} / {{ host.load15|num }}</span>
+                    <span><i class="fas fa-network-wired"></i> Net ↓{{ host.net_rx|num('MiB/s') }} ↑{{ host.net_tx|num('MiB/s') }}</span>
+                    <span><i class="fas fa-hdd"></i> Disk R {{ host.disk_read|num('MiB/s') }} W {{ host.disk_write|num('MiB/s') }}</span>
+                </div>
+                {% endif %}
+                
+                {% if server_data.client_stats %}
+                {% set client = server_data.client_stats %}
+                <div class="server-host">
+                    <span><i class="fas fa-stopwatch"></i> collect p95 {{ (client.stages.collect or {}).p95|num('ms') }} <em>max {{ (client.stages.collect or {}).max|num('ms') }}</em></span>
+                    <span>smi p95 {{ (client.stages.smi or {}).p95|num('ms') }}</span>
+                    <span>parse p95 {{ (client.stages.parse or {}).p95|num('ms') }}</span>
+                    <span><i class="fas fa-paper-plane"></i> send p95 {{ (client.stages.send or {}).p95|num('ms') }}</span>
+                    <span>agent CPU {{ client.cpu_percent|num }}% <em>RSS {{ client.rss_mb|num('MiB') }}</em></span>
+                </div>
+                {% endif %}
+                
                 <div class="gpu-grid">
                     {% for gpu in server_data.gpus %}
                     <div class="gpu-card">
                         <div class="gpu-header">
                             <div class="gpu-title">GPU {{ gpu.index }}</div>
-                            {% set util = gpu.utilization|int %}
+                            {% set util = gpu.utilization or 0 %}
                             <div class="gpu-status {{ 'idle' if util < 20 else ('busy' if util < 80 else 'full') }}">
                                 {{ 'Idle' if util < 20 else ('Active' if util < 80 else 'Full') }}
                             </div>
@@ -663,35 +724,35 @@ HTML_TEMPLATE = """
                         <div class="metrics-row">
                             <div class="metric">
                                 <div class="metric-label">Temperature</div>
-                                <div class="metric-value">{{ gpu.temperature }}°C</div>
+                                <div class="metric-value">{{ gpu.temperature|num }}°C</div>
                             </div>
                             <div class="metric">
                                 <div class="metric-label">Power</div>
-                                <div class="metric-value">{{ gpu.power_draw }}</div>
+                                <div class="metric-value">{{ gpu.power_draw|num('W') }}</div>
                             </div>
                         </div>
                         
                         <div class="progress-section">
                             <div class="progress-header">
                                 <span class="progress-label">GPU Utilization</span>
-                                <span class="progress-value">{{ gpu.utilization }}%</span>
+                                <span class="progress-value">{{ gpu.utilization|num }}%{% if gpu.aggregates and gpu.aggregates.utilization %} (peak {{ gpu.aggregates.utilization.max|num }}%, p95 {{ gpu.aggregates.utilization.p95|num }}%){% endif %}</span>
                             </div>
                             <div class="progress-bar">
-                                {% set util_val = gpu.utilization|int %}
+                                {% set util_val = gpu.utilization or 0 %}
                                 <div class="progress-fill {{ 'progress-low' if util_val < 50 else ('progress-medium' if util_val < 80 else 'progress-high') }}" 
-                                     style="width: {{ gpu.utilization }}%"></div>
+                                     style="width: {{ util_val }}%"></div>
                             </div>
                         </div>
                         
                         <div class="progress-section">
                             <div class="progress-header">
                                 <span class="progress-label">Memory Usage</span>
-                                <span class="progress-value">{{ gpu.memory_used }} / {{ gpu.memory_total }}</span>
+                                <span class="progress-value">{{ gpu.memory_used|num('MiB') }} / {{ gpu.memory_total|num('MiB') }}</span>
                             </div>
                             <div class="progress-bar">
-                                {% set mem_val = gpu.memory_percent|int %}
+                                {% set mem_val = gpu.memory_percent or 0 %}
                                 <div class="progress-fill {{ 'progress-low' if mem_val < 50 else ('progress-medium' if mem_val < 80 else 'progress-high') }}" 
-                                     style="width: {{ gpu.memory_percent }}%"></div>
+                                     style="width: {{ mem_val }}%"></div>
                             </div>
                         </div>
                         
@@ -705,10 +766,10 @@ HTML_TEMPLATE = """
                                 {% for proc in gpu.processes %}
                                 <div class="process-item">
                                     <div class="process-info">
-                                        <div class="process-name">{{ proc.name }}</div>
-                                        <div class="process-pid">PID: {{ proc.pid }}</div>
+                                        <div class="process-name" title="{{ proc.cmdline or proc.name }}">{{ proc.name }}</div>
+                                        <div class="process-pid">PID: {{ proc.pid }}{% if proc.user %} · {{ proc.user }}{% endif %}{% if proc.container %} · {{ proc.container }}{% endif %}{% if proc.sm_util is not none %} · SM {{ proc.sm_util|num }}% · BW {{ proc.mem_util|num }}%{% endif %}</div>
                                     </div>
-                                    <div class="process-memory">{{ proc.memory }}</div>
+                                    <div class="process-memory">{{ proc.memory|num('MiB') }}</div>
                                 </div>
                                 {% endfor %}
                             </div>
@@ -731,7 +792,8 @@ HTML_TEMPLATE = """
     
     <script>
         // 历史数据
-        const historyData = {{ history_json|safe }};
+        let historyData = {{ history_json|safe }};
+        const processHistory = {{ process_history_json|safe }};
         
         // Chart.js 配置
         Chart.defaults.color = '#94a3b8';
@@ -936,6 +998,12 @@ HTML_TEMPLATE = """
             '#f97316'  // orange
         ];
         
+        const hostLabels = {
+            cpu_percent: 'CPU',
+            iowait_percent: 'IO wait',
+            mem_percent: 'RAM'
+        };
+        
         // 初始化图表
         function initCharts() {
             // 获取所有时间戳（所有服务器共享）
@@ -989,13 +1057,20 @@ HTML_TEMPLATE = """
                 return;
             }
             
+            const metric = document.getElementById('metricSelect').value;
+            if (metric === 'processes') {
+                updateProcessChart(serverName);
+                return;
+            }
             const data = historyData[serverName];
+            const peaks = data[metric + '_peak'] || {};
+            const gpuLabels = data.gpu_labels || {};
             const datasets = [];
             let colorIndex = 0;
             
-            for (const [gpuId, gpuData] of Object.entries(data.gpu_memory)) {
+            for (const [gpuId, gpuData] of Object.entries(data[metric] || {})) {
                 datasets.push({
-                    label: `GPU ${gpuId}`,
+                    label: metric === 'host' ? hostLabels[gpuId] : `GPU ${gpuLabels[gpuId] ?? gpuId}`,
                     data: gpuData,
                     borderColor: colors[colorIndex % colors.length],
                     backgroundColor: colors[colorIndex % colors.length] + '20',
@@ -1005,6 +1080,20 @@ HTML_TEMPLATE = """
                     pointRadius: 0,
                     pointHoverRadius: 4
                 });
+                // 窗口峰值（客户端启用 --sample-every 时才有）
+                if (peaks[gpuId]) {
+                    datasets.push({
+                        label: `GPU ${gpuLabels[gpuId] ?? gpuId} peak`,
+                        data: peaks[gpuId],
+                        borderColor: colors[colorIndex % colors.length],
+                        borderWidth: 1,
+                        borderDash: [4, 4],
+                        tension: 0.3,
+                        fill: false,
+                        pointRadius: 0,
+                        pointHoverRadius: 4
+                    });
+                }
                 colorIndex++;
             }
             
@@ -1013,8 +1102,55 @@ HTML_TEMPLATE = """
             serverMemoryChart.update();
         }
         
+        // 进程SM使用率（来自服务端每个进程的环形缓冲，需客户端 --process-util）
+        function updateProcessChart(serverName) {
+            const data = processHistory[serverName] || {timestamps: [], processes: {}};
+            const datasets = [];
+            let colorIndex = 0;
+            
+            for (const proc of Object.values(data.processes)) {
+                datasets.push({
+                    label: `GPU ${proc.gpu} ${proc.name} (${proc.pid})`,
+                    data: proc.sm_util,
+                    borderColor: colors[colorIndex % colors.length],
+                    backgroundColor: colors[colorIndex % colors.length] + '20',
+                    borderWidth: 2,
+                    tension: 0.3,
+                    fill: false,
+                    pointRadius: 0,
+                    pointHoverRadius: 4
+                });
+                colorIndex++;
+            }
+            
+            serverMemoryChart.data.labels = data.timestamps.map(ts => ts.slice(-8));
+            serverMemoryChart.data.datasets = datasets;
+            serverMemoryChart.update();
+        }
+        
+        // 时间范围（保存在 localStorage，页面自动刷新后保持）；服务端按范围选择原始或1分钟/15分钟/1小时汇总数据
+        function changeRange() {
+            const range = document.getElementById('rangeSelect').value;
+            localStorage.setItem('historyRange', range);
+            loadHistory(range);
+        }
+        
+        function loadHistory(range) {
+            fetch(range ? `/api/history?range=${range}&points=100` : '/api/history')
+                .then(response => response.json())
+                .then(data => {
+                    historyData = data;
+                    initCharts();
+                });
+        }
+        
         // 初始化
         initCharts();
+        const savedRange = localStorage.getItem('historyRange');
+        if (savedRange) {
+            document.getElementById('rangeSelect').value = savedRange;
+            loadHistory(savedRange);
+        }
         
         // 自动刷新页面（10秒）
         setInterval(function() {
@@ -1032,7 +1168,11 @@ def clean_old_data():
 
 @app.route('/')
 def index():
-    """主页面 - 显示所有服务器的GPU信息"""
+    """主页面 - 显示所有服务器的GPU信息（按版本缓存，按 Accept-Encoding 压缩）"""
+    return cached_response(request, state.response_cache, 'index', state.page_version(), render_index, 'text/html')
+
+def render_index():
+    """渲染主页面"""
     current_time = datetime.now().strftime('%H:%M:%S')
     
     # 计算运行时间
@@ -1042,52 +1182,14 @@ def index():
     uptime = f"{uptime_hours:02d}:{uptime_minutes:02d}"
     
     # 准备数据
-    servers = {}
-    current_timestamp = time.time()
-    total_gpus = 0
-    online_count = 0
-    offline_count = 0
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        
-        if is_online:
-            online_count += 1
-            total_gpus += len(data.get('gpus', []))
-        else:
-            offline_count += 1
-        
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
+    servers = state.servers()
+    online = [server for server in servers.values() if server['online']]
+    total_gpus = sum(len(server['gpus']) for server in online)
+    online_count = len(online)
+    offline_count = len(servers) - online_count
     
     # 准备历史数据用于图表 - 使用全局时间轴
-    import json
-    history_json = {}
-    
-    # 转换全局时间戳为列表
-    timestamps_list = list(global_timestamps)
-    
-    for server_name, hist in history_data.items():
-        # 为每个时间点填充数据，如果没有则设为null
-        total_mem_data = []
-        gpu_mem_data = defaultdict(list)
-        
-        for ts in timestamps_list:
-            # 总显存
-            total_mem_data.append(hist['total_memory_percent'].get(ts, None))
-            
-            # 每个GPU的显存
-            for gpu_id in hist['gpu_memory'].keys():
-                gpu_mem_data[gpu_id].append(hist['gpu_memory'][gpu_id].get(ts, None))
-        
-        history_json[server_name] = {
-            'timestamps': timestamps_list,
-            'total_memory_percent': total_mem_data,
-            'gpu_memory': {k: v for k, v in gpu_mem_data.items()}
-        }
+    history_json = collect_history()
     
     return render_template_string(
         HTML_TEMPLATE,
@@ -1098,110 +1200,168 @@ def index():
         online_servers=online_count,
         offline_servers=offline_count,
         uptime=uptime,
-        history_json=json.dumps(history_json)
+        history_json=json.dumps(history_json),
+        process_history_json=json.dumps(state.process_history.snapshot())
     )
 
-@app.route('/api/update', methods=['POST'])
-def update_gpu_data():
-    """接收客户端发送的GPU数据"""
-    global last_update_time
-    
-    try:
-        data = request.get_json()
-        server_name = data.get('server_name', 'unknown')
-        
-        gpu_data[server_name] = {
-            'timestamp': data.get('timestamp'),
-            'gpus': data.get('gpus', []),
-            'last_update': time.time()
-        }
-        
-        # 更新历史数据 - 使用全局时间轴
+@state.on_store
+def record_history(server_name, data, sampled_at):
+    """入库时记录历史数据（样本已转换为数值，发布到 gpu_data 之前调用）
+
+    实时样本 sampled_at 为 None，按接收时间记入对应的时间桶；
+    补传样本传入其采集时间（秒），记入采集时间所在的时间桶（晚于当前时间的按当前时间）。
+    """
+    # 更新历史数据 - 按时间桶写入（历史数组就地修改，与 collect_history() 互斥）
+    with history.lock:
         gpus = data.get('gpus', [])
         if gpus:
-            current_time_str = datetime.now().strftime('%H:%M:%S')
             current_timestamp = time.time()
-            
-            # 只在距离上次更新超过5秒时添加新的时间点
-            should_add_timestamp = (
-                last_update_time is None or 
-                (current_timestamp - last_update_time) >= 5
-            )
-            
-            if should_add_timestamp:
-                global_timestamps.append(current_time_str)
-                last_update_time = current_timestamp
-            
+            # 同一时间桶内的样本覆盖之前的值；已滚出保留范围的补传样本只保存最新状态
+            slot = history.slot(server_name, current_timestamp if sampled_at is None
+                                else min(sampled_at, current_timestamp))
+            if slot is None:
+                gpus = []
+        if gpus:
             # 计算总显存使用百分比
-            total_used = sum(float(gpu.get('memory_used', '0').split()[0]) for gpu in gpus)
-            total_capacity = sum(float(gpu.get('memory_total', '0').split()[0]) for gpu in gpus)
+            total_used = sum(gpu.get('memory_used') or 0 for gpu in gpus)
+            total_capacity = sum(gpu.get('memory_total') or 0 for gpu in gpus)
             total_percent = (total_used / total_capacity * 100) if total_capacity > 0 else 0
             
-            # 记录数据（使用时间戳作为key）
-            hist = history_data[server_name]
-            hist['total_memory_percent'][current_time_str] = round(total_percent, 1)
+            # 记录数据（写入各级的时间桶位置 slot）
+            history.record(server_name, slot, 'total_memory_percent', None, round(total_percent, 1))
             
-            # 记录每个GPU的显存使用
+            # 记录每个GPU的显存和使用率；带窗口统计时记录均值和峰值
             for gpu in gpus:
-                gpu_id = str(gpu.get('index', 0))
-                mem_percent = float(gpu.get('memory_percent', 0))
-                hist['gpu_memory'][gpu_id][current_time_str] = round(mem_percent, 1)
-        
-        return jsonify({'status': 'success', 'message': 'Data updated'}), 200
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 400
-
-@app.route('/api/data')
-def get_data():
-    """API接口 - 返回JSON格式的数据"""
-    current_timestamp = time.time()
-    servers = {}
-    
-    for server_name, data in gpu_data.items():
-        is_online = (current_timestamp - data.get('last_update', 0)) < DATA_TIMEOUT
-        servers[server_name] = {
-            'online': is_online,
-            'timestamp': data.get('timestamp', 'N/A'),
-            'gpus': data.get('gpus', [])
-        }
-    
-    return jsonify(servers)
+                gpu_id = gpu.get('uuid') or str(gpu.get('index', 0))
+                history.label(server_name, gpu_id, gpu.get('index', 0))
+                aggregates = gpu.get('aggregates') or {}
+                for series, field in (('gpu_memory', 'memory_percent'), ('gpu_utilization', 'utilization')):
+                    window = aggregates.get(field)
+                    if window:
+                        history.record(server_name, slot, series, gpu_id, round(window['mean'], 1))
+                        history.record(server_name, slot, series + '_peak', gpu_id, round(window['max'], 1))
+                    else:
+                        history.record(server_name, slot, series, gpu_id, round(gpu.get(field) or 0, 1))
+            
+            # 记录主机CPU/内存（用于排查数据加载等CPU侧瓶颈）
+            host = data.get('host')
+            if host:
+                for field in HOST_HISTORY_FIELDS:
+                    history.record(server_name, slot, 'host', field, host.get(field))
 
 @app.route('/api/history')
 def get_history():
-    """返回历史数据"""
+    """返回历史数据
+
+    可选参数: start/end（epoch秒，end 默认为当前时间）或 range（秒，从当前时间往前），
+    points（需要的点数，默认100）；按范围选择保留时长覆盖该范围的、最粗的仍能给出 points 个点的分辨率，
+    桶数多于 points 时把连续的桶合并，返回约 points 个点。
+    不带参数时返回最近 points 个原始点，按版本缓存。
+    """
+    if not request.args:
+        return cached_response(request, state.response_cache, 'history', state.gpu_data.version, build_history, 'application/json')
+    try:
+        points = int(request.args.get('points', HISTORY_POINTS))
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - float(request.args.get('range', points * history.interval))))
+        if points <= 0 or not 0 < end - start < float('inf'):
+            raise ValueError('need points > 0 and start < end')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return app.response_class(build_history(start, end, points), mimetype='application/json')
+
+def build_history(start=None, end=None, points=HISTORY_POINTS):
+    """生成 /api/history 的数据"""
+    return json.dumps(collect_history(start, end, points))
+
+def collect_history(start=None, end=None, points=HISTORY_POINTS):
+    """把各服务器 [start, end] 内的历史数据对齐到同一段时间桶，没有数据的时间桶设为null
+
+    不指定范围时为截至最新数据的 points 个原始点；指定范围时最多约 points 个点（合并连续的桶）。
+    """
+    with history.lock:
+        if start is None:
+            tier = history.tiers[0]
+            if tier.end is not None:
+                start = (tier.end - points + 1) * tier.interval
+            return _collect_history(tier, start, end)
+        tier = history.select(start, end, points)
+        return _collect_history(tier, start, end, tier.step(start, end, points))
+
+def _collect_history(tier, start_time, end_time, step=1):
     history_json = {}
     
-    # 转换全局时间戳为列表
-    timestamps_list = list(global_timestamps)
+    # 每个点的起始时间转为图表标签（超过一天的范围带日期）
+    start, count, aligned = tier.overlay(start_time, end_time, step)
+    resolution = tier.interval * step
+    label_format = '%m-%d %H:%M' if count * resolution > 86400 else '%H:%M:%S'
+    timestamps_list = [datetime.fromtimestamp((start + i * step) * tier.interval).strftime(label_format)
+                       for i in range(count)]
     
-    for server_name, hist in history_data.items():
-        # 为每个时间点填充数据，如果没有则设为null
-        total_mem_data = []
-        gpu_mem_data = defaultdict(list)
-        
-        for ts in timestamps_list:
-            # 总显存
-            total_mem_data.append(hist['total_memory_percent'].get(ts, None))
-            
-            # 每个GPU的显存
-            for gpu_id in hist['gpu_memory'].keys():
-                gpu_mem_data[gpu_id].append(hist['gpu_memory'][gpu_id].get(ts, None))
-        
+    for server_name, columns in aligned.items():
         history_json[server_name] = {
             'timestamps': timestamps_list,
-            'total_memory_percent': total_mem_data,
-            'gpu_memory': {k: v for k, v in gpu_mem_data.items()}
-        }
+            'resolution': resolution,
+            'total_memory_percent': columns.get(('total_memory_percent', None), [None] * count),
+            'gpu_labels': dict(tier.labels[server_name])
+        }
+        # 每个GPU的显存/使用率（均值和峰值），以及主机指标
+        for series in HISTORY_SERIES:
+            history_json[server_name][series] = {}
+        for (series, key), values in columns.items():
+            if series in HISTORY_SERIES:
+                history_json[server_name][series][key] = values
     
-    return jsonify(history_json)
+    return history_json
+
+@app.route('/api/history/raw')
+def get_raw_history():
+    """从历史数据库读取一台服务器 [start, end] 内的原始点（需 --history-db）
+
+    参数: server（必填）、gpu（UUID，主机指标为指标名，总显存为空串；省略时为该服务器的全部序列）、
+    start/end（epoch秒，默认最近1小时）。返回 {gpu: {序列: [[ts, value], ...]}}。
+    """
+    if history_db is None:
+        return jsonify({'status': 'error', 'message': 'history database not enabled (--history-db)'}), 404
+    server_name = request.args.get('server')
+    try:
+        if not server_name:
+            raise ValueError('missing server')
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 3600))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    gpu = request.args.get('gpu')
+    if gpu is None:
+        with history.lock:
+            gpus = sorted({'' if key is None else key
+                           for tier in history.tiers for (_, key) in tier.columns.get(server_name, {})})
+    else:
+        gpus = [gpu]
+    result = {}
+    for gpu in gpus:
+        series = result[gpu] = {}
+        for name, ts, value in history_db.range(server_name, gpu, start, end):
+            series.setdefault(name, []).append([ts, value])
+    return jsonify(result)
 
 def main():
     parser = argparse.ArgumentParser(description='GPU监控服务端 - 数据库控制台风格')
     parser.add_argument('--port', type=int, default=5000, help='服务端口 (默认: 5000)')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
+    parser.add_argument('--history-db', type=str, default=None,
+                        help='历史数据库文件（SQLite），重启后恢复历史图表 (默认: 不保存)')
+    parser.add_argument('--history-db-days', type=float, default=HISTORY_DB_RAW_DAYS,
+                        help=f'数据库保留原始点的天数，各级汇总按各自的保留时长保存 (默认: {HISTORY_DB_RAW_DAYS})')
     args = parser.parse_args()
     
+    global history_db
+    if args.history_db:
+        history_db = HistoryDB(args.history_db, raw_retention=args.history_db_days * 86400)
+        restored_start = time.time()
+        restored = history.attach(history_db)
+        print(f"历史数据库: {args.history_db}，恢复 {restored} 个原始点（{time.time() - restored_start:.1f}s）")
+    
     # 启动清理线程
     cleaner = threading.Thread(target=clean_old_data, daemon=True)
     cleaner.start()
@@ -1214,7 +1374,14 @@ def main():
     print(f"║  URL: http://localhost:{args.port:<18} ║")
     print(f"╚════════════════════════════════════════╝")
     
-    app.run(host=args.host, port=args.port, debug=False)
+    # 使用HTTP/1.1，让客户端的keep-alive连接可以被复用
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    try:
+        app.run(host=args.host, port=args.port, debug=False, threaded=True)
+    finally:
+        # 退出前写完队列中的历史数据
+        if history_db is not None:
+            history_db.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录（不是安装包），测试直接从根目录导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 假 nvidia-smi（可执行脚本），流式采集和XML解析测试用它代替真实驱动
+FAKE_NVIDIA_SMI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_nvidia_smi.py')
+
+@pytest.fixture
+def fake_smi():
+    return FAKE_NVIDIA_SMI
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试用的假 nvidia-smi：两块 GPU（GPU-aaa 有一个进程，GPU-bbb 空闲，功耗不可用）
+
+支持的调用方式：
+  --query-gpu=... --format=csv,noheader,nounits -lms=N   每 N 毫秒输出一帧 CSV（字段顺序同 STREAM_QUERY_FIELDS）
+  --query-compute-apps=... --format=csv,noheader,nounits  输出进程列表
+  -q -x [-d 段名,...]                                      输出 XML；带 -d 时与真实驱动一样不含型号、UUID 等静态字段
+  pmon -s u -d N                                           每 N 秒输出一次进程使用率（带 jpg/ofa 列的新版格式）
+环境变量 FAKE_SMI_HANG_AFTER=N 让流式输出在第 N 帧之后卡住，FAKE_SMI_STEADY=1 让流式输出的显存占用保持不变，
+FAKE_SMI_PMON_SM=N 设置 pmon 输出的 SM 使用率（默认 35），FAKE_SMI_FAIL=1 让命令以非零状态退出，
+FAKE_SMI_LOG=文件 时把每次调用的参数追加到该文件（每次一行）。
+"""
+
+import os
+import sys
+import time
+
+XML_GPU_A = """
+	<gpu id="00000000:01:00.0">
+		<product_name>NVIDIA A100-SXM4-80GB</product_name>
+		<uuid>GPU-aaa</uuid>
+		<pci>
+			<pci_bus_id>00000000:01:00.0</pci_bus_id>
+			<tx_util>1200 KB/s</tx_util>
+			<rx_util>800 KB/s</rx_util>
+		</pci>
+		<fb_memory_usage>
+			<total>81920 MiB</total>
+			<used>40960 MiB</used>
+		</fb_memory_usage>
+		<utilization><gpu_util>87 %</gpu_util></utilization>
+		<ecc_mode><current_ecc>Enabled</current_ecc></ecc_mode>
+		<ecc_errors><volatile><sram_correctable>2</sram_correctable><sram_uncorrectable>0</sram_uncorrectable></volatile></ecc_errors>
+		<temperature><gpu_temp>61 C</gpu_temp></temperature>
+		<gpu_power_readings>
+			<power_draw>N/A</power_draw>
+			<instant_power_draw>312.45 W</instant_power_draw>
+			<current_power_limit>400.00 W</current_power_limit>
+		</gpu_power_readings>
+		<clocks_event_reasons>
+			<clocks_event_reason_gpu_idle>Not Active</clocks_event_reason_gpu_idle>
+			<clocks_event_reason_sw_power_cap>Active</clocks_event_reason_sw_power_cap>
+		</clocks_event_reasons>
+		<clocks>
+			<graphics_clock>1410 MHz</graphics_clock>
+			<sm_clock>1410 MHz</sm_clock>
+			<mem_clock>1593 MHz</mem_clock>
+		</clocks>
+		<processes>
+			<process_info>
+				<pid>1234</pid>
+				<type>C</type>
+				<process_name>python train.py</process_name>
+				<used_memory>40000 MiB</used_memory>
+			</process_info>
+		</processes>
+	</gpu>"""
+
+XML_GPU_B = """
+	<gpu id="00000000:02:00.0">
+		<product_name>NVIDIA A100-SXM4-80GB</product_name>
+		<uuid>GPU-bbb</uuid>
+		<pci><pci_bus_id>00000000:02:00.0</pci_bus_id></pci>
+		<fb_memory_usage>
+			<total>81920 MiB</total>
+			<used>0 MiB</used>
+		</fb_memory_usage>
+		<utilization><gpu_util>0 %</gpu_util></utilization>
+		<temperature><gpu_temp>35 C</gpu_temp></temperature>
+		<power_readings><power_draw>[Not Supported]</power_draw><power_limit>400.00 W</power_limit></power_readings>
+		<processes></processes>
+	</gpu>"""
+
+# 带 -d 时不输出的静态字段
+STATIC_TAGS = ('<product_name>', '<uuid>', '<pci_bus_id>')
+
+def print_xml(narrow):
+    body = XML_GPU_A + XML_GPU_B
+    if narrow:
+        body = '\n'.join(line for line in body.splitlines() if not line.strip().startswith(STATIC_TAGS))
+    print('<?xml version="1.0" ?>')
+    print('<nvidia_smi_log>')
+    print('\t<driver_version>535.104.05</driver_version>')
+    print('\t<attached_gpus>2</attached_gpus>')
+    print(body)
+    print('</nvidia_smi_log>')
+
+def stream_csv(interval_ms):
+    hang_after = int(os.environ.get('FAKE_SMI_HANG_AFTER', 0))
+    steady = bool(os.environ.get('FAKE_SMI_STEADY'))
+    n = 0
+    while True:
+        print(f"0, GPU-aaa, 45, {n % 100}, {1000 if steady else 1000 + n}, 24576, 120.50, 300.00, 00000000:01:00.0, 535.104.05, "
+              f"NVIDIA GeForce RTX 3090", flush=True)
+        print("1, GPU-bbb, 50, 3, 700, 24576, [N/A], 300.00, 00000000:02:00.0, 535.104.05, "
+              "NVIDIA GeForce RTX 3090, Ti", flush=True)
+        n += 1
+        if hang_after and n >= hang_after:
+            time.sleep(3600)
+        time.sleep(interval_ms / 1000)
+
+def pmon(delay):
+    sm = os.environ.get('FAKE_SMI_PMON_SM', '35')
+    n = 0
+    while True:
+        if n % 5 == 0:
+            print("# gpu         pid   type     sm    mem    enc    dec    jpg    ofa    command")
+            print("# Idx           #    C/G      %      %      %      %      %      %    name")
+        print(f"    0       1234     C     {sm:>2}     20      -      -      -      -    python")
+        print("    0       1235     C      -      -      -      -      -      -    python")
+        print("    1          -     -      -      -      -      -      -      -    -", flush=True)
+        n += 1
+        time.sleep(delay)
+
+def main(argv):
+    if os.environ.get('FAKE_SMI_LOG'):
+        with open(os.environ['FAKE_SMI_LOG'], 'a') as log:
+            log.write(' '.join(argv) + '\n')
+    if os.environ.get('FAKE_SMI_FAIL'):
+        return 9
+    if any(arg.startswith('--query-compute-apps') for arg in argv):
+        print("GPU-aaa, 1234, 500, python train.py")
+        print("GPU-bbb, 2345, 700, python -c import torch, time")
+        return 0
+    if any(arg.startswith('--query-gpu') for arg in argv):
+        interval_ms = 1000
+        for arg in argv:
+            if arg.startswith('-lms='):
+                interval_ms = int(arg[len('-lms='):])
+        stream_csv(interval_ms)
+        return 0
+    if argv[:1] == ['pmon']:
+        delay = int(argv[argv.index('-d') + 1]) if '-d' in argv else 1
+        pmon(delay)
+        return 0
+    if '-q' in argv and '-x' in argv:
+        print_xml('-d' in argv)
+        return 0
+    print(f"fake nvidia-smi: 不支持的参数 {' '.join(argv)}", file=sys.stderr)
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,32 @@
+"""自适应采样间隔（AdaptiveInterval）测试：稳定时逐步放慢，明显变化时回到最短间隔"""
+
+from gpu_monitor_client import AdaptiveInterval
+
+def gpus(util=10, used=1000, pids=(1,), total=10000):
+    return [{'index': 0, 'utilization': util, 'memory_used': used, 'memory_total': total,
+             'processes': [{'pid': pid} for pid in pids]}]
+
+def test_backs_off_while_stable_up_to_max():
+    scheduler = AdaptiveInterval(1, 5, backoff=2)
+    assert scheduler.update(gpus()) == 1  # 第一个样本没有比较对象，按最短间隔
+    # 低于阈值的抖动视为稳定
+    assert [scheduler.update(gpus(util=14, used=1100)) for _ in range(4)] == [2, 4, 5, 5]
+
+def test_changes_reset_to_min():
+    for changed in (gpus(util=15), gpus(used=1200), gpus(pids=(1, 2)), gpus() + [dict(gpus()[0], index=1)]):
+        scheduler = AdaptiveInterval(1, 8, backoff=2)
+        scheduler.update(gpus())
+        scheduler.update(gpus())
+        assert scheduler.interval == 2
+        assert scheduler.update(changed) == 1
+
+def test_legacy_strings_and_missing_values():
+    scheduler = AdaptiveInterval(1, 8, backoff=2)
+    scheduler.update([{'index': 0, 'utilization': '10 %', 'memory_used': '1000 MiB', 'memory_total': 'N/A'}])
+    # 无法解析的值按 0 处理，不会抛出异常
+    assert scheduler.update([{'index': 0, 'utilization': None, 'memory_used': None}]) == 1
+    assert scheduler.update([{'index': 0, 'utilization': None, 'memory_used': None}]) == 2
+
+def test_fixed_interval():
+    scheduler = AdaptiveInterval(3, 3)
+    assert {scheduler.update(gpus(util=i * 50)) for i in range(3)} == {3}
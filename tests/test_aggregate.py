@@ -0,0 +1,44 @@
+"""窗口聚合（WindowAggregator）测试：上报最后一个样本，附带窗口内各指标的统计值"""
+
+from gpu_monitor_client import WindowAggregator
+
+def gpu(index, utilization, memory_used=100, power_draw=None):
+    return {'index': index, 'utilization': utilization, 'memory_used': memory_used, 'memory_total': 1000,
+            'power_draw': power_draw, 'processes': []}
+
+def test_flush_reports_last_sample_with_window_stats():
+    aggregator = WindowAggregator(fields=['utilization', 'memory_used', 'power_draw'])
+    for i in range(20):
+        aggregator.add([gpu(0, i * 5, memory_used=100 + i), gpu(1, 50)])
+    first, second = aggregator.flush()
+    # 样本本身以最后一个为准
+    assert (first['utilization'], first['memory_used'], first['window_samples']) == (95, 119, 20)
+    assert first['aggregates']['utilization'] == {'min': 0.0, 'max': 95.0, 'mean': 47.5, 'p95': 90.0}
+    assert first['aggregates']['memory_used']['max'] == 119.0
+    # 整个窗口都缺失的字段不带统计值
+    assert 'power_draw' not in first['aggregates']
+    assert second['aggregates']['utilization'] == {'min': 50.0, 'max': 50.0, 'mean': 50.0, 'p95': 50.0}
+
+def test_flush_starts_new_window():
+    aggregator = WindowAggregator()
+    assert aggregator.flush() is None
+    last = [gpu(0, 10)]
+    aggregator.add([gpu(0, 90)])
+    aggregator.add(last)
+    (reported,) = aggregator.flush()
+    assert reported['aggregates']['utilization']['max'] == 90.0
+    assert 'aggregates' not in last[0]  # 不修改采集到的样本
+    assert aggregator.flush() is None
+    aggregator.add([gpu(0, 30)])
+    (reported,) = aggregator.flush()
+    assert reported['aggregates']['utilization']['min'] == reported['aggregates']['utilization']['max'] == 30.0
+    assert reported['window_samples'] == 1
+
+def test_legacy_string_values():
+    aggregator = WindowAggregator(fields=['utilization', 'memory_used'])
+    aggregator.add([{'index': 0, 'utilization': '20', 'memory_used': '1024 MiB'}])
+    aggregator.add([{'index': 0, 'utilization': 'N/A', 'memory_used': '2048 MiB'}])
+    (reported,) = aggregator.flush()
+    assert reported['aggregates']['utilization']['mean'] == 20.0
+    assert reported['aggregates']['memory_used']['mean'] == 1536.0
+    assert reported['window_samples'] == 2
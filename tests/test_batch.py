@@ -0,0 +1,130 @@
+"""断线缓存的批量补传测试：服务端按 spool_id + 序号去重，响应丢失后的重试不会重复入库"""
+
+import json
+
+import pytest
+import requests
+from flask import Flask
+
+from gpu_monitor_client import SampleSpool, default_spool_path, flush_spool
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import BATCH_PATH, build_batch_body
+
+class Response:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self._json = response.get_json()
+
+    def json(self):
+        return self._json
+
+class FlaskLink:
+    """把 ServerLink 的请求转给 Flask 测试客户端；lose_next 为真时请求照常处理，但响应丢失（连接中断）"""
+
+    legacy = False
+    timeout = 5
+
+    def __init__(self, client):
+        self.client = client
+        self.lose_next = False
+        self.requests = []
+
+    def post(self, path, data=None, headers=None, timeout=None, json=None):
+        response = self.client.post(path, data=data, headers=headers, json=json)
+        self.requests.append((path, response.status_code))
+        if self.lose_next:
+            self.lose_next = False
+            raise requests.exceptions.ConnectionError('response lost')
+        return Response(response)
+
+    def retry_in(self):
+        return 0
+
+    def mark_success(self):
+        pass
+
+    def mark_failure(self, reconnect=False):
+        pass
+
+@pytest.fixture
+def server():
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    state.stored = []
+
+    @state.on_store
+    def remember(server_name, data, sampled_at):
+        state.stored.append(data['timestamp'])
+    return state, app.test_client()
+
+def sample(i):
+    return json.dumps({'server_name': 'a', 'timestamp': f'2024-10-18 12:00:{i:02d}',
+                       'gpus': [{'index': 0, 'utilization': i}]}).encode()
+
+def test_retry_after_lost_response_with_shifted_window(server, tmp_path):
+    state, client = server
+    link = FlaskLink(client)
+    spool = SampleSpool(str(tmp_path / 'spool'), 1)
+    for i in range(3):
+        spool.append(sample(i))
+    # 第一批已入库但响应丢失，样本留在缓存中
+    link.lose_next = True
+    assert not flush_spool(link, 'a', spool, batch_size=3)
+    assert spool.count == 3
+    # 重试前又缓存了一条，批次边界变了，已入库的三条被跳过
+    spool.append(sample(3))
+    assert flush_spool(link, 'a', spool, batch_size=4)
+    assert spool.count == 0
+    assert state.stored == [f'2024-10-18 12:00:{i:02d}' for i in range(4)]
+    spool.close()
+
+def test_batch_reports_stored_and_skipped(server):
+    state, client = server
+    body = build_batch_body('a', [sample(1), sample(2)], 'spool-1', [1, 2])
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    assert client.post(BATCH_PATH, data=body, headers=headers).get_json()['count'] == 2
+    body = build_batch_body('a', [sample(2), sample(3)], 'spool-1', [2, 3])
+    result = client.post(BATCH_PATH, data=body, headers=headers).get_json()
+    assert (result['count'], result['skipped']) == (1, 1)
+    # 其他缓存的序号互不影响
+    body = build_batch_body('a', [sample(4)], 'spool-2', [1])
+    assert client.post(BATCH_PATH, data=body, headers=headers).get_json()['count'] == 1
+    assert len(state.stored) == 4
+    assert state.spool_progress.stored('spool-1') == 3
+
+def test_invalid_batch_stores_nothing(server):
+    state, client = server
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    bad = json.dumps({'timestamp': 'x', 'gpus': 'not a list'}).encode()
+    body = build_batch_body('a', [sample(1), bad], 'spool-1', [1, 2])
+    assert client.post(BATCH_PATH, data=body, headers=headers).status_code == 400
+    body = build_batch_body('a', [sample(1)], 'spool-1', [1, 2])
+    assert client.post(BATCH_PATH, data=body, headers=headers).status_code == 400
+    assert state.stored == []
+    assert state.spool_progress.stored('spool-1') == 0
+
+def test_batch_in_progress_returns_409(server):
+    state, client = server
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    assert state.spool_progress.begin('spool-1')
+    body = build_batch_body('a', [sample(1)], 'spool-1', [1])
+    response = client.post(BATCH_PATH, data=body, headers=headers)
+    assert response.status_code == 409 and response.get_json()['retry']
+    state.spool_progress.end('spool-1')
+    assert client.post(BATCH_PATH, data=body, headers=headers).status_code == 200
+
+def test_batch_without_spool_id_is_not_deduplicated(server):
+    state, client = server
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    body = build_batch_body('a', [sample(1)])
+    client.post(BATCH_PATH, data=body, headers=headers)
+    client.post(BATCH_PATH, data=body, headers=headers)
+    assert len(state.stored) == 2
+
+def test_default_spool_path(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_STATE_HOME', str(tmp_path))
+    assert default_spool_path('node/01') == str(tmp_path / 'gpu-monitor' / 'node_01.spool')
+    monkeypatch.delenv('XDG_STATE_HOME')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert default_spool_path('n') == str(tmp_path / '.local' / 'state' / 'gpu-monitor' / 'n.spool')
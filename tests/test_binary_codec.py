@@ -0,0 +1,86 @@
+"""二进制样本编码（encode_binary_sample / decode_binary_sample）的往返测试"""
+
+import json
+import struct
+
+import pytest
+
+from gpu_monitor_protocol import (BINARY_HEADER, BINARY_MAGIC, SCHEMA_VERSION, decode_binary_sample,
+                                  encode_binary_sample)
+
+def sample():
+    return {
+        'schema': SCHEMA_VERSION,
+        'server_name': 'gpu-节点-01',
+        'timestamp': '2024-10-18 12:00:05',
+        'gpus': [
+            {
+                'index': 0, 'name': 'NVIDIA A100-SXM4-80GB', 'uuid': 'GPU-aaa',
+                'temperature': 61.0, 'utilization': 87.0, 'memory_used': 40960.0, 'memory_total': 81920.0,
+                'memory_percent': 50.0, 'power_draw': 312.45, 'power_limit': 400.0,
+                'pci_bus_id': '00000000:01:00.0',
+                'aggregates': {'utilization': {'min': 80.0, 'max': 95.0}},
+                'processes': [
+                    {'pid': 1234, 'name': 'python train.py', 'memory': 40000.0, 'user': 'alice', 'sm_util': 70},
+                    {'pid': 2345, 'name': '', 'memory': None},
+                ],
+            },
+            {
+                'index': 1, 'name': 'NVIDIA A100-SXM4-80GB', 'uuid': 'GPU-bbb',
+                'temperature': 35.0, 'utilization': None, 'memory_used': 0.0, 'memory_total': 81920.0,
+                'memory_percent': 0.0, 'power_draw': None, 'power_limit': 400.0,
+                'processes': [],
+            },
+        ],
+        'host': {'cpu_percent': 12.5, 'memory_percent': 40.0},
+    }
+
+def test_round_trip():
+    data = sample()
+    decoded = decode_binary_sample(encode_binary_sample(data, seq=42))
+    # 带序号的二进制样本总是完整样本（关键帧）
+    assert decoded == dict(data, seq=42, keyframe=True)
+
+def test_without_seq():
+    decoded = decode_binary_sample(encode_binary_sample(sample()))
+    assert 'seq' not in decoded and 'keyframe' not in decoded
+
+def test_float32_values_are_rounded():
+    data = sample()
+    data['gpus'][0]['power_draw'] = 123.456789
+    data['gpus'][0]['temperature'] = '61 C'  # 旧版字符串字段同样按数值编码
+    gpu = decode_binary_sample(encode_binary_sample(data))['gpus'][0]
+    assert gpu['power_draw'] == 123.46
+    assert gpu['temperature'] == 61
+
+def test_missing_timestamp_and_bad_pid():
+    data = sample()
+    del data['timestamp']
+    data['gpus'][0]['processes'][0]['pid'] = 'N/A'
+    decoded = decode_binary_sample(encode_binary_sample(data))
+    assert decoded['timestamp'] is None
+    assert decoded['gpus'][0]['processes'][0]['pid'] == 0
+
+def test_sample_extras_are_optional_trailer():
+    data = sample()
+    body = encode_binary_sample(data)
+    del data['host']
+    bare = encode_binary_sample(data)
+    # 样本级附加字段只追加在末尾，没有附加字段的编码是它的前缀
+    assert body.startswith(bare)
+    assert decode_binary_sample(bare) == data
+
+def test_rejects_foreign_body():
+    body = encode_binary_sample(sample())
+    with pytest.raises(ValueError):
+        decode_binary_sample(b'JUNK' + body[4:])
+    magic, version, *rest = BINARY_HEADER.unpack_from(body, 0)
+    assert magic == BINARY_MAGIC
+    with pytest.raises(ValueError):
+        decode_binary_sample(BINARY_HEADER.pack(magic, version + 1, *rest) + body[BINARY_HEADER.size:])
+    with pytest.raises(struct.error):
+        decode_binary_sample(body[:BINARY_HEADER.size + 5])
+
+def test_smaller_than_json():
+    data = sample()
+    assert len(encode_binary_sample(data)) < len(json.dumps(data, separators=(',', ':')).encode())
@@ -0,0 +1,103 @@
+"""客户端自身运行指标测试：耗时直方图、窗口统计、本地 /metrics 接口，以及服务端保留最近一次的统计"""
+
+import json
+import socket
+import time
+import urllib.request
+
+from flask import Flask
+
+from gpu_monitor_client import AdaptiveInterval, ClientStats, LatencyHistogram, Sampler, start_stats_server
+from gpu_monitor_ingest import MonitorState, create_blueprint
+
+def test_histogram_quantiles_use_bucket_bounds():
+    histogram = LatencyHistogram()
+    for ms in [0.3] * 90 + [7] * 9 + [40]:
+        histogram.observe(ms)
+    summary = histogram.summary(buckets=True)
+    assert (summary['count'], summary['p50'], summary['p95'], summary['max']) == (100, 0.5, 10, 40)
+    assert summary['mean'] == round((0.3 * 90 + 63 + 40) / 100, 3)
+    assert summary['buckets'] == {'0.5': 90, '10': 9, '50': 1}
+    # 超出最大桶的值按最大值估计
+    histogram.observe(60000)
+    assert histogram.quantile(1.0) == 60000
+    assert LatencyHistogram().summary() == {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': 0.0}
+
+def test_window_summary_resets_but_total_keeps():
+    stats = ClientStats()
+    stats.observe('collect', 0.004)
+    stats.observe('send', 0.02)
+    window = stats.window_summary()
+    assert window['stages']['collect']['count'] == 1 and 'buckets' not in window['stages']['collect']
+    stats.observe('collect', 0.006)
+    assert set(stats.window_summary()['stages']) == {'collect'}
+    total = stats.summary()
+    assert total['stages']['collect']['count'] == 2 and total['stages']['send']['count'] == 1
+    assert total['targets'] == {} and total['rss_mb'] > 0
+
+def get_unix(path, request_path):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        sock.sendall(f'GET {request_path} HTTP/1.0\r\n\r\n'.encode())
+        response = b''
+        while chunk := sock.recv(65536):
+            response += chunk
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+def test_metrics_endpoints(tmp_path):
+    stats = ClientStats()
+    stats.observe('smi', 0.1)
+    server = start_stats_server('127.0.0.1:0', stats)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            assert json.load(response)['stages']['smi']['count'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    path = str(tmp_path / 'stats.sock')
+    server = start_stats_server(f'unix:{path}', stats)
+    try:
+        status, body = get_unix(path, '/')
+        assert status == 200 and json.loads(body)['stages']['smi']['p95'] == 100
+        assert get_unix(path, '/other')[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class Collector:
+    last_timings = {'smi': 0.003, 'parse': None}
+
+    def collect(self):
+        return [{'index': 0, 'utilization': 10, 'processes': []}]
+
+class Target:
+    def __init__(self):
+        self.offered = []
+
+    def offer(self, payload):
+        self.offered.append(payload)
+
+def test_summary_attached_every_n_samples_and_kept_by_server():
+    stats = ClientStats()
+    target = Target()
+    sampler = Sampler(Collector(), AdaptiveInterval(0.01, 0.01), 'a', [target], stats=stats, stats_every=3)
+    sampler.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(target.offered) < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sampler.stop()
+    offered = target.offered[:6]
+    assert ['client_stats' in payload for payload in offered] == [False, False, True, False, False, True]
+    stages = offered[2]['client_stats']['stages']
+    assert {'collect', 'smi', 'enrich', 'tick_lag'} <= set(stages) and 'parse' not in stages
+    # 服务端保留最近一次的统计，不带统计的样本沿用
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    client = app.test_client()
+    for payload in offered[2:4]:
+        assert client.post('/api/update', json=payload).status_code == 200
+    assert state.servers()['a']['client_stats']['stages']['smi']['count'] == 3
@@ -0,0 +1,140 @@
+"""nvidia-smi 采集器测试：XML字段计划（XmlFieldPlan / parse_gpu_info）和常驻流式采集（SmiStreamCollector），
+用 tests/fake_nvidia_smi.py 代替真实驱动"""
+
+import io
+import time
+
+import pytest
+
+from gpu_monitor_client import (STREAM_QUERY_FIELDS, SmiStreamCollector, XmlFieldPlan, build_xml_gpus,
+                                parse_gpu_info, parse_stream_line)
+
+@pytest.fixture
+def smi_log(tmp_path, monkeypatch):
+    """记录假 nvidia-smi 每次被调用的参数"""
+    path = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_SMI_LOG', str(path))
+
+    def calls():
+        return path.read_text().splitlines() if path.exists() else []
+    return calls
+
+def test_plan_narrows_to_needed_sections():
+    assert XmlFieldPlan().command('nvidia-smi') == [
+        'nvidia-smi', '-q', '-x', '-d', 'MEMORY,PIDS,POWER,TEMPERATURE,UTILIZATION']
+    assert XmlFieldPlan(['clocks', 'throttle']).command('nvidia-smi')[-1] == \
+        'CLOCK,MEMORY,PERFORMANCE,PIDS,POWER,TEMPERATURE,UTILIZATION'
+    # PCIe 吞吐没有对应的 -d 段，只能取完整输出
+    assert XmlFieldPlan(['pcie']).command('nvidia-smi') == ['nvidia-smi', '-q', '-x']
+    assert XmlFieldPlan().command('nvidia-smi', narrow=False) == ['nvidia-smi', '-q', '-x']
+    with pytest.raises(ValueError):
+        XmlFieldPlan(['fan'])
+
+def test_extract_single_pass():
+    plan = XmlFieldPlan()
+    xml = (b'<nvidia_smi_log><driver_version>550.54</driver_version>'
+           b'<gpu id="0"><product_name>T4</product_name><fb_memory_usage><used>10 MiB</used>'
+           b'<total>100 MiB</total></fb_memory_usage><gpu_power_readings><power_draw>N/A</power_draw>'
+           b'<instant_power_draw>20.5 W</instant_power_draw></gpu_power_readings>'
+           b'<processes><process_info><pid>7</pid><process_name>a</process_name></process_info></processes>'
+           b'</gpu></nvidia_smi_log>')
+    ((gpu_id, fields),) = plan.extract(io.BytesIO(xml))
+    assert gpu_id == '0'
+    # 候选路径按出现顺序取第一个有效值，N/A 会被后面的有效值替换
+    assert fields == {'processes': [{'pid': '7', 'name': 'a'}], 'driver_version': '550.54', 'name': 'T4',
+                      'memory_used': '10 MiB', 'memory_total': '100 MiB', 'power_draw': '20.5 W'}
+    (gpu,) = build_xml_gpus(plan, [(gpu_id, fields)])
+    assert gpu['memory_percent'] == 10.0
+    assert gpu['power_draw'] == 20.5
+    assert gpu['temperature'] is None
+    assert gpu['processes'] == [{'pid': 7, 'name': 'a', 'memory': None}]
+
+def test_parse_gpu_info(fake_smi):
+    gpus = parse_gpu_info(fake_smi)
+    assert [gpu['uuid'] for gpu in gpus] == ['GPU-aaa', 'GPU-bbb']
+    first, second = gpus
+    assert first['name'] == 'NVIDIA A100-SXM4-80GB'
+    assert first['driver_version'] == '535.104.05'
+    assert (first['temperature'], first['utilization'], first['memory_used'], first['memory_percent']) == \
+        (61, 87, 40960, 50.0)
+    assert (first['power_draw'], first['power_limit']) == (312.45, 400)
+    assert first['processes'] == [{'pid': 1234, 'name': 'python train.py', 'memory': 40000}]
+    assert second['power_draw'] is None
+    assert second['processes'] == []
+    assert 'clock_sm' not in first
+
+def test_optional_metrics(fake_smi):
+    first, second = parse_gpu_info(fake_smi, XmlFieldPlan(['clocks', 'pcie', 'ecc', 'throttle']))
+    assert (first['clock_graphics'], first['clock_sm'], first['clock_memory']) == (1410, 1410, 1593)
+    assert (first['pcie_tx'], first['pcie_rx']) == (1200, 800)
+    assert (first['ecc_mode'], first['ecc_corrected'], first['ecc_uncorrected']) == ('Enabled', 2, 0)
+    assert first['throttle_reasons'] == ['clocks_event_reason_sw_power_cap']
+    assert second['throttle_reasons'] == []
+    assert second['clock_sm'] is None
+
+def test_static_fields_cached_between_narrow_queries(fake_smi, smi_log):
+    static_cache = {}
+    full = parse_gpu_info(fake_smi, static_cache=static_cache)
+    narrow = parse_gpu_info(fake_smi, static_cache=static_cache)
+    # 第二次只请求 -d 指定的段，型号、UUID 等由缓存补齐
+    calls = smi_log()
+    assert calls[0] == '-q -x'
+    assert calls[1].startswith('-q -x -d ')
+    assert narrow == full
+    assert set(static_cache) == {'00000000:01:00.0', '00000000:02:00.0'}
+
+def test_new_gpu_triggers_full_query():
+    plan = XmlFieldPlan()
+    static_cache = {'old': {'name': 'T4', 'uuid': 'GPU-old', 'pci_bus_id': None, 'driver_version': None}}
+    build_xml_gpus(plan, [('new', {'memory_used': '1 MiB'})], static_cache)
+    assert static_cache == {}
+
+def test_parse_gpu_info_failure(fake_smi, monkeypatch):
+    monkeypatch.setenv('FAKE_SMI_FAIL', '1')
+    assert parse_gpu_info(fake_smi) is None
+    assert parse_gpu_info('/nonexistent/nvidia-smi') is None
+
+def test_parse_stream_line():
+    line = '3, GPU-x, 45, [N/A], 1000, 24576, 120.50, 300.00, 00000000:01:00.0, 535.104.05, Tesla V100, PCIe'
+    gpu = parse_stream_line(line)
+    assert gpu['index'] == 3
+    assert gpu['name'] == 'Tesla V100, PCIe'  # 型号放在最后，其中的逗号不影响切分
+    assert gpu['utilization'] is None
+    assert gpu['memory_percent'] == 4.1
+    assert parse_stream_line('3, GPU-x, 45') is None
+    assert parse_stream_line('index, ' + ', '.join(STREAM_QUERY_FIELDS[1:])) is None
+
+def test_stream_collector(fake_smi, smi_log):
+    collector = SmiStreamCollector(0.05, nvidia_smi=fake_smi)
+    try:
+        first = collector.collect()
+        assert [gpu['uuid'] for gpu in first] == ['GPU-aaa', 'GPU-bbb']
+        assert first[1]['name'] == 'NVIDIA GeForce RTX 3090, Ti'
+        assert first[1]['power_draw'] is None
+        assert first[0]['processes'] == [{'pid': 1234, 'name': 'python train.py', 'memory': 500}]
+        assert first[1]['processes'] == [{'pid': 2345, 'name': 'python -c import torch, time', 'memory': 700}]
+        time.sleep(0.2)
+        second = collector.collect()
+        # 常驻进程持续输出，每次取最新一帧；显存变化时才重新查询进程列表
+        assert second[0]['memory_used'] > first[0]['memory_used']
+        calls = smi_log()
+        assert sum(call.startswith('--query-gpu') for call in calls) == 1
+        assert sum(call.startswith('--query-compute-apps') for call in calls) == 2
+        assert collector.restarts == 0
+    finally:
+        collector.close()
+
+def test_stream_collector_restarts_hung_process(fake_smi, smi_log, monkeypatch):
+    # GPU数量未知时第一帧要等第二帧开头才发布，所以在第二帧之后卡住
+    monkeypatch.setenv('FAKE_SMI_HANG_AFTER', '2')
+    collector = SmiStreamCollector(0.05, nvidia_smi=fake_smi, hang_timeout=0.5)
+    try:
+        assert collector.collect() is not None
+        time.sleep(0.7)
+        # 超过 hang_timeout 没有新输出，下一次采集重启子进程并等到新的一帧
+        gpus = collector.collect()
+        assert collector.restarts == 1
+        assert [gpu['index'] for gpu in gpus] == [0, 1]
+        assert sum(call.startswith('--query-gpu') for call in smi_log()) == 2
+    finally:
+        collector.close()
@@ -0,0 +1,87 @@
+"""请求体解压（含解压上限）、响应压缩协商和按版本缓存的响应（ResponseCache）测试"""
+
+import gzip
+import json
+import zlib
+
+import pytest
+from flask import Flask
+
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import (BATCH_PATH, BodyTooLarge, ResponseCache, build_batch_body, choose_encoding,
+                                  decode_body)
+
+def test_decode_body_encodings():
+    raw = b'{"a": 1}' * 100
+    assert decode_body(raw) == decode_body(raw, 'identity') == raw
+    assert decode_body(gzip.compress(raw), ' GZIP ') == raw
+    assert decode_body(zlib.compress(raw), 'deflate') == raw
+    with pytest.raises(ValueError):
+        decode_body(raw, 'br')
+    with pytest.raises(ValueError):
+        decode_body(b'not gzip', 'gzip')
+    # 截断的压缩数据不会被当作完整的请求体
+    with pytest.raises(ValueError):
+        decode_body(gzip.compress(raw)[:-12], 'gzip')
+
+def test_decode_body_limit():
+    bomb = gzip.compress(b'\0' * (1 << 20))
+    assert len(bomb) < 2048
+    assert len(decode_body(bomb, 'gzip', limit=1 << 20)) == 1 << 20
+    with pytest.raises(BodyTooLarge):
+        decode_body(bomb, 'gzip', limit=(1 << 20) - 1)
+    with pytest.raises(BodyTooLarge):
+        decode_body(zlib.compress(b'\0' * 4096), 'deflate', limit=4095)
+
+def test_oversized_request_returns_413(monkeypatch):
+    app = Flask(__name__)
+    app.register_blueprint(create_blueprint(MonitorState()))
+    client = app.test_client()
+    monkeypatch.setattr(decode_body, '__defaults__', (None, 1000))
+    samples = [json.dumps({'timestamp': 'x', 'gpus': [], 'pad': 'x' * 1000}).encode()]
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    response = client.post(BATCH_PATH, data=build_batch_body('a', samples), headers=headers)
+    assert response.status_code == 413 and response.get_json()['error'] == 'too_large'
+    body = gzip.compress(json.dumps({'server_name': 'a', 'gpus': [], 'pad': 'x' * 1000}).encode())
+    assert client.post('/api/update', data=body, headers=headers).status_code == 413
+
+@pytest.mark.parametrize('header, encoding', [
+    ('gzip, deflate, br', 'gzip'),
+    ('*', 'gzip'),
+    ('gzip;q=0, deflate', None),
+    ('', None),
+    (None, None),
+])
+def test_choose_encoding(header, encoding):
+    assert choose_encoding(header) == encoding
+
+def test_response_cache_builds_once_per_version():
+    cache = ResponseCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return 'x' * 2000
+
+    raw = cache.get('page', 1, None, build)
+    assert raw == b'x' * 2000
+    assert gzip.decompress(cache.get('page', 1, 'gzip', build)) == raw
+    assert cache.get('page', 1, 'gzip', build) is cache.get('page', 1, 'gzip', build)
+    assert len(builds) == 1
+    # 版本变化后重新生成，旧版本的压缩结果一并丢弃
+    cache.get('page', 2, 'gzip', build)
+    assert len(builds) == 2
+
+def test_cached_response_negotiates_compression():
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    client = app.test_client()
+    small = client.get('/api/data', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers and small.headers['Vary'] == 'Accept-Encoding'
+    # 超过 COMPRESS_MIN_SIZE 的响应按 Accept-Encoding 压缩
+    state.store_sample('a', {'timestamp': 'x', 'gpus': [{'index': i, 'name': 'GPU' * 50} for i in range(8)]})
+    response = client.get('/api/data', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'a' in json.loads(gzip.decompress(response.data))
+    assert 'Content-Encoding' not in client.get('/api/data').headers
@@ -0,0 +1,147 @@
+"""增量样本（make_delta / apply_delta）和进程表差分的往返测试"""
+
+import copy
+import random
+
+import pytest
+
+from gpu_monitor_client import DeltaEncoder
+from gpu_monitor_protocol import (DeltaBaseMismatch, apply_delta, apply_process_diff, diff_processes,
+                                  expand_sample, make_delta)
+
+def random_process(rng, pid):
+    process = {'pid': pid, 'name': rng.choice(['train.py', 'eval.py', 'python']), 'memory': rng.randrange(0, 4000)}
+    # pmon 只在部分样本中给出进程的使用率，这些字段会时有时无
+    if rng.random() < 0.5:
+        process['sm_util'] = rng.randrange(0, 100)
+        process['mem_util'] = rng.randrange(0, 100)
+    if rng.random() < 0.3:
+        process['user'] = rng.choice(['alice', 'bob'])
+    return process
+
+def random_gpu(rng, index, uuid=None):
+    gpu = {
+        'index': index,
+        'uuid': uuid or f'GPU-{index}-{rng.randrange(2)}',
+        'utilization': rng.choice([0, 35, 99, None]),
+        'memory_used': rng.randrange(0, 24576),
+        'temperature': rng.randrange(30, 90),
+        'processes': [random_process(rng, pid) for pid in rng.sample(range(100, 110), rng.randrange(0, 5))],
+    }
+    if rng.random() < 0.3:
+        gpu['aggregates'] = {'utilization': {'mean': 10.0, 'max': rng.randrange(10, 100)}}
+    if rng.random() < 0.1:
+        gpu['processes'] = None
+    return gpu
+
+def mutate(rng, gpus):
+    """在上一条样本的基础上随机改动：字段变化或消失、进程增减/改字段/换顺序、GPU增减或换卡"""
+    gpus = copy.deepcopy(gpus)
+    for gpu in gpus:
+        if rng.random() < 0.5:
+            gpu['utilization'] = rng.randrange(0, 100)
+        if rng.random() < 0.2:
+            gpu.pop(rng.choice(['aggregates', 'temperature']), None)
+        if rng.random() < 0.1:
+            gpu['uuid'] = f"GPU-{gpu['index']}-new"
+        processes = gpu.get('processes')
+        if isinstance(processes, list):
+            for process in processes:
+                if rng.random() < 0.4:
+                    process.pop('sm_util', None)
+                    process.pop('mem_util', None)
+                elif rng.random() < 0.4:
+                    process['sm_util'] = rng.randrange(0, 100)
+                if rng.random() < 0.3:
+                    process['memory'] = rng.randrange(0, 4000)
+            if processes and rng.random() < 0.3:
+                processes.pop(rng.randrange(len(processes)))
+            if rng.random() < 0.3:
+                pids = {process['pid'] for process in processes}
+                free = [pid for pid in range(100, 120) if pid not in pids]
+                processes.insert(rng.randrange(len(processes) + 1), random_process(rng, rng.choice(free)))
+            if rng.random() < 0.2:
+                rng.shuffle(processes)
+        elif rng.random() < 0.5:
+            gpu['processes'] = []
+    if gpus and rng.random() < 0.1:
+        gpus.pop()
+    if rng.random() < 0.1:
+        gpus.append(random_gpu(rng, len(gpus)))
+    return gpus
+
+def test_random_round_trip():
+    rng = random.Random(20241018)
+    for _ in range(5000):
+        base = [random_gpu(rng, index) for index in range(rng.randrange(1, 4))]
+        new = mutate(rng, base)
+        snapshot = copy.deepcopy(base)
+        changes, removed = make_delta(base, new)
+        assert apply_delta(base, changes, removed) == new
+        assert base == snapshot  # 基准不会被就地修改
+
+def test_removed_process_fields_are_cleared():
+    base = [{'index': 0, 'uuid': 'GPU-0', 'processes': [{'pid': 1, 'memory': 10, 'sm_util': 80, 'mem_util': 20}]}]
+    new = [{'index': 0, 'uuid': 'GPU-0', 'processes': [{'pid': 1, 'memory': 10}]}]
+    changes, removed = make_delta(base, new)
+    assert changes['0']['process_changes'] == {'removed_fields': {'1': ['sm_util', 'mem_util']}}
+    assert apply_delta(base, changes, removed) == new
+
+def test_process_order_follows_client():
+    base = [{'pid': 1}, {'pid': 2}]
+    new = [{'pid': 3}, {'pid': 2}, {'pid': 1}]
+    diff = diff_processes(base, new)
+    assert diff['order'] == [3, 2, 1]
+    assert apply_process_diff(base, diff)[0] == new
+    # 新进程追加在末尾、其余顺序不变时不需要 order
+    assert 'order' not in diff_processes(base, [{'pid': 1}, {'pid': 2}, {'pid': 3}])
+
+def test_process_events_from_delta():
+    base = [{'index': 0, 'uuid': 'GPU-0', 'processes': [{'pid': 1, 'name': 'a'}]}]
+    new = [{'index': 0, 'uuid': 'GPU-0', 'processes': [{'pid': 2, 'name': 'b'}]}]
+    changes, removed = make_delta(base, new)
+    events = []
+    apply_delta(base, changes, removed, events)
+    assert sorted((event['event'], event['pid']) for event in events) == [('end', 1), ('start', 2)]
+
+def test_expand_sample_checks_base_seq():
+    previous = {'seq': 7, 'gpus': [{'index': 0, 'utilization': 10}]}
+    delta = {'seq': 8, 'base_seq': 7, 'changes': {'0': {'utilization': 20}}}
+    assert expand_sample(delta, previous)['gpus'] == [{'index': 0, 'utilization': 20}]
+    with pytest.raises(DeltaBaseMismatch):
+        expand_sample(dict(delta, base_seq=6), previous)
+
+def test_encoder_keyframe_cadence():
+    encoder = DeltaEncoder(keyframe_every=3)
+    gpus = [{'index': 0, 'uuid': 'GPU-0', 'utilization': 0, 'processes': []}]
+    kinds = []
+    for i in range(9):
+        payload = {'server_name': 'a', 'timestamp': f'2024-10-18 12:00:{i:02d}',
+                   'gpus': [dict(gpus[0], utilization=i)]}
+        wire = encoder.encode(payload)
+        kinds.append('key' if wire.get('keyframe') else 'delta')
+        encoder.ack(wire, payload['gpus'])
+    # 每个关键帧之后最多 keyframe_every 个增量
+    assert kinds == ['key', 'delta', 'delta', 'delta', 'key', 'delta', 'delta', 'delta', 'key']
+
+def test_encoder_delta_is_relative_to_last_ack():
+    encoder = DeltaEncoder()
+    base = [{'index': 0, 'uuid': 'GPU-0', 'utilization': 10, 'processes': [{'pid': 1, 'name': 'a'}]}]
+    first = encoder.encode({'server_name': 'a', 'gpus': base})
+    assert first['keyframe'] and first['seq'] == 1
+    # 未确认时仍然发送关键帧
+    second = encoder.encode({'server_name': 'a', 'gpus': base})
+    assert second['keyframe'] and second['seq'] == 2
+    encoder.ack(second, base)
+    new = [{'index': 0, 'uuid': 'GPU-0', 'utilization': 20, 'processes': [{'pid': 2, 'name': 'b'}]}]
+    third = encoder.encode({'server_name': 'a', 'gpus': new})
+    assert third['base_seq'] == 2 and 'gpus' not in third
+    # 丢失的样本（第三条未确认）不影响下一条增量的基准
+    fourth = encoder.encode({'server_name': 'a', 'gpus': new})
+    assert fourth['base_seq'] == 2
+    previous = {'seq': 2, 'gpus': base}
+    events = []
+    assert expand_sample(fourth, previous, events)['gpus'] == new
+    assert sorted((event['event'], event['pid']) for event in events) == [('end', 1), ('start', 2)]
+    encoder.reset()
+    assert encoder.encode({'server_name': 'a', 'gpus': new})['keyframe']
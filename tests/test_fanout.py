@@ -0,0 +1,72 @@
+"""多服务端上报测试：同一份采样交给每个上报目标，某个服务端不可用不影响其他目标"""
+
+import socket
+import threading
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+
+from gpu_monitor_client import AdaptiveInterval, ReportTarget, Sampler, SampleSpool, ServerLink, target_spool_path
+from gpu_monitor_ingest import MonitorState, create_blueprint
+
+class Collector:
+    def collect(self):
+        return [{'index': 0, 'uuid': 'GPU-aaa', 'utilization': 10, 'memory_used': 100, 'memory_total': 1000,
+                 'processes': []}]
+
+@pytest.fixture
+def live_server():
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield state, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+def unused_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+def test_down_server_does_not_block_others(live_server, tmp_path):
+    state, url = live_server
+    down = unused_url()
+    spool_path = target_spool_path(str(tmp_path / 'a.spool'), down, multiple=True)
+    targets = [ReportTarget(ServerLink(url, timeout=2), label='up '),
+               ReportTarget(ServerLink(down, timeout=2, backoff_base=0.01), label='down ',
+                            spool=SampleSpool(spool_path, 1))]
+    sampler = Sampler(Collector(), AdaptiveInterval(0.05, 0.05), 'node-1', targets)
+    for target in targets:
+        target.start()
+    sampler.start()
+    try:
+        deadline = time.monotonic() + 10
+        while (targets[0].sent < 5 or targets[1].failed < 1) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        sampler.stop()
+        for target in targets:
+            target.stop()
+            target.close()
+    assert targets[0].sent >= 5 and targets[0].failed == 0
+    assert state.gpu_data.get('node-1')['gpus'][0]['uuid'] == 'GPU-aaa'
+    # 不可用的服务端只影响它自己的目标：发送失败的样本写入该目标的缓存
+    assert targets[1].sent == 0 and targets[1].failed >= 1
+    assert SampleSpool(spool_path, 1).count >= 1
+
+def test_full_queue_drops_oldest():
+    target = ReportTarget(ServerLink('http://127.0.0.1:1'), queue_size=2)
+    for i in range(5):
+        target.offer({'seq': i})
+    assert target.dropped == 3
+    assert [target.samples.get_nowait()['seq'] for _ in range(2)] == [3, 4]
+    target.close()
+
+def test_target_spool_path():
+    assert target_spool_path('/x/a.spool', 'http://h:5000', multiple=False) == '/x/a.spool'
+    assert target_spool_path('/x/a.spool', 'http://h:5000/', multiple=True) == '/x/a.h_5000.spool'
+    assert target_spool_path(None, 'http://h:5000', multiple=True) is None
@@ -0,0 +1,106 @@
+"""历史数据库（HistoryDB）的写入、汇总和启动恢复测试"""
+
+import sqlite3
+import time
+
+import pytest
+
+from gpu_monitor_history import HISTORY_INTERVAL, HistoryDB, TieredHistory
+
+def record_samples(history, start, count, servers=('a', 'b')):
+    """按服务端的方式每5秒写入一个样本（服务器级总显存、一块GPU的两个序列、一个主机指标）"""
+    for i in range(count):
+        for n, server_name in enumerate(servers):
+            point = history.slot(server_name, start + i * HISTORY_INTERVAL + n)
+            history.record(server_name, point, 'total_memory_percent', None, (i * 7 + n) % 100)
+            history.label(server_name, 'GPU-x', n)
+            history.record(server_name, point, 'gpu_memory', 'GPU-x', (i * 3) % 100)
+            history.record(server_name, point, 'gpu_memory_peak', 'GPU-x', (i * 5) % 100)
+            history.record(server_name, point, 'host', 'cpu_percent', None if i % 10 == 0 else i % 50)
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'history.db')
+
+@pytest.fixture
+def base():
+    # 写入线程启动时按当前时间清理过期数据，样本时间取最近的整点之前一小时
+    return float((int(time.time()) // 3600 - 1) * 3600)
+
+def test_restore_matches_live_history(db_path, base):
+    # 3小时的样本：原始级别只恢复最近1小时，各级汇总从数据库中已汇总的桶恢复
+    start = base - 2 * 3600
+    count = 3 * 3600 // HISTORY_INTERVAL
+    now = start + count * HISTORY_INTERVAL
+    live = TieredHistory()
+    db = HistoryDB(db_path)
+    live.attach(db, now=start)
+    record_samples(live, start, count)
+    db.close()
+
+    restored = TieredHistory()
+    db = HistoryDB(db_path)
+    assert restored.attach(db, now=now) > 0
+    db.close()
+    for live_tier, restored_tier in zip(live.tiers, restored.tiers):
+        assert restored_tier.overlay() == live_tier.overlay()
+        assert restored_tier.labels == live_tier.labels
+
+def test_rollups_are_persisted_per_tier(db_path, base):
+    history = TieredHistory()
+    db = HistoryDB(db_path)
+    history.attach(db, now=base)
+    record_samples(history, base, 24, servers=('a',))  # 2分钟
+    db.close()
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT tier, bucket, count, total, low, high FROM rollups JOIN series ON series.id = series_id "
+                        "WHERE series.series = 'gpu_memory' ORDER BY tier, bucket").fetchall()
+    values = [(i * 3) % 100 for i in range(24)]
+    assert rows == [
+        (60, base // 60, 12, sum(values[:12]), min(values[:12]), max(values[:12])),
+        (60, base // 60 + 1, 12, sum(values[12:]), min(values[12:]), max(values[12:])),
+        (900, base // 900, 24, sum(values), min(values), max(values)),
+        (3600, base // 3600, 24, sum(values), min(values), max(values)),
+    ]
+    # 缺失值不计入汇总，文本只在序列表中保存一次
+    (count,) = conn.execute("SELECT count FROM rollups JOIN series ON series.id = series_id "
+                            "WHERE series.gpu = 'cpu_percent' AND tier = 3600").fetchone()
+    assert count == 24 - 3
+    assert conn.execute('SELECT COUNT(*) FROM series').fetchone() == (4,)
+    conn.close()
+
+def test_prune_bounds_raw_points_and_each_tier(db_path, base):
+    history = TieredHistory()
+    db = HistoryDB(db_path, raw_retention=86400)
+    history.attach(db, now=base)
+    record_samples(history, base, 24, servers=('a',))
+    db.close()
+    conn = sqlite3.connect(db_path)
+    # 两天后清理：原始点超过1天、1分钟一级超过12小时的都删除，15分钟和1小时两级仍在保留范围内
+    assert conn.execute('SELECT COUNT(*) FROM points').fetchone() == (24 * 4,)
+    db._prune(conn, base + 2 * 86400)
+    assert conn.execute('SELECT COUNT(*) FROM points').fetchone() == (0,)
+    assert [tier for (tier,) in conn.execute('SELECT DISTINCT tier FROM rollups ORDER BY tier')] == [900, 3600]
+    conn.close()
+
+def test_writer_starts_after_restore(db_path, base):
+    db = HistoryDB(db_path)
+    db.add(('a', '', base, 'total_memory_percent', 1.0))
+    # 接入前后台线程还没有启动，写入和清理不会与恢复同时进行
+    assert db._writer is None
+    TieredHistory().attach(db, now=base)
+    assert db._writer is not None
+    db.close()
+    assert db.written == 1
+
+def test_range_reads_one_series_group(db_path, base):
+    history = TieredHistory()
+    db = HistoryDB(db_path)
+    history.attach(db, now=base)
+    record_samples(history, base, 5)
+    db.close()
+    reader = HistoryDB(db_path)
+    rows = reader.range('b', 'GPU-x', base, base + 10)
+    assert rows == [('gpu_memory', base + 1, 0.0), ('gpu_memory_peak', base + 1, 0.0),
+                    ('gpu_memory', base + 6, 3.0), ('gpu_memory_peak', base + 6, 5.0)]
+    reader.close()
@@ -0,0 +1,145 @@
+"""内存中的历史数据（HistoryStore / RollupStore / TieredHistory）的时间桶对齐、环形复用和汇总测试"""
+
+from gpu_monitor_history import HistoryStore, RollupStore, TieredHistory
+
+def write(store, server_name, timestamp, value, series='gpu_memory', key='GPU-x'):
+    slot = store.slot(server_name, timestamp)
+    if slot is not None:
+        store.record(server_name, slot, series, key, value)
+    return slot
+
+def test_slot_is_bucket_modulo_capacity():
+    store = HistoryStore(capacity=4, interval=5)
+    assert store.bucket(1003) == 200
+    assert write(store, 'a', 1003, 1.0) == 200 % 4
+    # 同一时间桶内的多个样本以最后一个为准
+    assert write(store, 'a', 1004.9, 2.0) == 0
+    assert write(store, 'a', 1005, 3.0) == 1
+    assert store.overlay() == (200, 2, {'a': {('gpu_memory', 'GPU-x'): [2.0, 3.0]}})
+
+def test_missing_buckets_and_values_are_none():
+    store = HistoryStore(capacity=4, interval=5)
+    write(store, 'a', 1000, 1.0)
+    write(store, 'a', 1015, None)
+    assert store.overlay() == (200, 4, {'a': {('gpu_memory', 'GPU-x'): [1.0, None, None, None]}})
+
+def test_ring_reuse_clears_old_values():
+    store = HistoryStore(capacity=4, interval=5)
+    write(store, 'a', 1000, 1.0)
+    write(store, 'a', 1000, 7.0, series='gpu_memory_peak')
+    # 一整圈之后的桶复用同一位置，该位置其他列的旧值被清空
+    assert write(store, 'a', 1020, 2.0) == write(store, 'a', 1020, 2.0) == 0
+    start, count, aligned = store.overlay()
+    assert (start, count) == (201, 4)
+    assert aligned['a'][('gpu_memory', 'GPU-x')] == [None, None, None, 2.0]
+    assert aligned['a'][('gpu_memory_peak', 'GPU-x')] == [None, None, None, None]
+    # 已滚出保留范围的样本不再写入
+    assert write(store, 'a', 1000, 3.0) is None
+
+def test_overlay_aligns_servers_and_window():
+    store = HistoryStore(capacity=8, interval=5)
+    for i in range(4):
+        write(store, 'a', 1000 + i * 5, float(i))
+    write(store, 'b', 1010, 10.0)
+    write(store, 'b', 1025, 11.0)
+    start, count, aligned = store.overlay()
+    assert (start, count) == (200, 6)
+    assert aligned['a'][('gpu_memory', 'GPU-x')] == [0.0, 1.0, 2.0, 3.0, None, None]
+    assert aligned['b'][('gpu_memory', 'GPU-x')] == [None, None, 10.0, None, None, 11.0]
+    start, count, aligned = store.overlay(1005, 1014)
+    assert (start, count) == (201, 2)
+    assert aligned['b'][('gpu_memory', 'GPU-x')] == [None, 10.0]
+
+def test_stale_server_is_evicted():
+    store = HistoryStore(capacity=4, interval=5)
+    write(store, 'a', 1000, 1.0)
+    store.label('a', 'GPU-x', 0)
+    write(store, 'b', 1015, 1.0)
+    assert set(store.columns) == {'a', 'b'}
+    # 其他服务器的最新桶号超出 a 的最新桶号一整圈，a 连同它的列一起删除
+    write(store, 'b', 1020, 1.0)
+    assert set(store.columns) == set(store.buckets) == set(store.labels) == {'b'}
+    assert store.nbytes() == 2 * 4 * 8
+
+def test_rollup_mean_and_peak():
+    store = RollupStore(capacity=4, interval=60)
+    for timestamp, value in [(600, 10.0), (610, None), (620, 21.0), (659, 5.0), (660, 1.0)]:
+        write(store, 'a', timestamp, value)
+        write(store, 'a', timestamp, value, series='gpu_memory_peak')
+    _, _, aligned = store.overlay()
+    # 缺失值不计入汇总；普通序列取均值（一位小数），*_peak 序列取最大值
+    assert aligned['a'][('gpu_memory', 'GPU-x')] == [12.0, 1.0]
+    assert aligned['a'][('gpu_memory_peak', 'GPU-x')] == [21.0, 1.0]
+    counts, totals, lows, highs = store.columns['a'][('gpu_memory', 'GPU-x')]
+    assert (counts[10 % 4], totals[10 % 4], lows[10 % 4], highs[10 % 4]) == (3, 36.0, 5.0, 21.0)
+
+def test_rollup_merge():
+    store = RollupStore(capacity=4, interval=60)
+    write(store, 'a', 600, 10.0)
+    store.merge('a', 10 % 4, 'gpu_memory', 'GPU-x', 2, 50.0, 5.0, 45.0)
+    store.merge_many('a', 'gpu_memory', 'GPU-x', [(1, 10, 1, 2.0, 2.0, 2.0), (1, 11, 2, 8.0, 3.0, 5.0)])
+    counts, totals, lows, highs = store.columns['a'][('gpu_memory', 'GPU-x')]
+    assert (counts[2], totals[2], lows[2], highs[2]) == (4, 62.0, 2.0, 45.0)
+    assert (counts[3], totals[3], lows[3], highs[3]) == (2, 8.0, 3.0, 5.0)
+    assert store.overlay()[2]['a'][('gpu_memory', 'GPU-x')] == [15.5, 4.0]
+
+def test_tiered_history_records_every_tier():
+    history = TieredHistory(interval=5, capacity=12, rollups=[(60, 4), (300, 4)])
+    for i in range(24):
+        point = history.slot('a', 1200 + i * 5)
+        history.record('a', point, 'gpu_memory', 'GPU-x', float(i))
+    raw, minute, five = history.tiers
+    assert raw.overlay()[1:] == (12, {'a': {('gpu_memory', 'GPU-x'): [float(i) for i in range(12, 24)]}})
+    assert minute.overlay()[2]['a'][('gpu_memory', 'GPU-x')] == [5.5, 17.5]
+    assert five.overlay()[2]['a'][('gpu_memory', 'GPU-x')] == [11.5]
+    assert history.retention == 4 * 300
+    # 原始级别已滚出、汇总级别仍在保留范围内的样本只写入汇总级别
+    _, slots = history.slot('a', 1200)
+    assert slots[0] is None and slots[1:] == [0, 0]
+    assert history.slot('a', 1200 - 4 * 300) is None
+
+def test_select_picks_coarsest_tier_with_enough_points():
+    history = TieredHistory(interval=5, capacity=12, rollups=[(60, 4), (300, 4)])
+    raw, minute, five = history.tiers
+    assert history.select(0, 60, 10) is raw
+    assert history.select(0, 60, 1) is minute
+    # 1分钟一级只保留240秒，600秒的范围即使点数不够也用5分钟一级
+    assert history.select(0, 600, 10) is five
+    # 没有级别能覆盖时用保留最久的一级
+    assert history.select(0, 3000, 10) is five
+
+def test_select_respects_retention_of_default_tiers():
+    history = TieredHistory()
+    raw, minute, quarter, hour = history.tiers
+    end = 1700000000
+    # 1天的范围: 1分钟一级只保留12小时，15分钟一级的96个点覆盖整天
+    assert history.select(end - 86400, end, 100) is quarter
+    assert history.select(end - 3600, end, 100) is raw
+    assert history.select(end - 6 * 3600, end, 100) is minute
+    assert history.select(end - 7 * 86400, end, 100) is hour
+    # 覆盖范围以最新数据为准：已有更新的数据时，更早的窗口可能超出该级的保留范围
+    point = history.slot('a', end + 12 * 3600)
+    history.record('a', point, 'gpu_memory', 'GPU-x', 1.0)
+    assert history.select(end - 3600, end, 10) is quarter
+
+def test_overlay_step_merges_buckets():
+    store = HistoryStore(capacity=12, interval=5)
+    for i, value in enumerate([1.0, 3.0, None, 8.0, 2.0, None, None]):
+        write(store, 'a', 1000 + i * 5, value)
+        write(store, 'a', 1000 + i * 5, value, series='gpu_memory_peak')
+    assert store.step(1000, 1034, 3) == 3
+    start, count, aligned = store.overlay(1000, 1034, 3)
+    assert (start, count) == (200, 3)
+    assert aligned['a'][('gpu_memory', 'GPU-x')] == [2.0, 5.0, None]
+    assert aligned['a'][('gpu_memory_peak', 'GPU-x')] == [3.0, 8.0, None]
+
+def test_rollup_step_is_weighted_by_count():
+    store = RollupStore(capacity=4, interval=60)
+    for timestamp, value in [(600, 10.0), (610, 20.0), (620, 30.0), (660, 4.0), (720, 7.0)]:
+        write(store, 'a', timestamp, value)
+        write(store, 'a', timestamp, value, series='gpu_memory_peak')
+    _, count, aligned = store.overlay(600, 779, 2)
+    assert count == 2
+    # (10+20+30+4)/4，而不是两个桶均值的均值
+    assert aligned['a'][('gpu_memory', 'GPU-x')] == [16.0, 7.0]
+    assert aligned['a'][('gpu_memory_peak', 'GPU-x')] == [30.0, 7.0]
@@ -0,0 +1,55 @@
+"""主机指标（HostMetrics）测试，用临时目录模拟 /proc"""
+
+import pytest
+
+from gpu_monitor_client import MIB, HostMetrics
+
+NET_HEADER = ('Inter-|   Receive                                                |  Transmit\n'
+              ' face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets\n')
+
+def write_proc(root, cpu, rx, tx, sectors_read, sectors_written):
+    (root / 'stat').write_text(f"cpu  {' '.join(map(str, cpu))}\ncpu0 1 1 1 1\nbtime 1700000000\n")
+    (root / 'meminfo').write_text('MemTotal:       16384000 kB\nMemFree:  1 kB\nMemAvailable:    4096000 kB\n')
+    (root / 'loadavg').write_text('1.50 0.75 0.25 2/300 12345\n')
+    (root / 'net').mkdir(exist_ok=True)
+    zeros = ' '.join(['0'] * 7)
+    (root / 'net' / 'dev').write_text(
+        NET_HEADER + f"    lo: 999999 {zeros} 999999 {zeros}\n  eth0: {rx} {zeros} {tx} {zeros}\n")
+    (root / 'diskstats').write_text(
+        f"   8       0 sda 1 0 {sectors_read} 0 1 0 {sectors_written} 0 0 0 0\n"
+        f"   8       1 sda1 1 0 {sectors_read} 0 1 0 {sectors_written} 0 0 0 0\n"
+        f"   7       0 loop0 1 0 5000 0 1 0 5000 0 0 0 0\n")
+
+@pytest.fixture
+def metrics(tmp_path):
+    write_proc(tmp_path, [100, 0, 100, 700, 100, 0, 0, 0], 0, 0, 0, 0)
+    metrics = HostMetrics(str(tmp_path))
+    metrics._disks = {'sda', 'loop0'}  # 测试机的 /sys/block 与模拟的 /proc 无关
+    yield tmp_path, metrics
+    metrics.close()
+
+def test_first_read_has_no_rates(metrics):
+    _, metrics = metrics
+    host = metrics.read()
+    assert (host['mem_total'], host['mem_used'], host['mem_percent']) == (16000, 12000, 75.0)
+    assert (host['load1'], host['load5'], host['load15']) == (1.5, 0.75, 0.25)
+    assert host['cpu_percent'] is None and host['net_rx'] is None and host['disk_write'] is None
+
+def test_rates_from_counter_deltas(metrics):
+    root, metrics = metrics
+    metrics.read()
+    # 打开的文件不会重新打开，改写内容后 seek(0) 读到新值
+    write_proc(root, [400, 0, 200, 1000, 400, 0, 0, 0], 4 * MIB, 2 * MIB, 8192, 4096)
+    metrics._previous['time'] -= 2
+    host = metrics.read()
+    # 区间内 total=1000，idle=300+300（含iowait），iowait=300
+    assert (host['cpu_percent'], host['iowait_percent']) == (40.0, 30.0)
+    # lo、分区和 loop 设备不计入
+    assert host['net_rx'] == pytest.approx(2.0, rel=0.01)
+    assert host['net_tx'] == pytest.approx(1.0, rel=0.01)
+    assert host['disk_read'] == pytest.approx(2.0, rel=0.01)
+    assert host['disk_write'] == pytest.approx(1.0, rel=0.01)
+
+def test_missing_proc_is_disabled(tmp_path):
+    metrics = HostMetrics(str(tmp_path / 'missing'))
+    assert not metrics.enabled and metrics.read() is None
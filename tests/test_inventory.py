@@ -0,0 +1,106 @@
+"""GPU静态清单测试：客户端注册一次后只发送动态字段，服务端按清单补全；服务端重启后重新注册"""
+
+import pytest
+from flask import Flask
+
+from gpu_monitor_client import StaticInventory, send_data_to_server
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import REGISTER_PATH, InventoryStore, UnknownInventory, inventory_id
+
+class Response:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self._json = response.get_json()
+
+    def json(self):
+        return self._json
+
+class Link:
+    """把 ServerLink 的请求转给 Flask 测试客户端，并记录请求"""
+
+    server_url = 'http://test'
+    legacy = False
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+
+    def post(self, path, data=None, headers=None, json=None):
+        self.requests.append((path, json))
+        return Response(self.client.post(path, data=data, headers=headers, json=json))
+
+    def retry_in(self):
+        return 0
+
+    def mark_success(self):
+        pass
+
+    def mark_failure(self, reconnect=False):
+        pass
+
+def server():
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    return state, app.test_client()
+
+def payload(utilization=10, memory_total=81920):
+    return {'schema': 2, 'server_name': 'a', 'timestamp': '2024-10-18 12:00:00', 'gpus': [
+        {'index': 0, 'uuid': 'GPU-aaa', 'name': 'A100', 'memory_total': memory_total, 'power_limit': 400,
+         'utilization': utilization, 'memory_used': 100, 'processes': []}]}
+
+def test_register_once_and_send_dynamic_fields():
+    state, client = server()
+    link = Link(client)
+    inventory = StaticInventory()
+    assert send_data_to_server(link, payload(10), inventory=inventory)
+    assert send_data_to_server(link, payload(20), inventory=inventory)
+    assert [path for path, _ in link.requests] == [REGISTER_PATH, '/api/update', '/api/update']
+    sent = link.requests[-1][1]
+    assert sent['inventory_id'] == inventory.inventory_id
+    assert 'name' not in sent['gpus'][0] and sent['gpus'][0]['uuid'] == 'GPU-aaa'
+    # 服务端保存的样本带完整的静态字段
+    stored = state.gpu_data.get('a')['gpus'][0]
+    assert (stored['name'], stored['memory_total'], stored['utilization']) == ('A100', 81920, 20)
+    # 静态属性变化时重新注册
+    assert send_data_to_server(link, payload(20, memory_total=40960), inventory=inventory)
+    assert link.requests[-2][0] == REGISTER_PATH
+    assert state.gpu_data.get('a')['gpus'][0]['memory_total'] == 40960
+
+def test_reregister_after_server_restart():
+    _, client = server()
+    link = Link(client)
+    inventory = StaticInventory()
+    assert send_data_to_server(link, payload(), inventory=inventory)
+    # 新的服务端不认识之前的清单ID，返回 409 need_register 后重新注册并重发
+    state, link.client = server()
+    assert send_data_to_server(link, payload(30), inventory=inventory)
+    assert [path for path, _ in link.requests[-3:]] == ['/api/update', REGISTER_PATH, '/api/update']
+    assert state.gpu_data.get('a')['gpus'][0]['name'] == 'A100'
+
+def test_old_server_without_register_gets_full_samples():
+    app = Flask(__name__)
+    app.add_url_rule('/api/update', 'update', lambda: ({'status': 'success'}, 200), methods=['POST'])
+    link = Link(app.test_client())
+    inventory = StaticInventory()
+    assert send_data_to_server(link, payload(), inventory=inventory)
+    assert not inventory.supported
+    assert send_data_to_server(link, payload(), inventory=inventory)
+    assert [path for path, _ in link.requests] == [REGISTER_PATH, '/api/update', '/api/update']
+    assert link.requests[-1][1]['gpus'][0]['name'] == 'A100'
+
+def test_store_keeps_latest_inventory_per_server():
+    store = InventoryStore()
+    gpus = [{'uuid': 'GPU-aaa', 'name': 'A100', 'memory_total': 81920}]
+    first = store.register('a', gpus)
+    assert first == inventory_id('a', gpus) == store.register('a', gpus)
+    second = store.register('a', [dict(gpus[0], memory_total=40960)])
+    assert store.get(first) is None and store.get(second)['gpus']['GPU-aaa']['memory_total'] == 40960
+    expanded = store.expand({'server_name': 'a', 'inventory_id': second, 'gpus': [{'uuid': 'GPU-aaa', 'utilization': 5}]})
+    assert expanded['gpus'][0]['name'] == 'A100'
+    sample = {'server_name': 'a'}
+    assert store.expand(sample) is sample
+    with pytest.raises(UnknownInventory):
+        store.expand({'server_name': 'b', 'inventory_id': second, 'gpus': []})
+    with pytest.raises(UnknownInventory):
+        store.expand({'server_name': 'a', 'inventory_id': second, 'gpus': [{'uuid': 'GPU-zzz'}]})
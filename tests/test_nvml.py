@@ -0,0 +1,48 @@
+"""NVML采集器（NvmlCollector）测试，用 gpu_monitor_nvml_mock 代替 libnvidia-ml"""
+
+import gpu_monitor_client
+from gpu_monitor_client import NVML_VALUE_NOT_AVAILABLE, NvmlCollector, SmiXmlCollector, create_collector
+from gpu_monitor_nvml_mock import DEFAULT_DEVICES, DRIVER_VERSION, MIB, MockNvml
+
+def collector_with(monkeypatch, devices):
+    lib = MockNvml(devices)
+    monkeypatch.setattr(gpu_monitor_client, 'load_nvml', lambda lib_path=None: lib)
+    return NvmlCollector(), lib
+
+def test_collect_from_mock():
+    collector = NvmlCollector('mock')
+    try:
+        busy, idle = collector.collect()
+    finally:
+        collector.close()
+    assert (busy['index'], busy['uuid'], busy['pci_bus_id']) == (0, DEFAULT_DEVICES[0]['uuid'], '00000000:01:00.0')
+    assert busy['driver_version'] == DRIVER_VERSION
+    assert (busy['memory_used'], busy['memory_total'], busy['memory_percent']) == (1024, 24576, 4.2)
+    assert (busy['temperature'], busy['power_draw'], busy['power_limit']) == (45, 230.0, 350.0)
+    assert 50 <= busy['utilization'] < 100
+    assert busy['processes'] == [{'pid': 4242, 'name': 'python train.py', 'memory': 900}]
+    assert (idle['utilization'], idle['processes']) == (0, [])
+
+def test_process_buffer_grows_and_names_are_cached(monkeypatch):
+    device = dict(DEFAULT_DEVICES[1], processes=[(1000 + i, f'job{i}', i * MIB) for i in range(100)])
+    device['processes'][0] = (1000, 'job0', NVML_VALUE_NOT_AVAILABLE)
+    collector, lib = collector_with(monkeypatch, [device])
+    try:
+        (gpu,) = collector.collect()
+        assert len(gpu['processes']) == 100
+        assert gpu['processes'][0] == {'pid': 1000, 'name': 'job0', 'memory': None}
+        assert gpu['processes'][99] == {'pid': 1099, 'name': 'job99', 'memory': 99}
+        # 进程名称按 pid 缓存，进程退出后清理
+        lib.devices[0]['processes'] = [(1099, 'renamed', 0)]
+        (gpu,) = collector.collect()
+        assert gpu['processes'][0]['name'] == 'job99'
+        assert set(collector._process_names) == {1099}
+    finally:
+        collector.close()
+    assert not lib.initialized
+
+def test_missing_library_falls_back_to_smi(capsys):
+    collector = create_collector('auto', 1, nvml_lib='/nonexistent/libnvidia-ml.so.1')
+    assert isinstance(collector, SmiXmlCollector)
+    assert '回退到 nvidia-smi 采集' in capsys.readouterr().out
+    collector.close()
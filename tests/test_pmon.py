@@ -0,0 +1,67 @@
+"""进程使用率（PmonMonitor）的解析、合并测试，以及合并结果不会改到之前样本的回归测试"""
+
+import time
+from types import SimpleNamespace
+
+from gpu_monitor_client import DeltaEncoder, PmonMonitor, SmiStreamCollector
+
+def read_lines(monitor, lines):
+    proc = SimpleNamespace(stdout=iter(lines))
+    monitor._proc = proc
+    monitor._read_stream(proc)
+    return {key: usage[:2] for key, usage in monitor._usage.items()}
+
+def test_columns_follow_header():
+    old = [
+        '# gpu        pid  type    sm   mem   enc   dec   command\n',
+        '# Idx          #   C/G     %     %     %     %   name\n',
+        '    0       1234     C    50    12     -     -   python\n',
+        '    1          -     -     -     -     -     -   -\n',
+    ]
+    assert read_lines(PmonMonitor(), old) == {(0, 1234): (50.0, 12.0)}
+    # 新版驱动多出 jpg/ofa 列，按表头定位 sm/mem；没有活动的进程输出 '-'，记为 0
+    new = [
+        '# gpu         pid   type     sm    mem    enc    dec    jpg    ofa    command\n',
+        '# Idx           #    C/G      %      %      %      %      %      %    name\n',
+        '    0       1234     C     35     20      -      -      -      -    python\n',
+        '    0       1235     C      -      -      -      -      -      -    python\n',
+    ]
+    assert read_lines(PmonMonitor(), new) == {(0, 1234): (35.0, 20.0), (0, 1235): (0.0, 0.0)}
+
+def test_merge_from_running_pmon(fake_smi, monkeypatch):
+    monkeypatch.setenv('FAKE_SMI_PMON_SM', '77')
+    monitor = PmonMonitor(fake_smi)
+    try:
+        gpus = [{'index': 0, 'processes': [{'pid': 1234}, {'pid': 1235}, {'pid': 9}]},
+                {'index': 1, 'processes': []}]
+        monitor.merge(gpus)  # 第一次调用启动子进程
+        deadline = time.monotonic() + 5
+        while not monitor._usage and time.monotonic() < deadline:
+            time.sleep(0.05)
+        monitor.merge(gpus)
+        assert gpus[0]['processes'] == [{'pid': 1234, 'sm_util': 77.0, 'mem_util': 20.0},
+                                        {'pid': 1235, 'sm_util': 0.0, 'mem_util': 0.0}, {'pid': 9}]
+        assert monitor.restarts == 0
+    finally:
+        monitor.close()
+
+def test_stream_samples_do_not_share_process_dicts(fake_smi, monkeypatch):
+    # 显存不变时进程列表不会重新查询，同一份进程信息被多个样本使用
+    monkeypatch.setenv('FAKE_SMI_STEADY', '1')
+    collector = SmiStreamCollector(0.05, nvidia_smi=fake_smi)
+    encoder = DeltaEncoder()
+    try:
+        first = collector.collect()
+        first[0]['processes'][0]['sm_util'] = 10  # 与 PmonMonitor.merge() 一样原地写入
+        wire = encoder.encode({'server_name': 'a', 'gpus': first})
+        encoder.ack(wire, first)
+        time.sleep(0.1)
+        second = collector.collect()
+        assert second[0]['processes'][0] == {'pid': 1234, 'name': 'python train.py', 'memory': 500}
+        second[0]['processes'][0]['sm_util'] = 90
+        assert first[0]['processes'][0]['sm_util'] == 10
+        # 已确认的基准没有被改动，使用率的变化会出现在增量中
+        delta = encoder.encode({'server_name': 'a', 'gpus': second})
+        assert delta['changes']['0']['process_changes']['changed'] == {'1234': {'sm_util': 90}}
+    finally:
+        collector.close()
@@ -0,0 +1,78 @@
+"""进程启动/结束事件测试：增量样本和补传的完整样本在服务端产生事件，/api/process_events 按服务器过滤和缓存"""
+
+import json
+
+from flask import Flask
+
+from gpu_monitor_client import DeltaEncoder
+from gpu_monitor_ingest import MonitorState, create_blueprint
+from gpu_monitor_protocol import BATCH_PATH, ProcessEventLog, ProcessHistory, build_batch_body, process_table_events
+
+def server():
+    app = Flask(__name__)
+    state = MonitorState()
+    app.register_blueprint(create_blueprint(state))
+    return state, app.test_client()
+
+def gpus(*pids):
+    return [{'index': 0, 'uuid': 'GPU-0', 'utilization': 10,
+             'processes': [{'pid': pid, 'name': f'job{pid}', 'memory': 100} for pid in pids]}]
+
+def send(client, encoder, server_name, timestamp, sample_gpus):
+    payload = {'schema': 2, 'server_name': server_name, 'timestamp': timestamp, 'gpus': sample_gpus}
+    wire = encoder.encode(payload)
+    response = client.post('/api/update', json=wire)
+    assert response.status_code == 200
+    encoder.ack(wire, sample_gpus)
+    return wire
+
+def test_delta_samples_record_events():
+    state, client = server()
+    encoder = DeltaEncoder()
+    send(client, encoder, 'a', '2024-10-18 12:00:00', gpus(1, 2))
+    wire = send(client, encoder, 'a', '2024-10-18 12:00:05', gpus(2, 3))
+    assert 'gpus' not in wire  # 只发送了进程表的变化
+    send(client, DeltaEncoder(), 'b', '2024-10-18 12:00:05', gpus(9))
+    events = client.get('/api/process_events?server=a').get_json()
+    assert [(event['event'], event['pid'], event['timestamp']) for event in events] == [
+        ('end', 1, '2024-10-18 12:00:05'), ('start', 3, '2024-10-18 12:00:05')]
+    assert events[1]['name'] == 'job3' and events[1]['uuid'] == 'GPU-0'
+    # 服务端还原的完整进程表
+    assert [p['pid'] for p in state.gpu_data.get('a')['gpus'][0]['processes']] == [2, 3]
+    # 关键帧不产生事件；未知服务器的过滤结果为空（不进入响应缓存）
+    assert client.get('/api/process_events').get_json() == events
+    assert client.get('/api/process_events?server=zzz').get_json() == []
+
+def test_batch_samples_record_events():
+    state, client = server()
+    samples = [json.dumps({'timestamp': f'2024-10-18 12:00:0{i}', 'gpus': gpus(*pids)}).encode()
+               for i, pids in enumerate([(1,), (1, 2), (2,)])]
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    assert client.post(BATCH_PATH, data=build_batch_body('a', samples), headers=headers).status_code == 200
+    assert [(event['event'], event['pid']) for event in state.process_events.snapshot('a')] == [
+        ('start', 2), ('end', 1)]
+
+def test_table_events_match_by_uuid():
+    before = [{'index': 0, 'uuid': 'GPU-0', 'processes': [{'pid': 1}]}]
+    # 同一进程换了序号（例如 CUDA_VISIBLE_DEVICES 变化导致顺序不同）不算启动/结束
+    after = [{'index': 1, 'uuid': 'GPU-0', 'processes': [{'pid': '1'}]}]
+    assert process_table_events(before, after) == []
+    assert [event['event'] for event in process_table_events(before, [])] == ['end']
+
+def test_event_log_is_bounded():
+    log = ProcessEventLog(size=3)
+    log.record('a', [])
+    for pid in range(5):
+        log.record('a', [{'event': 'start', 'pid': pid}], '2024-10-18 12:00:00')
+    assert [event['pid'] for event in log.snapshot()] == [2, 3, 4]
+
+def test_process_history_aligns_timestamps():
+    history = ProcessHistory(size=2)
+    history.record('a', [{'index': 0, 'processes': [{'pid': 1, 'name': 'x', 'sm_util': 10, 'memory': 5}]}], 't1')
+    history.record('a', [{'index': 0, 'processes': [{'pid': 2, 'name': 'y', 'sm_util': 20, 'memory': 6}]}], 't2')
+    history.record('a', [{'index': 0, 'processes': [{'pid': 2, 'name': 'y', 'sm_util': 30, 'memory': 7}]}], 't3')
+    snapshot = history.snapshot()['a']
+    assert snapshot['timestamps'] == ['t1', 't2', 't3']
+    assert snapshot['processes']['0:1']['sm_util'] == [10, None, None]
+    # 每个进程只保留最近 size 个点
+    assert snapshot['processes']['0:2']['memory'] == [None, 6, 7]
@@ -0,0 +1,65 @@
+"""进程信息补充（ProcessInfoCache）测试，用临时目录模拟 /proc"""
+
+import os
+import pwd
+from datetime import datetime
+
+from gpu_monitor_client import ProcessInfoCache
+
+CONTAINER = 'a' * 12 + 'b' * 52
+
+def make_process(root, pid, start_ticks, cmdline, cgroup='0::/user.slice\n'):
+    path = root / str(pid)
+    path.mkdir(exist_ok=True)
+    # 进程名带空格和括号，字段从最后一个 ')' 之后开始数
+    fields = ['S'] + ['0'] * 18 + [str(start_ticks)] + ['0'] * 5
+    (path / 'stat').write_text(f"{pid} (python (x) y) {' '.join(fields)}\n")
+    (path / 'cmdline').write_bytes(cmdline.replace(' ', '\0').encode() + b'\0')
+    (path / 'cgroup').write_text(cgroup)
+
+def proc_root(tmp_path):
+    (tmp_path / 'stat').write_text('cpu  1 2 3\nbtime 1700000000\n')
+    return tmp_path
+
+def gpus(*pids):
+    return [{'index': 0, 'processes': [{'pid': pid} for pid in pids]},
+            {'index': 1, 'processes': [{'pid': pids[0]}, {'pid': 'N/A'}]}]
+
+def test_enrich_reads_proc_once_per_process(tmp_path):
+    root = proc_root(tmp_path)
+    make_process(root, 100, 250, 'python train.py --lr 0.1',
+                 f'0::/system.slice/docker-{CONTAINER}.scope\n')
+    cache = ProcessInfoCache(str(root))
+    ticks = cache._clock_ticks
+    result = cache.enrich(gpus(100, 200))
+    first = result[0]['processes'][0]
+    assert first['cmdline'] == 'python train.py --lr 0.1'
+    assert first['container'] == CONTAINER[:12]
+    assert first['user'] == pwd.getpwuid(os.stat(root / '100').st_uid).pw_name
+    assert first['started'] == datetime.fromtimestamp(1700000000 + 250 / ticks).strftime('%Y-%m-%d %H:%M:%S')
+    # 同一进程在多块GPU上得到相同的信息；已退出的进程和无效 pid 保持不变
+    assert result[1]['processes'][0] == first
+    assert result[0]['processes'][1] == {'pid': 200}
+    assert result[1]['processes'][1] == {'pid': 'N/A'}
+
+def test_cache_follows_pid_reuse_and_exit(tmp_path):
+    root = proc_root(tmp_path)
+    make_process(root, 100, 250, 'python a.py')
+    cache = ProcessInfoCache(str(root))
+    cache.enrich(gpus(100))
+    # 启动时间不变时使用缓存，不再读取命令行
+    make_process(root, 100, 250, 'python changed.py')
+    assert cache.enrich(gpus(100))[0]['processes'][0]['cmdline'] == 'python a.py'
+    # pid 被新进程复用（启动时间不同），重新读取
+    make_process(root, 100, 900, 'python b.py')
+    assert cache.enrich(gpus(100))[0]['processes'][0]['cmdline'] == 'python b.py'
+    assert list(cache._cache) == [(100, 900)]
+    # 本次没有出现的进程从缓存中移除
+    make_process(root, 300, 10, 'bash')
+    cache.enrich(gpus(300))
+    assert list(cache._cache) == [(300, 10)]
+
+def test_missing_proc_root_is_disabled(tmp_path):
+    cache = ProcessInfoCache(str(tmp_path / 'missing'))
+    assert not cache.enabled
+    assert cache.enrich(gpus(1)) == gpus(1)
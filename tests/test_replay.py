@@ -0,0 +1,73 @@
+"""记录/回放测试：--record 记下的原始输出经 ReplayCollector 回放，得到与实时采集相同的结果"""
+
+import json
+import time
+
+from gpu_monitor_client import CollectorRecorder, NvmlCollector, ReplayCollector, SmiStreamCollector, SmiXmlCollector
+
+def record(collector, path, rounds=1, pause=0.0):
+    collector.recorder = CollectorRecorder(str(path))
+    results = []
+    try:
+        for _ in range(rounds):
+            results.append(collector.collect())
+            time.sleep(pause)
+    finally:
+        collector.close()
+        collector.recorder.close()
+    return results
+
+def replay_all(path, speed=1000.0):
+    collector = ReplayCollector(str(path), speed=speed)
+    results = []
+    try:
+        while True:
+            gpus = collector.collect()
+            if collector.finished:
+                return collector, results
+            results.append(gpus)
+    finally:
+        collector.close()
+
+def test_xml_round_trip(fake_smi, tmp_path):
+    path = tmp_path / 'xml.jsonl'
+    (live,) = record(SmiXmlCollector(fake_smi), path)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line['kind'] for line in lines] == ['xml']
+    collector, replayed = replay_all(path)
+    assert replayed == [live]
+    assert collector.replayed == 1 and collector.parse_seconds > 0
+
+def test_stream_round_trip(fake_smi, tmp_path):
+    path = tmp_path / 'stream.jsonl'
+    live = record(SmiStreamCollector(0.05, nvidia_smi=fake_smi), path, rounds=3, pause=0.06)
+    kinds = {json.loads(line)['kind'] for line in path.read_text().splitlines()}
+    assert kinds == {'csv', 'apps'}
+    _, replayed = replay_all(path, speed=1e9)
+    # 全速回放时所有记录在一次 collect() 中解析完，得到最后记录的一帧；
+    # 后台读取的帧比 collect() 取走的多，最后一帧不早于实时采集的最后一次结果
+    last, live_last = replayed[-1], live[-1]
+    assert [sorted(gpu) for gpu in last] == [sorted(gpu) for gpu in live_last]
+    assert [gpu['processes'] for gpu in last] == [gpu['processes'] for gpu in live_last]
+    assert last[0]['memory_used'] >= live_last[0]['memory_used']
+    assert last[1] == live_last[1]
+
+def test_nvml_round_trip(tmp_path):
+    path = tmp_path / 'nvml.jsonl'
+    (live,) = record(NvmlCollector('mock'), path)
+    assert replay_all(path)[1] == [live]
+
+def test_replay_follows_recorded_time_and_skips_bad_lines(tmp_path, capsys):
+    path = tmp_path / 'timed.jsonl'
+    frames = [[{'index': 0, 'uuid': 'GPU-aaa', 'utilization': i, 'processes': []}] for i in range(3)]
+    lines = [json.dumps({'t': 100 + i, 'kind': 'nvml', 'data': json.dumps(frame)}) for i, frame in enumerate(frames)]
+    lines.insert(1, json.dumps({'t': 100.5, 'kind': 'nvml', 'data': '{broken'}))
+    path.write_text('\n'.join(lines) + '\n{"t": 103, "kind": "nv')  # 最后一行在记录时被中断
+    started = time.monotonic()
+    collector, replayed = replay_all(path, speed=20)
+    # 记录跨度 2 秒，20 倍速约 0.1 秒
+    assert 0.09 <= time.monotonic() - started < 1
+    # 无法解析的记录不改变当前帧
+    assert [gpus[0]['utilization'] for gpus in replayed] == [0, 0, 1, 2]
+    assert collector.replayed == 3
+    assert '跳过无法解析的记录' in capsys.readouterr().out
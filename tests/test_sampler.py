@@ -0,0 +1,56 @@
+"""采集线程（Sampler）的节拍推进测试，以及某个节拍出错后线程继续运行的回归测试"""
+
+import time
+
+from gpu_monitor_client import AdaptiveInterval, Sampler, next_tick
+
+class Collector:
+    def __init__(self):
+        self.calls = 0
+
+    def collect(self):
+        self.calls += 1
+        return [{'index': 0, 'utilization': 10, 'memory_used': 100, 'memory_total': 1000, 'processes': []}]
+
+class Target:
+    def __init__(self):
+        self.offered = []
+
+    def offer(self, payload):
+        self.offered.append(payload)
+
+class FailingOnce(AdaptiveInterval):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.failed = False
+
+    def update(self, gpus):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError('boom')
+        return super().update(gpus)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_next_tick_skips_missed_ticks():
+    assert next_tick(10, 5, 12) == 15
+    # 采集超时错过了 15、20 两个节拍，跳到 now 之后的第一个节拍，不补采
+    assert next_tick(10, 5, 23) == 25
+    assert next_tick(10, 5, 25) == 30
+
+def test_sampler_survives_tick_error(capsys):
+    target = Target()
+    sampler = Sampler(Collector(), FailingOnce(0.02, 0.02), 'a', [target])
+    sampler.start()
+    try:
+        assert wait_for(lambda: len(target.offered) >= 2)
+        assert sampler.is_alive()
+    finally:
+        sampler.stop()
+    assert not sampler.is_alive()
+    assert '采样时发生未预期的错误: boom' in capsys.readouterr().out
+    assert target.offered[0]['server_name'] == 'a'
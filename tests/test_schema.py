@@ -0,0 +1,94 @@
+"""样本格式版本（schema）测试：旧版字符串样本的转换、服务端的错误码、客户端改发旧版格式的判断，
+以及缺字段的 schema 2 样本在历史记录和页面中的处理"""
+
+import pytest
+
+import gpu_monitor_server
+import gpu_monitor_server_enhanced
+import gpu_monitor_server_geek
+from gpu_monitor_client import _negotiate_legacy
+from gpu_monitor_protocol import SCHEMA_VERSION, UnsupportedSchema, legacy_sample, normalize_sample
+
+def typed_gpu():
+    return {'index': 0, 'uuid': 'GPU-aaa', 'temperature': 61.0, 'utilization': 87.0, 'memory_used': 1234.0,
+            'memory_total': 81920.0, 'memory_percent': 1.5, 'power_draw': None, 'power_limit': 400.0,
+            'processes': [{'pid': 1234, 'name': 'python', 'memory': 500.0}]}
+
+def test_legacy_round_trip():
+    data = {'schema': SCHEMA_VERSION, 'server_name': 'a', 'gpus': [typed_gpu()]}
+    legacy = legacy_sample(data)
+    assert 'schema' not in legacy
+    gpu = legacy['gpus'][0]
+    assert (gpu['memory_used'], gpu['power_draw'], gpu['utilization']) == ('1234 MiB', 'N/A', '87')
+    assert gpu['processes'][0] == {'pid': 1234, 'name': 'python', 'memory': '500 MiB'}
+    assert normalize_sample(legacy)['gpus'] == [typed_gpu()]
+
+def test_legacy_strings_are_parsed_once():
+    data = {'gpus': [{'index': 0, 'utilization': '45', 'memory_used': '1000 MiB', 'memory_total': '4000 MiB',
+                      'power_draw': '[N/A]', 'processes': [{'pid': '7', 'memory': '10 MiB'}]}]}
+    gpu = normalize_sample(data)['gpus'][0]
+    assert (gpu['utilization'], gpu['memory_percent'], gpu['power_draw']) == (45.0, 25.0, None)
+    assert gpu['processes'] == [{'pid': 7, 'memory': 10.0}]
+    # schema 2 的样本原样使用
+    typed = {'schema': 2, 'gpus': [{'index': 0}]}
+    assert normalize_sample(typed) is typed
+
+@pytest.mark.parametrize('schema', [SCHEMA_VERSION + 1, '2'])
+def test_unsupported_schema(schema):
+    with pytest.raises(UnsupportedSchema):
+        normalize_sample({'schema': schema, 'gpus': []})
+
+def test_server_tags_errors():
+    client = gpu_monitor_server_geek.app.test_client()
+    response = client.post('/api/update', json={'schema': SCHEMA_VERSION + 1, 'server_name': 'schema-test'})
+    assert response.status_code == 400 and response.get_json()['error'] == 'unsupported_schema'
+    response = client.post('/api/update', data=b'{not json', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400 and response.get_json()['error'] == 'invalid_sample'
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        if self._body is None:
+            raise ValueError('not json')
+        return self._body
+
+class Link:
+    server_url = 'http://test'
+
+    def __init__(self):
+        self.legacy = False
+        self.posted = []
+
+    def post(self, path, json=None, headers=None):
+        self.posted.append(json)
+        return Response(200)
+
+@pytest.mark.parametrize('response, downgrade', [
+    (Response(400, {'status': 'error', 'message': 'x', 'error': 'unsupported_schema'}), True),
+    (Response(400, {'status': 'error', 'message': 'x'}), True),  # 旧版服务端的错误响应
+    (Response(400), True),
+    (Response(400, {'status': 'error', 'message': 'x', 'error': 'invalid_sample'}), False),
+    (Response(500, {'status': 'error', 'message': 'x'}), False),
+])
+def test_client_downgrades_only_for_schema_errors(response, downgrade):
+    link = Link()
+    result = _negotiate_legacy(link, response, {'schema': SCHEMA_VERSION, 'server_name': 'a', 'gpus': [typed_gpu()]})
+    assert link.legacy is downgrade
+    if downgrade:
+        assert result.status_code == 200 and 'schema' not in link.posted[0]
+    else:
+        assert result is response and link.posted == []
+
+@pytest.mark.parametrize('module', [gpu_monitor_server, gpu_monitor_server_enhanced, gpu_monitor_server_geek])
+def test_sparse_typed_gpu_is_stored_and_rendered(module):
+    client = module.app.test_client()
+    sample = {'schema': SCHEMA_VERSION, 'server_name': 'sparse-node', 'timestamp': '2024-10-18 12:00:00',
+              'gpus': [{'index': 0, 'uuid': 'GPU-sparse', 'name': 'GPU', 'processes': []}]}
+    assert client.post('/api/update', json=sample).status_code == 200
+    page = client.get('/').get_data(as_text=True)
+    assert 'sparse-node' in page
+    # 缺失的使用率和显存显示为 N/A，进度条宽度按 0 处理
+    assert 'N/A%"' not in page and 'width: 0%' in page
@@ -0,0 +1,104 @@
+"""发送失败样本的环形缓存（SampleSpool）测试：回绕、丢弃最旧样本、重启后恢复"""
+
+import os
+import random
+
+from gpu_monitor_client import SampleSpool
+
+# 1 KiB 的数据区，几十条记录就会回绕
+SMALL = 1 / 1024
+
+def payload(seq, size=100):
+    return (b'%08d' % seq) * (size // 8) + b'x' * (size % 8)
+
+def test_append_peek_discard(tmp_path):
+    spool = SampleSpool(str(tmp_path / 'spool'), SMALL)
+    for i in range(3):
+        assert spool.append(payload(i))
+    assert spool.peek(2) == [(1, payload(0)), (2, payload(1))]
+    spool.discard(2)
+    assert spool.peek(10) == [(3, payload(2))]
+    spool.discard(1)
+    assert spool.count == 0
+    # 清空后从数据区开头继续写，序号不重置
+    assert spool.append(payload(3))
+    assert (spool.head, spool.tail) == (SampleSpool.RECORD.size + 100, 0)
+    assert spool.peek(10) == [(4, payload(3))]
+    spool.close()
+
+def test_full_spool_drops_oldest(tmp_path):
+    spool = SampleSpool(str(tmp_path / 'spool'), SMALL)
+    # 每条 12 + 100 字节，1024 字节最多放下 9 条
+    for i in range(20):
+        assert spool.append(payload(i))
+    records = spool.peek(100)
+    assert [seq for seq, _ in records] == list(range(12, 21))
+    assert [body for _, body in records] == [payload(i) for i in range(11, 20)]
+    assert spool.dropped == 11
+    spool.close()
+
+def test_oversized_sample_is_rejected(tmp_path):
+    spool = SampleSpool(str(tmp_path / 'spool'), SMALL)
+    assert not spool.append(b'x' * 600)
+    assert spool.count == 0
+    spool.close()
+
+def test_reopen_recovers_records(tmp_path):
+    path = str(tmp_path / 'spool')
+    spool = SampleSpool(path, SMALL)
+    for i in range(15):
+        spool.append(payload(i, 90))
+    spool.discard(2)
+    before = (spool.peek(100), spool.head, spool.tail, spool.next_seq, spool.dropped, spool.spool_id)
+    spool.close()
+
+    spool = SampleSpool(path, SMALL)
+    assert (spool.peek(100), spool.head, spool.tail, spool.next_seq, spool.dropped, spool.spool_id) == before
+    spool.append(payload(15, 90))
+    assert spool.peek(100)[-1] == (16, payload(15, 90))
+    spool.close()
+
+def test_mismatched_file_is_rebuilt(tmp_path, capsys):
+    path = str(tmp_path / 'spool')
+    spool = SampleSpool(path, SMALL)
+    spool.append(payload(0))
+    spool.close()
+    with open(path, 'r+b') as f:
+        f.write(b'NOTSPOOL')
+    # 文件头损坏时重建为空缓存
+    spool = SampleSpool(path, 2 * SMALL)
+    assert '格式不匹配' in capsys.readouterr().out
+    assert (spool.count, spool.next_seq) == (0, 1)
+    assert os.path.getsize(path) == SampleSpool.HEADER_SIZE + 2048
+    spool.close()
+
+def test_random_wrap_against_model(tmp_path):
+    """随机长度的追加、补传和重启，缓存内容始终是最近写入且未补传的一段样本"""
+    rng = random.Random(20241018)
+    path = str(tmp_path / 'spool')
+    spool = SampleSpool(path, SMALL)
+    model = []  # 尚未补传的 (序号, 内容)，最旧的在前
+    seq = 0
+    dropped = 0
+    for _ in range(3000):
+        action = rng.random()
+        if action < 0.6:
+            seq += 1
+            body = os.urandom(rng.randrange(0, 300))
+            assert spool.append(body)
+            model.append((seq, body))
+        elif action < 0.9:
+            n = rng.randrange(0, 4)
+            spool.discard(n)
+            del model[:n]
+        else:
+            spool.close()
+            spool = SampleSpool(path, SMALL)
+        # 空间不足时只会丢弃最旧的样本
+        dropped += len(model) - spool.count
+        del model[:len(model) - spool.count]
+        assert spool.peek(len(model) + 1) == model
+        assert spool.dropped == dropped
+        assert spool.next_seq == seq + 1
+    assert dropped > 0
+    spool.close()
@@ -0,0 +1,61 @@
+"""最新状态存储（StateStore）测试：写入时复制的快照、版本号、沿用字段，以及并发读写"""
+
+import threading
+
+import pytest
+
+from gpu_monitor_protocol import StateStore
+
+def test_snapshot_is_immutable_and_stable():
+    store = StateStore()
+    store.put('a', {'gpus': [1]})
+    snapshot = store.snapshot()
+    with pytest.raises(TypeError):
+        snapshot['b'] = {}
+    store.put('b', {'gpus': [2]})
+    # 已取得的快照不受之后发布的影响
+    assert list(snapshot) == ['a']
+    assert list(store.snapshot()) == ['a', 'b']
+    assert store.get('b') == {'gpus': [2]} and store.get('c') is None
+    assert store.version == 2
+
+def test_sticky_fields():
+    store = StateStore()
+    store.put('a', {'seq': 1, 'client_stats': {'window': 5}})
+    store.put('a', {'seq': 2, 'client_stats': None}, sticky=('client_stats',))
+    assert store.get('a') == {'seq': 2, 'client_stats': {'window': 5}}
+    store.put('a', {'seq': 3, 'client_stats': {'window': 6}}, sticky=('client_stats',))
+    assert store.get('a')['client_stats'] == {'window': 6}
+    store.put('b', {'seq': 1}, sticky=('client_stats',))
+    assert store.get('b') == {'seq': 1}
+
+def test_concurrent_readers_see_complete_snapshots():
+    store = StateStore()
+    writers_done = threading.Event()
+    errors = []
+
+    def write(prefix):
+        for i in range(2000):
+            store.put(f'{prefix}{i % 50}', {'gpus': [i] * 4, 'seq': i})
+
+    def read():
+        while not writers_done.is_set():
+            try:
+                for record in store.snapshot().values():
+                    # 记录整条替换，不会读到写了一半的记录
+                    assert record['gpus'] == [record['seq']] * 4
+            except Exception as e:  # 包括迭代时字典大小变化的 RuntimeError
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writers = [threading.Thread(target=write, args=(prefix,)) for prefix in 'ab']
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writers_done.set()
+    for thread in readers:
+        thread.join()
+    assert errors == []
+    assert store.version == 4000 and len(store.snapshot()) == 100